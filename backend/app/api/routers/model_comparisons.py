@@ -7,14 +7,53 @@ from sqlalchemy.orm import Session
 
 from app.api.deps import get_db
 from app.models import ModelComparison, ModelComparisonResult
-from app.services.llm import call_llm, call_openai, evaluate_output
+from app.services.llm import early_stop_condition, generate, provider_for_model
+from app.services.cassette import check_cassette
+from app.services.residency import OLLAMA_RELEASE_AFTER_COMPARISON, model_residency
+from app.services.scoring_pool import scoring_pool
+from app.services.runner import (
+    cache_summary,
+    call_metrics,
+    estimate_comparison,
+    metrics_summary,
+)
+from app.services.model_stats import record_model_stats
+from app.services.tokens import enforce_budget
 
 
 router = APIRouter(prefix="/model-comparisons", tags=["model-comparisons"])
 
 
+def _estimate(comparison: Dict[str, Any], db: Session) -> Dict[str, Any]:
+    return estimate_comparison(
+        comparison["prompt_template"],
+        comparison["template_variables"],
+        comparison["models"],
+        comparison["regression_set"],
+        comparison.get("model_settings", {}).get("max_tokens", 1000),
+        db=db,
+    )
+
+
+@router.post("/estimate/")
+def estimate_model_comparison(comparison: Dict[str, Any], db: Session = Depends(get_db)):
+    """Predicted duration, tokens and cost of a comparison, without running it"""
+    estimate = _estimate(comparison, db)
+    if comparison.get("cost_budget") is not None:
+        estimate["within_budget"] = estimate["max_cost_usd"] <= comparison["cost_budget"]
+    return estimate
+
+
 @router.post("/")
 async def create_model_comparison(comparison: Dict[str, Any], db: Session = Depends(get_db)):
+    cassette = comparison.get("cassette")
+    cassette_mode = comparison.get("cassette_mode", "off")
+    check_cassette(cassette_mode, cassette)
+    estimate = _estimate(comparison, db)
+    # A replayed comparison makes no calls and costs nothing
+    if cassette_mode != "replay":
+        enforce_budget(estimate, comparison.get("cost_budget"))
+
     comparison_id = str(uuid.uuid4())
     db_comparison = ModelComparison(
         id=comparison_id,
@@ -29,13 +68,25 @@ async def create_model_comparison(comparison: Dict[str, Any], db: Session = Depe
     db.add(db_comparison)
     db.commit()
 
+    model_settings = comparison.get("model_settings", {})
+    cache_policy = comparison.get("cache_policy", "auto")
+    stream = comparison.get("stream", False)
+    max_output_chars = comparison.get("max_output_chars")
+    early_stop = comparison.get("early_stop", False) or max_output_chars is not None
+    expected = [
+        sample.get("expected_output", "") for sample in comparison["regression_set"]
+    ]
     results: List[Dict[str, Any]] = []
-    for model_id in comparison["models"]:
+    # Each Ollama model is loaded once and warmed before its samples are timed
+    for model_id in model_residency.order_models(comparison["models"]):
         try:
-            provider = "openai" if model_id.startswith("gpt-") else "ollama"
+            provider = provider_for_model(model_id)
+            if provider == "ollama":
+                await model_residency.warm_up(model_id)
 
-            total_score = 0.0
             total_samples = len(comparison["regression_set"])
+            calls: List[Dict[str, Any]] = []
+            outputs: List[str] = []
 
             for sample in comparison["regression_set"]:
                 prompt = comparison["prompt_template"]
@@ -43,32 +94,46 @@ async def create_model_comparison(comparison: Dict[str, Any], db: Session = Depe
                     if var in sample:
                         prompt = prompt.replace(f"{{{var}}}", str(sample[var]))
 
-                if provider == "openai":
-                    response = await call_openai(
-                        prompt,
-                        model_id,
-                        comparison.get("model_settings", {}).get("temperature", 0.7),
-                        comparison.get("model_settings", {}).get("max_tokens", 1000),
-                        comparison.get("model_settings", {}).get("top_p", 1.0),
-                        comparison.get("model_settings", {}).get("top_k"),
-                    )
-                else:
-                    response = await call_llm(
-                        prompt,
-                        provider,
-                        model_id,
-                        comparison.get("model_settings", {}).get("temperature", 0.7),
-                        comparison.get("model_settings", {}).get("max_tokens", 1000),
-                        comparison.get("model_settings", {}).get("top_p", 1.0),
-                        comparison.get("model_settings", {}).get("top_k"),
-                    )
-
-                score = evaluate_output(
-                    response, sample.get("expected_output", ""), comparison["evaluation_function"]
+                response = await generate(
+                    prompt,
+                    provider,
+                    model_id,
+                    model_settings.get("temperature", 0.7),
+                    model_settings.get("max_tokens", 1000),
+                    model_settings.get("top_p", 1.0),
+                    model_settings.get("top_k"),
+                    seed=model_settings.get("seed"),
+                    cache_policy=cache_policy,
+                    stream=stream,
+                    stop_when=(
+                        early_stop_condition(
+                            comparison["evaluation_function"],
+                            sample.get("expected_output", ""),
+                            max_output_chars,
+                        )
+                        if early_stop
+                        else None
+                    ),
+                    hedge=comparison.get("hedge"),
+                    priority="comparison",
+                    job_id=comparison_id,
+                    cassette=cassette,
+                    cassette_mode=cassette_mode,
                 )
-                total_score += score
-
+                calls.append(call_metrics(response))
+                outputs.append(response.text)
+
+            total_score = sum(
+                await scoring_pool.evaluate(
+                    outputs,
+                    expected,
+                    comparison["evaluation_function"],
+                    comparison.get("score_cutoff", 0.0),
+                )
+            )
             avg_score = total_score / total_samples if total_samples > 0 else 0.0
+            metrics = metrics_summary(calls)
+            record_model_stats(db, provider, model_id, calls)
 
             result = ModelComparisonResult(
                 id=str(uuid.uuid4()),
@@ -78,6 +143,7 @@ async def create_model_comparison(comparison: Dict[str, Any], db: Session = Depe
                 avg_score=avg_score,
                 total_samples=total_samples,
                 status="completed",
+                **metrics,
             )
             db.add(result)
             results.append(
@@ -87,6 +153,8 @@ async def create_model_comparison(comparison: Dict[str, Any], db: Session = Depe
                     "avg_score": avg_score,
                     "total_samples": total_samples,
                     "status": "completed",
+                    "cache": cache_summary(calls),
+                    **metrics,
                 }
             )
         except Exception:
@@ -109,9 +177,12 @@ async def create_model_comparison(comparison: Dict[str, Any], db: Session = Depe
                     "status": "failed",
                 }
             )
+        if provider_for_model(model_id) == "ollama" and OLLAMA_RELEASE_AFTER_COMPARISON:
+            await model_residency.release(model_id)
 
     db.commit()
-    return {"id": comparison_id, "results": results}
+    results.sort(key=lambda r: comparison["models"].index(r["model"]))
+    return {"id": comparison_id, "results": results, "estimate": estimate}
 
 
 @router.get("/")
@@ -148,6 +219,12 @@ def list_model_comparisons(db: Session = Depends(get_db)):
                         "avg_score": r.avg_score,
                         "total_samples": r.total_samples,
                         "status": r.status,
+                        "p50_latency_ms": r.p50_latency_ms,
+                        "p95_latency_ms": r.p95_latency_ms,
+                        "p50_ttft_ms": r.p50_ttft_ms,
+                        "p95_ttft_ms": r.p95_ttft_ms,
+                        "total_tokens": r.total_tokens,
+                        "total_cost_usd": r.total_cost_usd,
                     }
                     for r in results
                 ],
@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 
 from app.api.deps import get_db
 from app.models import PromptSystem
+from app.services.model_stats import MAX_TOKENS_MODES
 
 
 router = APIRouter(prefix="/prompt-systems", tags=["prompt-systems"])
@@ -22,12 +23,18 @@ class PromptSystemCreate(BaseModel):
     model: str = "gpt-3.5-turbo"
     temperature: float = 0.7
     max_tokens: int = 1000
+    max_tokens_mode: str = "fixed"
     top_p: float = 1.0
     top_k: Optional[int] = None
 
 
 @router.post("/")
 def create_prompt_system(payload: PromptSystemCreate, db: Session = Depends(get_db)):
+    if payload.max_tokens_mode not in MAX_TOKENS_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported max_tokens mode: {payload.max_tokens_mode}",
+        )
     db_prompt_system = PromptSystem(
         id=str(uuid.uuid4()),
         name=payload.name,
@@ -37,6 +44,7 @@ def create_prompt_system(payload: PromptSystemCreate, db: Session = Depends(get_
         model=payload.model,
         temperature=payload.temperature,
         max_tokens=payload.max_tokens,
+        max_tokens_mode=payload.max_tokens_mode,
         top_p=payload.top_p,
         top_k=payload.top_k,
         created_at=datetime.utcnow(),
@@ -10,8 +10,26 @@ from sqlalchemy.orm import Session, joinedload
 from app.api.deps import get_db
 from app.models import PromptSystem, TestResult, TestRun
 
-# Reuse helpers from main until they are modularized
-from app.services.llm import call_llm, evaluate_output
+from app.services.runner import (
+    CALL_METRIC_FIELDS,
+    cache_summary,
+    estimate_run,
+    metrics_summary,
+    prepare_samples,
+    rescore_test_run,
+    resolve_concurrency,
+    run_prompt_system,
+)
+from app.services.model_stats import (
+    model_history,
+    record_model_stats,
+    record_output_lengths,
+    resolve_max_tokens,
+    token_cap_summary,
+)
+from app.services.dispatch import DEFAULT_JOB_WEIGHT
+from app.services.evaluation import EVALUATION_METHODS
+from app.services.tokens import enforce_budget
 
 
 router = APIRouter(prefix="/test-runs", tags=["test-runs"])
@@ -21,6 +39,53 @@ class TestRunCreate(BaseModel):
     prompt_system_id: str
     regression_set: List[Dict[str, Any]]
     evaluation_function: str = "fuzzy"
+    concurrency: Optional[int] = None
+    cache_policy: str = "auto"
+    stream: bool = False
+    early_stop: bool = False
+    max_output_chars: Optional[int] = None
+    hedge: Optional[bool] = None
+    cost_budget: Optional[float] = None
+    cassette: Optional[str] = None
+    cassette_mode: str = "off"
+    score_cutoff: float = 0.0
+    weight: float = DEFAULT_JOB_WEIGHT
+
+
+class TestRunEvaluate(BaseModel):
+    evaluation_function: str
+    score_cutoff: float = 0.0
+
+
+def _estimate(
+    db: Session, prompt_system, samples, test_run: TestRunCreate, max_tokens: int
+):
+    return estimate_run(
+        prompt_system.provider,
+        prompt_system.model,
+        [sample["prompt"] for sample in samples],
+        max_tokens,
+        resolve_concurrency(test_run.concurrency),
+        history=model_history(db, prompt_system.provider, prompt_system.model),
+    )
+
+
+@router.post("/estimate/")
+def estimate_test_run(test_run: TestRunCreate, db: Session = Depends(get_db)):
+    """Predicted duration, tokens and cost of a test run, without running it"""
+    prompt_system = (
+        db.query(PromptSystem).filter(PromptSystem.id == test_run.prompt_system_id).first()
+    )
+    if not prompt_system:
+        raise HTTPException(status_code=404, detail="Prompt system not found")
+
+    samples = prepare_samples(prompt_system.template, test_run.regression_set)
+    max_tokens = resolve_max_tokens(db, prompt_system)
+    estimate = _estimate(db, prompt_system, samples, test_run, max_tokens)
+    estimate["max_tokens"] = max_tokens
+    if test_run.cost_budget is not None:
+        estimate["within_budget"] = estimate["max_cost_usd"] <= test_run.cost_budget
+    return estimate
 
 
 @router.post("/")
@@ -32,44 +97,31 @@ async def create_test_run(test_run: TestRunCreate, db: Session = Depends(get_db)
     if not prompt_system:
         raise HTTPException(status_code=404, detail="Prompt system not found")
 
-    # Process all samples first before creating any database records
-    results: List[Dict[str, Any]] = []
-    total_score = 0.0
-
-    for i, sample in enumerate(test_run.regression_set):
-        variables = {k: v for k, v in sample.items() if k != "expected_output"}
-        expected_output = sample.get("expected_output", "")
-
-        try:
-            prompt = prompt_system.template.format(**variables)
-        except KeyError as e:
-            raise HTTPException(status_code=400, detail=f"Missing variable in sample {i}: {e}")
-
-        predicted_output = await call_llm(
-            prompt=prompt,
-            provider=prompt_system.provider,
-            model=prompt_system.model,
-            temperature=prompt_system.temperature,
-            max_tokens=prompt_system.max_tokens,
-            top_p=prompt_system.top_p,
-            top_k=prompt_system.top_k,
-        )
-
-        score = evaluate_output(
-            predicted_output, expected_output, test_run.evaluation_function
-        )
-        total_score += score
-
-        results.append(
-            {
-                "sample_id": str(i),
-                "input_variables": variables,
-                "expected_output": expected_output,
-                "predicted_output": predicted_output,
-                "score": score,
-                "evaluation_method": test_run.evaluation_function,
-            }
-        )
+    # Render every prompt up front so a bad sample fails before any LLM spend,
+    # then fan the samples out; results come back in sample order
+    samples = prepare_samples(prompt_system.template, test_run.regression_set)
+    max_tokens = resolve_max_tokens(db, prompt_system)
+    estimate = _estimate(db, prompt_system, samples, test_run, max_tokens)
+    # A replayed run makes no calls and costs nothing
+    if test_run.cassette_mode != "replay":
+        enforce_budget(estimate, test_run.cost_budget)
+    results = await run_prompt_system(
+        prompt_system,
+        samples,
+        test_run.evaluation_function,
+        concurrency=test_run.concurrency,
+        cache_policy=test_run.cache_policy,
+        stream=test_run.stream,
+        early_stop=test_run.early_stop,
+        max_output_chars=test_run.max_output_chars,
+        hedge=test_run.hedge,
+        max_tokens=max_tokens,
+        cassette=test_run.cassette,
+        cassette_mode=test_run.cassette_mode,
+        score_cutoff=test_run.score_cutoff,
+        weight=test_run.weight,
+    )
+    total_score = sum(result["score"] for result in results)
 
     # Persist results
     test_run_id = str(uuid.uuid4())
@@ -90,6 +142,9 @@ async def create_test_run(test_run: TestRunCreate, db: Session = Depends(get_db)
             predicted_output=result["predicted_output"],
             score=result["score"],
             evaluation_method=result["evaluation_method"],
+            **{field: result[field] for field in CALL_METRIC_FIELDS},
+            max_tokens=result["max_tokens"],
+            capped=result["capped"],
         )
         db.add(db_result)
 
@@ -98,6 +153,11 @@ async def create_test_run(test_run: TestRunCreate, db: Session = Depends(get_db)
     )
     db_test_run.avg_score = avg_score
     db_test_run.total_samples = len(test_run.regression_set)
+    metrics = metrics_summary(results)
+    for field, value in metrics.items():
+        setattr(db_test_run, field, value)
+    record_model_stats(db, prompt_system.provider, prompt_system.model, results)
+    record_output_lengths(db, prompt_system.id, prompt_system.model, results)
 
     db.commit()
 
@@ -105,6 +165,10 @@ async def create_test_run(test_run: TestRunCreate, db: Session = Depends(get_db)
         "test_run_id": test_run_id,
         "avg_score": avg_score,
         "total_samples": len(test_run.regression_set),
+        "cache": cache_summary(results),
+        "metrics": metrics,
+        "estimate": estimate,
+        "token_cap": token_cap_summary(prompt_system, max_tokens, results),
         "results": results,
     }
 
@@ -124,6 +188,25 @@ def get_test_run(test_run_id: str, db: Session = Depends(get_db)):
     return {"test_run": test_run, "results": results}
 
 
+@router.post("/{test_run_id}/evaluate/")
+async def evaluate_test_run(
+    test_run_id: str, payload: TestRunEvaluate, db: Session = Depends(get_db)
+):
+    """Re-score a test run's stored outputs with an evaluation function, without
+    calling the LLM or changing the stored scores"""
+    if payload.evaluation_function not in EVALUATION_METHODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported evaluation function: {payload.evaluation_function}",
+        )
+    test_run = db.get(TestRun, test_run_id)
+    if not test_run:
+        raise HTTPException(status_code=404, detail="Test run not found")
+    return await rescore_test_run(
+        db, test_run, payload.evaluation_function, payload.score_cutoff
+    )
+
+
 @router.get("/")
 def list_test_runs(db: Session = Depends(get_db)):
     return (
@@ -7,7 +7,8 @@ from sqlalchemy.orm import Session, joinedload
 
 from app.api.deps import get_db
 from app.models import PromptSystem, TestSchedule
-from app.services.scheduler import scheduler
+from app.services.cassette import check_cassette
+from app.services.scheduler import EXECUTION_MODES, scheduler
 
 
 router = APIRouter(prefix="/test-schedules", tags=["test-schedules"])
@@ -23,6 +24,13 @@ async def create_test_schedule(
     )
     if not prompt_system:
         raise HTTPException(status_code=404, detail="Prompt system not found")
+    execution_mode = schedule.get("execution_mode", "realtime")
+    if execution_mode not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported execution mode: {execution_mode}"
+        )
+    cassette_mode = schedule.get("cassette_mode", "off")
+    check_cassette(cassette_mode, schedule.get("cassette"))
 
     # Create schedule
     schedule_id = str(uuid.uuid4())
@@ -40,6 +48,9 @@ async def create_test_schedule(
             else None
         ),
         alert_threshold=schedule.get("alert_threshold", 0.2),
+        execution_mode=execution_mode,
+        cassette_mode=cassette_mode,
+        cassette=schedule.get("cassette"),
         is_active=True,
         next_run_at=datetime.utcnow(),
     )
@@ -0,0 +1,29 @@
+import os
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# Shared async client for the LLM call path (cache, limits, coordination).
+# Short timeouts keep a missing Redis from stalling calls; callers fail open.
+_async_redis: Optional[aioredis.Redis] = None
+
+
+def get_async_redis() -> aioredis.Redis:
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=1.0,
+            socket_timeout=2.0,
+        )
+    return _async_redis
+
+
+async def close_async_redis():
+    global _async_redis
+    if _async_redis is not None:
+        await _async_redis.close()
+        _async_redis = None
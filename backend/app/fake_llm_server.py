@@ -0,0 +1,366 @@
+"""Standalone fake LLM server for load and soak tests.
+
+Speaks enough of the Ollama (``/api/generate``, ``/api/tags``, ``/api/ps``,
+``/api/embed``)
+and OpenAI (``/v1/chat/completions``, ``/v1/models``, and the ``/v1/files``
+and ``/v1/batches`` endpoints of the Batch API) protocols for the backend's
+clients, with latency, error rates and outputs configured through
+the FAKE_LLM_* variables (see app.services.fake_llm). Run it with:
+
+    uvicorn app.fake_llm_server:app --port 11434
+
+and point OLLAMA_HOST=localhost or OPENAI_BASE_URL=http://localhost:11434/v1
+at it.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.services.fake_llm import (
+    FakeLLMConfig,
+    count_prompt_tokens,
+    fake_embeddings,
+    fake_tokens,
+    sample_failure,
+    sample_latency,
+)
+
+
+app = FastAPI(title="Fake LLM Server")
+
+config = FakeLLMConfig()
+
+# Uploaded and generated files, and batch jobs, kept in memory
+files: Dict[str, bytes] = {}
+batches: Dict[str, Dict[str, Any]] = {}
+
+
+def _failure_response(status: int, openai_style: bool) -> JSONResponse:
+    message = "Rate limit exceeded" if status == 429 else "Internal server error"
+    body: Dict[str, Any] = {"error": message}
+    if openai_style:
+        body = {"error": {"message": message, "type": "fake_llm_error"}}
+    headers = {"Retry-After": str(config.retry_after)} if status == 429 else {}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+async def _stream_tokens(tokens: List[str]) -> AsyncIterator[str]:
+    for i, token in enumerate(tokens):
+        if i and config.token_interval:
+            await asyncio.sleep(config.token_interval)
+        yield token
+
+
+async def _json_body(request: Request) -> Dict[str, Any]:
+    # Ollama clients do not always send a JSON content type
+    return json.loads(await request.body() or b"{}")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@app.get("/")
+async def root():
+    return {"message": "Fake LLM server", "models": config.models}
+
+
+@app.get("/api/tags")
+async def ollama_tags():
+    return {
+        "models": [
+            {"name": name, "model": name, "modified_at": _now(), "size": 0}
+            for name in config.models
+        ]
+    }
+
+
+@app.get("/api/ps")
+async def ollama_ps():
+    # Every fake model is always "loaded"
+    return {
+        "models": [
+            {"name": name, "model": name, "size_vram": 0, "expires_at": _now()}
+            for name in config.models
+        ]
+    }
+
+
+@app.post("/api/generate")
+async def ollama_generate(request: Request):
+    payload = await _json_body(request)
+    model = payload.get("model", "")
+    prompt = payload.get("prompt", "")
+    options = payload.get("options") or {}
+    max_tokens = options.get("num_predict") or config.max_tokens
+    if max_tokens < 0:
+        max_tokens = config.max_tokens
+    if "prompt" not in payload:
+        # Like Ollama, a request without a prompt only loads the model
+        return {"model": model, "response": "", "done": True, "done_reason": "load"}
+
+    await asyncio.sleep(sample_latency(config.latency))
+    failure = sample_failure(config)
+    if failure:
+        return _failure_response(failure, openai_style=False)
+
+    started = time.monotonic()
+    tokens = fake_tokens(prompt, model, max_tokens, config, options.get("seed"))
+
+    def final(text: str) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "created_at": _now(),
+            "response": text,
+            "done": True,
+            "done_reason": "length" if len(tokens) >= max_tokens else "stop",
+            "prompt_eval_count": count_prompt_tokens(prompt),
+            "eval_count": len(tokens),
+            "eval_duration": int((time.monotonic() - started) * 1e9),
+        }
+
+    if not payload.get("stream", True):
+        if config.token_interval and len(tokens) > 1:
+            await asyncio.sleep(config.token_interval * (len(tokens) - 1))
+        return final("".join(tokens))
+
+    async def chunks() -> AsyncIterator[str]:
+        async for token in _stream_tokens(tokens):
+            chunk = {
+                "model": model,
+                "created_at": _now(),
+                "response": token,
+                "done": False,
+            }
+            yield json.dumps(chunk) + "\n"
+        yield json.dumps(final("")) + "\n"
+
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+
+@app.post("/api/embed")
+async def ollama_embed(request: Request):
+    payload = await _json_body(request)
+    texts = payload.get("input", [])
+    if isinstance(texts, str):
+        texts = [texts]
+    await asyncio.sleep(sample_latency(config.latency))
+    failure = sample_failure(config)
+    if failure:
+        return _failure_response(failure, openai_style=False)
+    return {
+        "model": payload.get("model", ""),
+        "embeddings": fake_embeddings(texts, config.embedding_dim),
+    }
+
+
+def _chat_request(payload: Dict[str, Any]):
+    """Model, prompt, max_tokens and seed of a chat-completions request"""
+    prompt = "\n".join(
+        str(message.get("content", "")) for message in payload.get("messages", [])
+    )
+    max_tokens = payload.get("max_tokens") or config.max_tokens
+    seed: Optional[int] = payload.get("seed")
+    return payload.get("model", ""), prompt, max_tokens, seed
+
+
+def _chat_completion(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Non-streaming chat-completions response body"""
+    model, prompt, max_tokens, seed = _chat_request(payload)
+    tokens = fake_tokens(prompt, model, max_tokens, config, seed)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "length" if len(tokens) >= max_tokens else "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": count_prompt_tokens(prompt),
+            "completion_tokens": len(tokens),
+            "total_tokens": count_prompt_tokens(prompt) + len(tokens),
+        },
+    }
+
+
+@app.get("/v1/models")
+async def openai_models():
+    return {
+        "object": "list",
+        "data": [
+            {"id": name, "object": "model", "created": 0, "owned_by": "fake"}
+            for name in config.models
+        ],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    payload = await _json_body(request)
+    model, prompt, max_tokens, seed = _chat_request(payload)
+
+    await asyncio.sleep(sample_latency(config.latency))
+    failure = sample_failure(config)
+    if failure:
+        return _failure_response(failure, openai_style=True)
+
+    tokens = fake_tokens(prompt, model, max_tokens, config, seed)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    finish_reason = "length" if len(tokens) >= max_tokens else "stop"
+
+    if not payload.get("stream"):
+        if config.token_interval and len(tokens) > 1:
+            await asyncio.sleep(config.token_interval * (len(tokens) - 1))
+        return _chat_completion(payload)
+
+    def event(delta: Dict[str, Any], reason: Optional[str] = None) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": reason}],
+        }
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    async def events() -> AsyncIterator[str]:
+        yield event({"role": "assistant", "content": ""})
+        async for token in _stream_tokens(tokens):
+            yield event({"content": token})
+        yield event({}, finish_reason)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _store_file(content: bytes, purpose: str, filename: str) -> Dict[str, Any]:
+    file_id = f"file-{uuid.uuid4().hex}"
+    files[file_id] = content
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+    }
+
+
+@app.post("/v1/files")
+async def openai_upload_file(
+    file: UploadFile = File(...), purpose: str = Form(...)
+):
+    return _store_file(await file.read(), purpose, file.filename or "upload")
+
+
+@app.get("/v1/files/{file_id}/content")
+async def openai_file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="No such file")
+    return StreamingResponse(iter([files[file_id]]), media_type="application/jsonl")
+
+
+async def _process_batch(batch: Dict[str, Any]):
+    """Complete every request of a batch after ``config.batch_delay`` seconds,
+    failing each with the configured error rates"""
+    batch["status"] = "in_progress"
+    batch["in_progress_at"] = int(time.time())
+    await asyncio.sleep(config.batch_delay)
+    if batch["status"] != "in_progress":
+        return
+
+    outputs, errors = [], []
+    for line in files[batch["input_file_id"]].decode().splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        item: Dict[str, Any] = {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": request["custom_id"],
+            "error": None,
+        }
+        failure = sample_failure(config)
+        if failure:
+            message = "Rate limit exceeded" if failure == 429 else "Server error"
+            item["response"] = {
+                "status_code": failure,
+                "body": {"error": {"message": message, "type": "fake_llm_error"}},
+            }
+            errors.append(item)
+        else:
+            item["response"] = {
+                "status_code": 200,
+                "body": _chat_completion(request["body"]),
+            }
+            outputs.append(item)
+
+    def jsonl(items: List[Dict[str, Any]]) -> bytes:
+        return "".join(json.dumps(item) + "\n" for item in items).encode()
+
+    if outputs:
+        stored = _store_file(jsonl(outputs), "batch_output", "output.jsonl")
+        batch["output_file_id"] = stored["id"]
+    if errors:
+        stored = _store_file(jsonl(errors), "batch_output", "errors.jsonl")
+        batch["error_file_id"] = stored["id"]
+    batch["request_counts"] = {
+        "total": len(outputs) + len(errors),
+        "completed": len(outputs),
+        "failed": len(errors),
+    }
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+@app.post("/v1/batches")
+async def openai_create_batch(request: Request):
+    payload = await _json_body(request)
+    if payload.get("input_file_id") not in files:
+        raise HTTPException(status_code=400, detail="Unknown input_file_id")
+    batch = {
+        "id": f"batch_{uuid.uuid4().hex}",
+        "object": "batch",
+        "endpoint": payload.get("endpoint"),
+        "input_file_id": payload["input_file_id"],
+        "completion_window": payload.get("completion_window", "24h"),
+        "status": "validating",
+        "output_file_id": None,
+        "error_file_id": None,
+        "created_at": int(time.time()),
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        "errors": None,
+    }
+    batches[batch["id"]] = batch
+    asyncio.create_task(_process_batch(batch))
+    return batch
+
+
+@app.get("/v1/batches/{batch_id}")
+async def openai_get_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="No such batch")
+    return batches[batch_id]
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def openai_cancel_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="No such batch")
+    batch = batches[batch_id]
+    if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+        batch["status"] = "cancelled"
+        batch["cancelled_at"] = int(time.time())
+    return batch
@@ -1,19 +1,17 @@
 import asyncio
-import difflib
 import json
 import os
 import uuid
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-import httpx
 import pandas as pd
 import redis
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from openai import OpenAI
+from app.db.redis_client import close_async_redis
 from app.db.session import engine, SessionLocal, Base
 from sqlalchemy.orm import joinedload
 from app.models import (
@@ -24,7 +22,48 @@ from app.models import (
     ModelComparison,
     ModelComparisonResult,
 )
-from app.services.scheduler import scheduler
+from app.services.concurrency import concurrency_limits
+from app.services.dispatch import DEFAULT_JOB_WEIGHT, dispatch_queue
+from app.services.embeddings import store_stats
+from app.services.evaluation import EVALUATION_METHODS
+from app.services.hedging import hedger
+from app.services.llm import (
+    OLLAMA_KEEP_ALIVE,
+    close_ollama_client,
+    close_openai_client,
+    early_stop_condition,
+    generate,
+    list_ollama_models,
+    provider_for_model,
+)
+from app.services.ollama_pool import ollama_pool
+from app.services.residency import OLLAMA_RELEASE_AFTER_COMPARISON, model_residency
+from app.services.resilience import breaker_states
+from app.services.runner import (
+    CALL_METRIC_FIELDS,
+    cache_summary,
+    call_metrics,
+    estimate_comparison,
+    estimate_run,
+    metrics_summary,
+    prepare_samples,
+    rescore_test_run,
+    resolve_concurrency,
+    run_prompt_system,
+)
+from app.services.model_stats import (
+    MAX_TOKENS_MODES,
+    model_history,
+    record_model_stats,
+    record_output_lengths,
+    resolve_max_tokens,
+    token_cap_summary,
+)
+from app.services.tokens import enforce_budget, load_encodings
+from app.services.cassette import check_cassette
+from app.services.scheduler import EXECUTION_MODES, scheduler
+from app.services.scoring_pool import scoring_pool
+from app.services.semantic import expected_vectors
 from app.api.routers import prompt_systems as prompt_systems_router
 from app.api.routers import test_runs as test_runs_router
 from app.api.routers import test_schedules as test_schedules_router
@@ -70,6 +109,7 @@ class PromptSystemCreate(BaseModel):
     model: str = "gpt-3.5-turbo"
     temperature: float = 0.7
     max_tokens: int = 1000
+    max_tokens_mode: str = "fixed"  # "fixed" or "auto" (capped from past outputs)
     top_p: float = 1.0
     top_k: Optional[int] = None
 
@@ -78,6 +118,22 @@ class TestRunCreate(BaseModel):
     prompt_system_id: str
     regression_set: List[Dict[str, Any]]
     evaluation_function: str = "fuzzy"  # "fuzzy", "exact", "semantic"
+    concurrency: Optional[int] = None  # max in-flight samples for this run
+    cache_policy: str = "auto"  # "auto", "always", "refresh", "off"
+    stream: bool = False  # stream outputs to record time to first token
+    early_stop: bool = False  # stop generating once the score is settled
+    max_output_chars: Optional[int] = None  # stop streaming past this length
+    hedge: Optional[bool] = None  # duplicate slow calls (default LLM_HEDGING)
+    cost_budget: Optional[float] = None  # reject runs that could cost more (USD)
+    cassette: Optional[str] = None  # cassette name (default "default")
+    cassette_mode: str = "off"  # "off", "record" or "replay" (no LLM calls)
+    score_cutoff: float = 0.0  # fuzzy scores below this are reported as 0
+    weight: float = DEFAULT_JOB_WEIGHT  # queue share relative to other runs
+
+
+class TestRunEvaluate(BaseModel):
+    evaluation_function: str  # see app.services.evaluation.EVALUATION_METHODS
+    score_cutoff: float = 0.0
 
 
 class TestScheduleCreate(BaseModel):
@@ -89,6 +145,9 @@ class TestScheduleCreate(BaseModel):
     email_notifications: bool = False
     email_recipients: List[str] = []
     alert_threshold: float = 0.2
+    execution_mode: str = "realtime"  # "realtime" or "batch" (OpenAI Batch API)
+    cassette: Optional[str] = None
+    cassette_mode: str = "off"  # "off", "record" or "replay"
 
 
 class ModelComparisonCreate(BaseModel):
@@ -98,103 +157,15 @@ class ModelComparisonCreate(BaseModel):
     models: List[str]
     regression_set: List[Dict[str, Any]]
     evaluation_function: str = "fuzzy"
-
-
-async def call_ollama(
-    prompt: str,
-    model: str,
-    temperature: float,
-    max_tokens: int,
-    top_p: float,
-    top_k: Optional[int] = None,
-):
-    """Call Ollama API"""
-    # Use host.docker.internal when running in Docker, localhost otherwise
-    ollama_host = os.getenv("OLLAMA_HOST", "host.docker.internal")
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"http://{ollama_host}:11434/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "options": {
-                        "temperature": temperature,
-                        "top_p": top_p,
-                        "top_k": top_k,
-                        "num_predict": max_tokens,
-                    },
-                    "stream": False,
-                },
-                timeout=60.0,
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("response", "").strip()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
-
-
-async def call_openai(
-    prompt: str,
-    model: str,
-    temperature: float,
-    max_tokens: int,
-    top_p: float,
-    top_k: Optional[int] = None,
-):
-    """Call OpenAI API"""
-    api_key = os.getenv("OPENAI_API_KEY")
-
-    if not api_key:
-        raise HTTPException(
-            status_code=500, detail="OpenAI API key not found in environment variables"
-        )
-
-    try:
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        error_msg = str(e)
-        if "invalid_api_key" in error_msg.lower() or "401" in error_msg:
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid OpenAI API key. Please check your API key configuration.",
-            )
-        elif "quota" in error_msg.lower():
-            raise HTTPException(
-                status_code=429,
-                detail="OpenAI API quota exceeded. Please check your usage limits.",
-            )
-        else:
-            raise HTTPException(
-                status_code=500, detail=f"OpenAI API error: {error_msg}"
-            )
-
-
-async def call_llm(
-    prompt: str,
-    provider: str,
-    model: str,
-    temperature: float,
-    max_tokens: int,
-    top_p: float,
-    top_k: Optional[int] = None,
-):
-    """Route LLM calls to appropriate provider"""
-    if provider == "ollama":
-        return await call_ollama(prompt, model, temperature, max_tokens, top_p, top_k)
-    elif provider == "openai":
-        return await call_openai(prompt, model, temperature, max_tokens, top_p, top_k)
-    else:
-        raise HTTPException(status_code=400, detail=f"Unsupported provider: {provider}")
+    cache_policy: str = "auto"
+    stream: bool = False
+    early_stop: bool = False
+    max_output_chars: Optional[int] = None
+    hedge: Optional[bool] = None
+    cost_budget: Optional[float] = None
+    cassette: Optional[str] = None
+    cassette_mode: str = "off"  # "off", "record" or "replay"
+    score_cutoff: float = 0.0  # fuzzy scores below this are reported as 0
 
 
 @app.get("/")
@@ -212,23 +183,32 @@ async def redis_health_check():
         return {"status": "unhealthy", "redis": "disconnected", "error": str(e)}
 
 
+@app.get("/health/llm/")
+async def llm_health_check():
+    """Report circuit breakers, concurrency limits, the dispatch queue, hedging,
+    Ollama nodes, the scoring pool and the semantic and embedding vector
+    caches"""
+    return {
+        "circuits": breaker_states(),
+        "concurrency": concurrency_limits(),
+        "dispatch": dispatch_queue.stats(),
+        "hedging": hedger.stats(),
+        "ollama_hosts": ollama_pool.status(),
+        "scoring": scoring_pool.stats(),
+        "semantic_vectors": expected_vectors.stats(),
+        "embedding_stores": store_stats(),
+    }
+
+
 @app.get("/models/")
 async def get_available_models():
     """Get available models for both providers"""
     # Get actual available models from Ollama
     ollama_models = []
     try:
-        ollama_host = os.getenv("OLLAMA_HOST", "host.docker.internal")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"http://{ollama_host}:11434/api/tags", timeout=5.0
-            )
-            if response.status_code == 200:
-                models_data = response.json()
-                ollama_models = [
-                    {"id": model["name"], "name": model["name"]}
-                    for model in models_data.get("models", [])
-                ]
+        ollama_models = [
+            {"id": name, "name": name} for name in await list_ollama_models()
+        ]
     except Exception as e:
         # Fallback to empty list if Ollama is not available
         pass
@@ -246,25 +226,25 @@ async def get_available_models():
 @app.get("/ollama/status/")
 async def check_ollama_status():
     """Check if Ollama is running and get available models"""
-    # Use host.docker.internal when running in Docker, localhost otherwise
-    ollama_host = os.getenv("OLLAMA_HOST", "host.docker.internal")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"http://{ollama_host}:11434/api/tags", timeout=5.0
-            )
-            response.raise_for_status()
-            models = response.json()
-            return {
-                "status": "running",
-                "models": [model["name"] for model in models.get("models", [])],
-            }
+        return {"status": "running", "models": await list_ollama_models()}
     except Exception as e:
         return {"status": "not_running", "error": str(e), "models": []}
 
 
+@app.get("/ollama/residency/")
+async def get_ollama_residency():
+    """Models currently loaded on each Ollama node"""
+    return {"keep_alive": OLLAMA_KEEP_ALIVE, "nodes": await model_residency.snapshot()}
+
+
 @app.post("/prompt-systems/")
 async def create_prompt_system(prompt_system: PromptSystemCreate):
+    if prompt_system.max_tokens_mode not in MAX_TOKENS_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported max_tokens mode: {prompt_system.max_tokens_mode}",
+        )
     db = SessionLocal()
     try:
         db_prompt_system = PromptSystem(
@@ -276,6 +256,7 @@ async def create_prompt_system(prompt_system: PromptSystemCreate):
             model=prompt_system.model,
             temperature=prompt_system.temperature,
             max_tokens=prompt_system.max_tokens,
+            max_tokens_mode=prompt_system.max_tokens_mode,
             top_p=prompt_system.top_p,
             top_k=prompt_system.top_k,
             created_at=datetime.utcnow(),
@@ -331,30 +312,45 @@ async def upload_regression_set(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail=f"Error parsing file: {str(e)}")
 
 
-def evaluate_output(predicted: str, expected: str, method: str = "fuzzy") -> float:
-    """Evaluate output using different methods"""
-    if method == "fuzzy":
-        # Fuzzy string matching using sequence matcher
-        return difflib.SequenceMatcher(
-            None, predicted.lower().strip(), expected.lower().strip()
-        ).ratio()
-    elif method == "exact":
-        # Exact string match (case-insensitive)
-        return 1.0 if predicted.lower().strip() == expected.lower().strip() else 0.0
-    elif method == "semantic":
-        # Semantic similarity using word overlap
-        predicted_words = set(predicted.lower().strip().split())
-        expected_words = set(expected.lower().strip().split())
-        if not expected_words:
-            return 1.0 if not predicted_words else 0.0
-        intersection = predicted_words.intersection(expected_words)
-        union = predicted_words.union(expected_words)
-        return len(intersection) / len(union) if union else 0.0
-    elif method == "contains":
-        # Check if expected output is contained in predicted output
-        return 1.0 if expected.lower().strip() in predicted.lower().strip() else 0.0
-    else:
-        return 0.0
+def estimate_test_run_samples(
+    db, prompt_system, samples, test_run: TestRunCreate, max_tokens: int
+):
+    return estimate_run(
+        prompt_system.provider,
+        prompt_system.model,
+        [sample["prompt"] for sample in samples],
+        max_tokens,
+        resolve_concurrency(test_run.concurrency),
+        history=model_history(db, prompt_system.provider, prompt_system.model),
+    )
+
+
+@app.post("/test-runs/estimate/")
+async def estimate_test_run(test_run: TestRunCreate):
+    """Predicted duration, tokens and cost of a test run, without running it"""
+    db = SessionLocal()
+    try:
+        prompt_system = (
+            db.query(PromptSystem)
+            .filter(PromptSystem.id == test_run.prompt_system_id)
+            .first()
+        )
+        if not prompt_system:
+            raise HTTPException(status_code=404, detail="Prompt system not found")
+
+        samples = prepare_samples(prompt_system.template, test_run.regression_set)
+        max_tokens = resolve_max_tokens(db, prompt_system)
+        estimate = estimate_test_run_samples(
+            db, prompt_system, samples, test_run, max_tokens
+        )
+        estimate["max_tokens"] = max_tokens
+        if test_run.cost_budget is not None:
+            estimate["within_budget"] = (
+                estimate["max_cost_usd"] <= test_run.cost_budget
+            )
+        return estimate
+    finally:
+        db.close()
 
 
 @app.post("/test-runs/")
@@ -370,50 +366,33 @@ async def create_test_run(test_run: TestRunCreate):
         if not prompt_system:
             raise HTTPException(status_code=404, detail="Prompt system not found")
 
-        # Process all samples first before creating any database records
-        results = []
-        total_score = 0
-
-        for i, sample in enumerate(test_run.regression_set):
-            # Extract variables and expected output
-            variables = {k: v for k, v in sample.items() if k != "expected_output"}
-            expected_output = sample.get("expected_output", "")
-
-            # Interpolate template
-            try:
-                prompt = prompt_system.template.format(**variables)
-            except KeyError as e:
-                raise HTTPException(
-                    status_code=400, detail=f"Missing variable in sample {i}: {e}"
-                )
-
-            # Call LLM
-            predicted_output = await call_llm(
-                prompt=prompt,
-                provider=prompt_system.provider,
-                model=prompt_system.model,
-                temperature=prompt_system.temperature,
-                max_tokens=prompt_system.max_tokens,
-                top_p=prompt_system.top_p,
-                top_k=prompt_system.top_k,
-            )
-
-            # Evaluate
-            score = evaluate_output(
-                predicted_output, expected_output, test_run.evaluation_function
-            )
-            total_score += score
-
-            results.append(
-                {
-                    "sample_id": str(i),
-                    "input_variables": variables,
-                    "expected_output": expected_output,
-                    "predicted_output": predicted_output,
-                    "score": score,
-                    "evaluation_method": test_run.evaluation_function,
-                }
-            )
+        # Render every prompt up front, then fan the samples out concurrently;
+        # nothing is written to the database until all samples are processed
+        samples = prepare_samples(prompt_system.template, test_run.regression_set)
+        max_tokens = resolve_max_tokens(db, prompt_system)
+        estimate = estimate_test_run_samples(
+            db, prompt_system, samples, test_run, max_tokens
+        )
+        # A replayed run makes no calls and costs nothing
+        if test_run.cassette_mode != "replay":
+            enforce_budget(estimate, test_run.cost_budget)
+        results = await run_prompt_system(
+            prompt_system,
+            samples,
+            test_run.evaluation_function,
+            concurrency=test_run.concurrency,
+            cache_policy=test_run.cache_policy,
+            stream=test_run.stream,
+            early_stop=test_run.early_stop,
+            max_output_chars=test_run.max_output_chars,
+            hedge=test_run.hedge,
+            max_tokens=max_tokens,
+            cassette=test_run.cassette,
+            cassette_mode=test_run.cassette_mode,
+            score_cutoff=test_run.score_cutoff,
+            weight=test_run.weight,
+        )
+        total_score = sum(result["score"] for result in results)
 
         # Only create database records after all samples are processed successfully
         test_run_id = str(uuid.uuid4())
@@ -435,6 +414,9 @@ async def create_test_run(test_run: TestRunCreate):
                 predicted_output=result["predicted_output"],
                 score=result["score"],
                 evaluation_method=result["evaluation_method"],
+                **{field: result[field] for field in CALL_METRIC_FIELDS},
+                max_tokens=result["max_tokens"],
+                capped=result["capped"],
             )
             db.add(db_result)
 
@@ -444,6 +426,11 @@ async def create_test_run(test_run: TestRunCreate):
         )
         db_test_run.avg_score = avg_score
         db_test_run.total_samples = len(test_run.regression_set)
+        metrics = metrics_summary(results)
+        for field, value in metrics.items():
+            setattr(db_test_run, field, value)
+        record_model_stats(db, prompt_system.provider, prompt_system.model, results)
+        record_output_lengths(db, prompt_system.id, prompt_system.model, results)
 
         # Commit everything at once
         db.commit()
@@ -452,6 +439,10 @@ async def create_test_run(test_run: TestRunCreate):
             "test_run_id": test_run_id,
             "avg_score": avg_score,
             "total_samples": len(test_run.regression_set),
+            "cache": cache_summary(results),
+            "metrics": metrics,
+            "estimate": estimate,
+            "token_cap": token_cap_summary(prompt_system, max_tokens, results),
             "results": results,
         }
 
@@ -502,6 +493,27 @@ async def get_test_run(test_run_id: str):
         db.close()
 
 
+@app.post("/test-runs/{test_run_id}/evaluate/")
+async def evaluate_test_run(test_run_id: str, payload: TestRunEvaluate):
+    """Re-score a test run's stored outputs with an evaluation function, without
+    calling the LLM or changing the stored scores"""
+    if payload.evaluation_function not in EVALUATION_METHODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported evaluation function: {payload.evaluation_function}",
+        )
+    db = SessionLocal()
+    try:
+        test_run = db.get(TestRun, test_run_id)
+        if not test_run:
+            raise HTTPException(status_code=404, detail="Test run not found")
+        return await rescore_test_run(
+            db, test_run, payload.evaluation_function, payload.score_cutoff
+        )
+    finally:
+        db.close()
+
+
 @app.get("/test-runs/")
 async def get_test_runs():
     db = SessionLocal()
@@ -535,13 +547,28 @@ async def get_evaluation_functions():
             {
                 "id": "semantic",
                 "name": "Semantic Similarity",
-                "description": "Word overlap similarity (Jaccard index)",
+                "description": "TF-IDF cosine similarity of character n-grams",
             },
             {
                 "id": "contains",
                 "name": "Contains",
                 "description": "Check if expected output is contained in predicted output",
             },
+            {
+                "id": "indel",
+                "name": "Fast Fuzzy Match",
+                "description": "Fuzzy similarity from the exact edit distance; fast on long outputs",
+            },
+            {
+                "id": "jaccard",
+                "name": "Word Overlap",
+                "description": "Word overlap similarity (Jaccard index)",
+            },
+            {
+                "id": "embedding",
+                "name": "Embedding Similarity",
+                "description": "Cosine similarity of model embeddings; catches paraphrases",
+            },
         ]
     }
 
@@ -559,6 +586,12 @@ async def create_test_schedule(schedule: TestScheduleCreate):
         )
         if not prompt_system:
             raise HTTPException(status_code=404, detail="Prompt system not found")
+        if schedule.execution_mode not in EXECUTION_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported execution mode: {schedule.execution_mode}",
+            )
+        check_cassette(schedule.cassette_mode, schedule.cassette)
 
         # Create schedule
         schedule_id = str(uuid.uuid4())
@@ -577,6 +610,9 @@ async def create_test_schedule(schedule: TestScheduleCreate):
                 else None
             ),
             alert_threshold=schedule.alert_threshold,
+            execution_mode=schedule.execution_mode,
+            cassette_mode=schedule.cassette_mode,
+            cassette=schedule.cassette,
             is_active=True,
             next_run_at=datetime.utcnow(),
         )
@@ -646,10 +682,42 @@ async def delete_test_schedule(schedule_id: str):
 
 
 # Model comparison endpoints
+def estimate_model_comparison(db, comparison: ModelComparisonCreate):
+    return estimate_comparison(
+        comparison.prompt_template,
+        comparison.template_variables,
+        comparison.models,
+        comparison.regression_set,
+        comparison.model_settings.get("max_tokens", 1000),
+        db=db,
+    )
+
+
+@app.post("/model-comparisons/estimate/")
+async def estimate_model_comparison_endpoint(comparison: ModelComparisonCreate):
+    """Predicted duration, tokens and cost of a comparison, without running it"""
+    db = SessionLocal()
+    try:
+        estimate = estimate_model_comparison(db, comparison)
+        if comparison.cost_budget is not None:
+            estimate["within_budget"] = (
+                estimate["max_cost_usd"] <= comparison.cost_budget
+            )
+        return estimate
+    finally:
+        db.close()
+
+
 @app.post("/model-comparisons/")
 async def create_model_comparison(comparison: ModelComparisonCreate):
     db = SessionLocal()
     try:
+        check_cassette(comparison.cassette_mode, comparison.cassette)
+        estimate = estimate_model_comparison(db, comparison)
+        # A replayed comparison makes no calls and costs nothing
+        if comparison.cassette_mode != "replay":
+            enforce_budget(estimate, comparison.cost_budget)
+
         # Create the comparison record
         comparison_id = str(uuid.uuid4())
         db_comparison = ModelComparison(
@@ -667,15 +735,30 @@ async def create_model_comparison(comparison: ModelComparisonCreate):
 
         results = []
 
+        def stop_condition(expected: str):
+            if not comparison.early_stop and comparison.max_output_chars is None:
+                return None
+            return early_stop_condition(
+                comparison.evaluation_function, expected, comparison.max_output_chars
+            )
+
+        expected = [
+            sample.get("expected_output", "") for sample in comparison.regression_set
+        ]
+
         # Run tests for each model
-        for model_id in comparison.models:
+        # Each Ollama model is loaded once and warmed before its samples are timed
+        for model_id in model_residency.order_models(comparison.models):
             try:
                 # Determine provider based on model ID
-                provider = "openai" if model_id.startswith("gpt-") else "ollama"
+                provider = provider_for_model(model_id)
+                if provider == "ollama":
+                    await model_residency.warm_up(model_id)
 
                 # Run the test
-                total_score = 0
                 total_samples = len(comparison.regression_set)
+                calls = []
+                outputs = []
 
                 for sample in comparison.regression_set:
                     # Format the prompt with variables
@@ -684,35 +767,42 @@ async def create_model_comparison(comparison: ModelComparisonCreate):
                         if var in sample:
                             prompt = prompt.replace(f"{{{var}}}", str(sample[var]))
 
-                    # Call the appropriate API
-                    if provider == "openai":
-                        response = await call_openai(
-                            prompt,
-                            model_id,
-                            comparison.model_settings.get("temperature", 0.7),
-                            comparison.model_settings.get("max_tokens", 1000),
-                            comparison.model_settings.get("top_p", 1.0),
-                            comparison.model_settings.get("top_k"),
-                        )
-                    else:
-                        response = await call_ollama(
-                            prompt,
-                            model_id,
-                            comparison.model_settings.get("temperature", 0.7),
-                            comparison.model_settings.get("max_tokens", 1000),
-                            comparison.model_settings.get("top_p", 1.0),
-                            comparison.model_settings.get("top_k"),
-                        )
-
-                    # Evaluate the response
-                    score = evaluate_output(
-                        response,
-                        sample.get("expected_output", ""),
+                    # Call the model through the response cache
+                    response = await generate(
+                        prompt,
+                        provider,
+                        model_id,
+                        comparison.model_settings.get("temperature", 0.7),
+                        comparison.model_settings.get("max_tokens", 1000),
+                        comparison.model_settings.get("top_p", 1.0),
+                        comparison.model_settings.get("top_k"),
+                        seed=comparison.model_settings.get("seed"),
+                        cache_policy=comparison.cache_policy,
+                        stream=comparison.stream,
+                        stop_when=stop_condition(
+                            sample.get("expected_output", "")
+                        ),
+                        hedge=comparison.hedge,
+                        priority="comparison",
+                        job_id=comparison_id,
+                        cassette=comparison.cassette,
+                        cassette_mode=comparison.cassette_mode,
+                    )
+                    calls.append(call_metrics(response))
+                    outputs.append(response.text)
+
+                # Score all of the model's outputs at once
+                total_score = sum(
+                    await scoring_pool.evaluate(
+                        outputs,
+                        expected,
                         comparison.evaluation_function,
+                        comparison.score_cutoff,
                     )
-                    total_score += score
-
+                )
                 avg_score = total_score / total_samples if total_samples > 0 else 0
+                metrics = metrics_summary(calls)
+                record_model_stats(db, provider, model_id, calls)
 
                 # Save the result
                 result = ModelComparisonResult(
@@ -723,6 +813,7 @@ async def create_model_comparison(comparison: ModelComparisonCreate):
                     avg_score=avg_score,
                     total_samples=total_samples,
                     status="completed",
+                    **metrics,
                 )
                 db.add(result)
                 results.append(
@@ -732,6 +823,8 @@ async def create_model_comparison(comparison: ModelComparisonCreate):
                         "avg_score": avg_score,
                         "total_samples": total_samples,
                         "status": "completed",
+                        "cache": cache_summary(calls),
+                        **metrics,
                     }
                 )
 
@@ -757,9 +850,21 @@ async def create_model_comparison(comparison: ModelComparisonCreate):
                     }
                 )
 
+            # Free the model's memory for the next one when configured to
+            if (
+                provider_for_model(model_id) == "ollama"
+                and OLLAMA_RELEASE_AFTER_COMPARISON
+            ):
+                await model_residency.release(model_id)
+
         db.commit()
-        return {"id": comparison_id, "results": results}
+        # Report results in the order the models were requested
+        results.sort(key=lambda r: comparison.models.index(r["model"]))
+        return {"id": comparison_id, "results": results, "estimate": estimate}
 
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -809,6 +914,12 @@ async def get_model_comparisons():
                             "avg_score": r.avg_score,
                             "total_samples": r.total_samples,
                             "status": r.status,
+                            "p50_latency_ms": r.p50_latency_ms,
+                            "p95_latency_ms": r.p95_latency_ms,
+                            "p50_ttft_ms": r.p50_ttft_ms,
+                            "p95_ttft_ms": r.p95_ttft_ms,
+                            "total_tokens": r.total_tokens,
+                            "total_cost_usd": r.total_cost_usd,
                         }
                         for r in results
                     ],
@@ -865,6 +976,14 @@ class PromptOptimizerCreate(BaseModel):
 # Redis-based optimization sessions storage
 OPTIMIZATION_SESSION_PREFIX = "optimization_session:"
 
+# Regression cases each candidate prompt is tested on, fewer when the
+# remaining budget cannot cover them
+OPTIMIZER_TEST_CASES = 10
+IMPROVER_SYSTEM_MESSAGE = (
+    "You are an expert prompt engineer. Provide clear, specific, and effective "
+    "prompt improvements."
+)
+
 
 def get_optimization_session(optimization_id: str) -> Dict[str, Any]:
     """Get optimization session from Redis"""
@@ -1045,8 +1164,41 @@ async def run_optimization(optimization_id: str):
                 session["config"]["evaluationMethod"],
             )
 
+            # Fit the iteration into what is left of the budget: stop if even
+            # the improvement call could overrun it, otherwise test on as many
+            # cases as the worst case allows
+            remaining = session["config"]["costBudget"] - session["total_cost"]
+            improvement_estimate = estimate_run(
+                prompt_system.provider,
+                prompt_system.model,
+                [improver_prompt(improvement_prompt)],
+                prompt_system.max_tokens,
+            )
+            if improvement_estimate["max_cost_usd"] > remaining:
+                break
+            test_cases = regression_set[:OPTIMIZER_TEST_CASES]
+            case_estimate = estimate_run(
+                prompt_system.provider,
+                prompt_system.model,
+                [
+                    render_test_case(session["best_prompt"], case)
+                    for case in test_cases
+                ],
+                # The improved prompt may be up to max_tokens longer than
+                # the current one; pricing that as output errs on the safe side
+                2 * prompt_system.max_tokens,
+            )
+            if case_estimate["max_cost_usd"] > 0:
+                per_case = case_estimate["max_cost_usd"] / len(test_cases)
+                affordable = int(
+                    (remaining - improvement_estimate["max_cost_usd"]) // per_case
+                )
+                test_cases = test_cases[:affordable]
+            if regression_set and not test_cases:
+                break
+
             # Get improved prompt using the same provider/model as the prompt system
-            improved_prompt = await get_improved_prompt(
+            improved_prompt, improvement_cost = await get_improved_prompt(
                 improvement_prompt,
                 provider=prompt_system.provider,
                 model=prompt_system.model,
@@ -1054,6 +1206,7 @@ async def run_optimization(optimization_id: str):
                 max_tokens=prompt_system.max_tokens,
                 top_p=prompt_system.top_p,
                 top_k=prompt_system.top_k,
+                job_id=optimization_id,
             )
 
             # Check if we got an empty prompt (indicating an error)
@@ -1062,16 +1215,17 @@ async def run_optimization(optimization_id: str):
                 error_message = "Failed to generate improved prompt. This is likely due to an invalid OpenAI API key. Please check your API key configuration."
 
             # Test the improved prompt
-            test_score = await test_improved_prompt(
+            test_score, test_cost = await test_improved_prompt(
                 improved_prompt,
                 prompt_system,
-                regression_set,
+                test_cases,
                 session["config"]["evaluationMethod"],
+                job_id=optimization_id,
             )
 
             # Update session
             improvement = test_score - session["best_score"]
-            session["total_cost"] += 0.01  # Rough cost estimate per iteration
+            session["total_cost"] += improvement_cost + test_cost
 
             result = {
                 "iteration": iteration + 1,
@@ -1079,6 +1233,7 @@ async def run_optimization(optimization_id: str):
                 "score": test_score,
                 "improvement": improvement,
                 "cost": session["total_cost"],
+                "test_cases": len(test_cases),
                 "error": error_message,
             }
 
@@ -1155,6 +1310,19 @@ def generate_improvement_prompt(
         Please return only the improved prompt, nothing else. Do not include 'improved prompt' at the beginning."""
 
 
+def improver_prompt(improvement_prompt: str) -> str:
+    """The full prompt sent to the model to improve a prompt"""
+    return f"{IMPROVER_SYSTEM_MESSAGE}\n\n{improvement_prompt}"
+
+
+def render_test_case(prompt: str, test_case: Dict) -> str:
+    """Format a prompt with a test case's variables"""
+    for key, value in test_case.items():
+        if key != "expected_output":
+            prompt = prompt.replace(f"{{{key}}}", str(value))
+    return prompt
+
+
 async def get_improved_prompt(
     improvement_prompt: str,
     provider: str,
@@ -1163,29 +1331,31 @@ async def get_improved_prompt(
     max_tokens: int,
     top_p: float,
     top_k: Optional[int] = None,
-) -> str:
-    """Get an improved prompt using the same provider/model as the prompt system."""
-    try:
-        system_message = (
-            "You are an expert prompt engineer. Provide clear, specific, and effective prompt improvements."
-        )
-        full_prompt = f"{system_message}\n\n{improvement_prompt}"
+    job_id: Optional[str] = None,
+) -> Tuple[str, float]:
+    """Get an improved prompt using the same provider/model as the prompt system.
 
-        return await call_llm(
-            prompt=full_prompt,
+    Returns the prompt and the cost of the call; an empty prompt on failure.
+    """
+    try:
+        response = await generate(
+            prompt=improver_prompt(improvement_prompt),
             provider=provider,
             model=model,
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=top_p,
             top_k=top_k,
+            priority="optimizer",
+            job_id=job_id,
         )
+        return response.text, response.cost_usd or 0.0
     except HTTPException as e:
         print(f"Error getting improved prompt: {e.detail}")
-        return ""
+        return "", 0.0
     except Exception as e:
         print(f"Error getting improved prompt: {str(e)}")
-        return ""
+        return "", 0.0
 
 
 async def test_improved_prompt(
@@ -1193,46 +1363,44 @@ async def test_improved_prompt(
     prompt_system: PromptSystem,
     regression_set: List[Dict],
     evaluation_method: str,
-) -> float:
-    """Test the improved prompt and return the average score"""
+    job_id: Optional[str] = None,
+) -> Tuple[float, float]:
+    """Test the improved prompt on the given cases; returns the average score
+    and the cost of the calls"""
+    outputs = []
+    cost = 0.0
     try:
-        scores = []
-
-        for test_case in regression_set[:10]:  # Test with first 10 cases for speed
-            # Format the prompt with test case variables
-            formatted_prompt = improved_prompt
-            for key, value in test_case.items():
-                if key != "expected_output":
-                    formatted_prompt = formatted_prompt.replace(
-                        f"{{{key}}}", str(value)
-                    )
-
-            # Call the LLM using the improved call_openai function
-            predicted_output = await call_llm(
-                prompt=formatted_prompt,
+        for test_case in regression_set:
+            # Call the LLM through the shared cache and dispatch queue
+            response = await generate(
+                prompt=render_test_case(improved_prompt, test_case),
                 provider=prompt_system.provider,
                 model=prompt_system.model,
                 temperature=prompt_system.temperature,
                 max_tokens=prompt_system.max_tokens,
                 top_p=prompt_system.top_p,
                 top_k=prompt_system.top_k,
+                priority="optimizer",
+                job_id=job_id,
             )
-
-            # Evaluate the result
-            score = evaluate_output(
-                predicted_output, test_case["expected_output"], evaluation_method
-            )
-            scores.append(score)
-
+            cost += response.cost_usd or 0.0
+            outputs.append(response.text)
+
+        # Evaluate the results
+        scores = await scoring_pool.evaluate(
+            outputs,
+            [test_case["expected_output"] for test_case in regression_set],
+            evaluation_method,
+        )
         avg_score = sum(scores) / len(scores) if scores else 0.0
-        return avg_score
+        return avg_score, cost
 
     except HTTPException as e:
         print(f"Error testing improved prompt: {e.detail}")
-        return 0.0
+        return 0.0, cost
     except Exception as e:
         print(f"Error testing improved prompt: {str(e)}")
-        return 0.0
+        return 0.0, cost
 
 
 @app.get("/prompt-optimizer/{optimization_id}/status")
@@ -1380,10 +1548,71 @@ async def startup_event():
             run_migration()
         except Exception:
             pass
+
+        # Run call metrics migration
+        try:
+            from app.migrations.m006_call_metrics import run_migration
+            run_migration()
+        except Exception:
+            pass
+
+        # Run streaming metrics migration
+        try:
+            from app.migrations.m007_streaming_metrics import run_migration
+            run_migration()
+        except Exception:
+            pass
+
+        # Run batch execution mode migration
+        try:
+            from app.migrations.m008_execution_mode import run_migration
+            run_migration()
+        except Exception:
+            pass
+
+        # Run call cost migration
+        try:
+            from app.migrations.m009_call_costs import run_migration
+            run_migration()
+        except Exception:
+            pass
+
+        # Seed per-model stats from existing results
+        try:
+            from app.migrations.m010_model_stats import run_migration
+            run_migration()
+        except Exception:
+            pass
+
+        # Run auto max_tokens migration
+        try:
+            from app.migrations.m011_auto_max_tokens import run_migration
+            run_migration()
+        except Exception:
+            pass
+
+        # Run cassette migration
+        try:
+            from app.migrations.m012_cassettes import run_migration
+            run_migration()
+        except Exception:
+            pass
+    # Tokenizer vocabularies may need downloading; not on the event loop
+    await asyncio.to_thread(load_encodings)
     # Load existing schedules
     await scheduler.load_existing_schedules()
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Release pooled provider connections
+    await close_openai_client()
+    await close_ollama_client()
+    await close_async_redis()
+    # Stop the scoring workers
+    scoring_pool.shutdown()
+
+
 if __name__ == "__main__":
     import uvicorn
 
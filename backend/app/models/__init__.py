@@ -4,4 +4,6 @@ from app.models.test_result import TestResult
 from app.models.test_schedule import TestSchedule
 from app.models.model_comparison import ModelComparison
 from app.models.model_comparison_result import ModelComparisonResult
+from app.models.model_stats import ModelStats
+from app.models.output_length_stats import OutputLengthStats
  
@@ -15,6 +15,12 @@ class ModelComparisonResult(Base):
     provider = Column(String)
     avg_score = Column(Float)
     total_samples = Column(Integer)
+    p50_latency_ms = Column(Float, nullable=True)
+    p95_latency_ms = Column(Float, nullable=True)
+    p50_ttft_ms = Column(Float, nullable=True)
+    p95_ttft_ms = Column(Float, nullable=True)
+    total_tokens = Column(Integer, nullable=True)
+    total_cost_usd = Column(Float, nullable=True)
     status = Column(String, default="completed")
     created_at = Column(DateTime, default=datetime.utcnow)
 
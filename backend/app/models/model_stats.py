@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+from app.db.session import Base
+
+
+class ModelStats(Base):
+    """Running latency and output-length distributions of one provider/model,
+    updated as results are saved so estimates never scan the results tables"""
+
+    __tablename__ = "model_stats"
+
+    id = Column(String, primary_key=True, index=True)  # "provider:model"
+    provider = Column(String)
+    model = Column(String)
+    samples = Column(Integer, default=0)
+    # QuantileSketch JSON of per-call latency (ms) and completion tokens
+    latency_sketch = Column(Text, nullable=True)
+    completion_tokens_sketch = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
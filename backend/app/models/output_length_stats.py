@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+
+from app.db.session import Base
+
+
+class OutputLengthStats(Base):
+    """Running distribution of a prompt system's output lengths on one model,
+    from which the "auto" max_tokens mode derives its cap"""
+
+    __tablename__ = "output_length_stats"
+
+    id = Column(String, primary_key=True, index=True)  # "prompt_system_id:model"
+    prompt_system_id = Column(String, ForeignKey("prompt_systems.id"))
+    model = Column(String)
+    samples = Column(Integer, default=0)
+    # QuantileSketch JSON of completion tokens per output
+    completion_tokens_sketch = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -17,6 +17,8 @@ class PromptSystem(Base):
     model = Column(String)
     temperature = Column(Float)
     max_tokens = Column(Integer)
+    # "fixed" sends max_tokens as is; "auto" caps it from past output lengths
+    max_tokens_mode = Column(String, default="fixed")
     top_p = Column(Float)
     top_k = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
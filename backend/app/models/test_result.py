@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Float, ForeignKey, String, Text
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, String, Text
 from sqlalchemy.orm import relationship
 
 from app.db.session import Base
@@ -15,6 +15,19 @@ class TestResult(Base):
     predicted_output = Column(Text)
     score = Column(Float)
     evaluation_method = Column(String)
+    latency_ms = Column(Float, nullable=True)
+    ttfb_ms = Column(Float, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    retries = Column(Integer, nullable=True)
+    cache_hit = Column(Boolean, nullable=True)
+    ttft_ms = Column(Float, nullable=True)
+    inter_token_ms = Column(Float, nullable=True)
+    stopped_early = Column(Boolean, nullable=True)
+    cost_usd = Column(Float, nullable=True)
+    # The max_tokens the call was sent with, and whether the output reached it
+    max_tokens = Column(Integer, nullable=True)
+    capped = Column(Boolean, nullable=True)
 
     test_run = relationship("TestRun", back_populates="results")
 
@@ -14,6 +14,12 @@ class TestRun(Base):
     test_schedule_id = Column(String, ForeignKey("test_schedules.id"), nullable=True)
     avg_score = Column(Float, nullable=True)
     total_samples = Column(Integer, nullable=True)
+    p50_latency_ms = Column(Float, nullable=True)
+    p95_latency_ms = Column(Float, nullable=True)
+    p50_ttft_ms = Column(Float, nullable=True)
+    p95_ttft_ms = Column(Float, nullable=True)
+    total_tokens = Column(Integer, nullable=True)
+    total_cost_usd = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     prompt_system = relationship("PromptSystem", back_populates="test_runs")
@@ -18,6 +18,12 @@ class TestSchedule(Base):
     email_notifications = Column(Boolean, default=False)
     email_recipients = Column(Text, nullable=True)
     alert_threshold = Column(Float, default=0.2)
+    # "realtime" (one call per sample) or "batch" (OpenAI Batch API)
+    execution_mode = Column(String, default="realtime")
+    # Record responses to, or replay them from, a cassette ("off", "record",
+    # "replay"; see app.services.cassette)
+    cassette_mode = Column(String, default="off")
+    cassette = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     last_run_at = Column(DateTime, nullable=True)
     next_run_at = Column(DateTime, nullable=True)
@@ -0,0 +1,311 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+
+from app.services.cache import cache_key, response_cache
+from app.services.llm import LLMResponse
+from app.services.resilience import (
+    LLM_ATTEMPT_TIMEOUT,
+    RETRYABLE_STATUS_CODES,
+    ProviderError,
+    call_with_retries,
+    parse_retry_after,
+)
+from app.services.tokens import call_cost, count_tokens
+
+
+# OpenAI Batch API: requests are queued and processed within the completion
+# window at a discount, with a separate (much larger) quota
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_BATCH_COMPLETION_WINDOW = os.getenv("OPENAI_BATCH_COMPLETION_WINDOW", "24h")
+OPENAI_BATCH_POLL_SECONDS = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", "30"))
+# Give up (and cancel the batch) after this long
+OPENAI_BATCH_TIMEOUT_SECONDS = float(
+    os.getenv("OPENAI_BATCH_TIMEOUT_SECONDS", str(25 * 3600))
+)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch states after which nothing more will happen
+FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+# A completed request, or the error message of a failed one
+BatchResult = Union[LLMResponse, str]
+
+
+def batch_line(
+    custom_id: str,
+    prompt: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """One request of a batch input file, in the chat-completions format"""
+    body: Dict[str, Any] = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+    }
+    if seed is not None:
+        body["seed"] = seed
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }
+
+
+def parse_batch_output(content: str) -> Dict[str, BatchResult]:
+    """Map each custom_id in a batch output or error file to a response, or
+    to an error message"""
+    results: Dict[str, BatchResult] = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item["custom_id"]
+        response = item.get("response") or {}
+        body = response.get("body") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            error = item.get("error") or body.get("error") or {}
+            message = error.get("message") if isinstance(error, dict) else error
+            results[custom_id] = (
+                f"OpenAI batch request failed: "
+                f"{message or response.get('status_code')}"
+            )
+            continue
+        usage = body.get("usage") or {}
+        results[custom_id] = LLMResponse(
+            text=(body["choices"][0]["message"]["content"] or "").strip(),
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+        )
+    return results
+
+
+def get_batch_http_client() -> httpx.AsyncClient:
+    """HTTP client for the Batch and Files endpoints of the OpenAI API"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ProviderError(
+            500, "OpenAI API key not found in environment variables"
+        )
+    return httpx.AsyncClient(
+        base_url=OPENAI_BASE_URL,
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    )
+
+
+class OpenAIBatchRunner:
+    """Run a set of chat completions through the OpenAI Batch API.
+
+    The requests are written to a JSONL file, uploaded and submitted as one
+    batch, which is polled until it reaches a final state; the output and
+    error files are then read back and matched to the requests by
+    ``custom_id``. Cached responses are served without entering the batch,
+    and fresh ones are written to the response cache.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        poll_seconds: float = OPENAI_BATCH_POLL_SECONDS,
+        timeout: float = OPENAI_BATCH_TIMEOUT_SECONDS,
+        completion_window: str = OPENAI_BATCH_COMPLETION_WINDOW,
+    ):
+        self.client = client
+        self.poll_seconds = poll_seconds
+        self.timeout = timeout
+        self.completion_window = completion_window
+
+    async def _send(self, method: str, url: str, timeout: float, **kwargs):
+        try:
+            response = await self.client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.HTTPError as e:
+            raise ProviderError(503, f"OpenAI batch API error: {e}", retryable=True)
+        if response.status_code == 401:
+            raise ProviderError(
+                401, "Invalid OpenAI API key. Please check your API key configuration."
+            )
+        if response.status_code >= 400:
+            retryable = response.status_code in RETRYABLE_STATUS_CODES
+            raise ProviderError(
+                response.status_code if retryable else 502,
+                f"OpenAI batch API error {response.status_code}: {response.text}",
+                retryable=retryable,
+                retry_after=parse_retry_after(response.headers.get("retry-after")),
+            )
+        return response
+
+    async def _request(
+        self, method: str, url: str, retry: bool = True, **kwargs
+    ) -> httpx.Response:
+        """One Batch or Files API call, retried with backoff on transient
+        errors unless ``retry`` is False"""
+
+        async def attempt(timeout: float) -> httpx.Response:
+            return await self._send(method, url, timeout, **kwargs)
+
+        if not retry:
+            return await attempt(LLM_ATTEMPT_TIMEOUT)
+        # The Batch API has its own quota; it does not share the realtime
+        # provider's circuit
+        response, _ = await call_with_retries(None, attempt)
+        return response
+
+    async def submit(self, lines: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Upload the input file and create the batch"""
+        content = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        upload = await self._request(
+            "POST",
+            "files",
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", content, "application/jsonl")},
+        )
+        # Not retried: a create that timed out may still have made the batch
+        batch = await self._request(
+            "POST",
+            "batches",
+            retry=False,
+            json={
+                "input_file_id": upload.json()["id"],
+                "endpoint": BATCH_ENDPOINT,
+                "completion_window": self.completion_window,
+            },
+        )
+        return batch.json()
+
+    async def wait(self, batch_id: str) -> Dict[str, Any]:
+        """Poll a batch until it reaches a final state; cancel it on timeout.
+
+        A poll that still fails after its retries is skipped, not fatal: the
+        batch keeps running remotely, and its results are paid for.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                batch = (await self._request("GET", f"batches/{batch_id}")).json()
+            except ProviderError as e:
+                if not e.retryable:
+                    raise
+                print(f"OpenAI batch {batch_id}: poll failed, will retry: {e.detail}")
+                batch = {"status": None}
+            if batch["status"] in FINAL_STATES:
+                return batch
+            if time.monotonic() >= deadline:
+                await self._request("POST", f"batches/{batch_id}/cancel")
+                raise ProviderError(
+                    504, f"OpenAI batch {batch_id} did not finish in time"
+                )
+            await asyncio.sleep(self.poll_seconds)
+
+    async def results(self, batch: Dict[str, Any]) -> Dict[str, BatchResult]:
+        results: Dict[str, BatchResult] = {}
+        for field in ("error_file_id", "output_file_id"):
+            if batch.get(field):
+                content = await self._request("GET", f"files/{batch[field]}/content")
+                results.update(parse_batch_output(content.text))
+        return results
+
+    async def run(
+        self,
+        requests: Dict[str, str],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        top_p: float,
+        top_k: Optional[int] = None,
+        seed: Optional[int] = None,
+        cache_policy: str = "auto",
+    ) -> Dict[str, BatchResult]:
+        """Complete ``requests`` (id -> prompt); returns id -> response or error.
+
+        Responses are cached under the same keys as realtime calls with these
+        settings (see app.services.cache.cache_key), so either warms the
+        other; ``top_k`` is part of the key only, as OpenAI does not take it.
+        """
+        use_cache = response_cache.should_use(cache_policy, temperature, seed)
+        keys = {
+            request_id: cache_key(
+                "openai", model, prompt, temperature, max_tokens, top_p, top_k, seed
+            )
+            for request_id, prompt in requests.items()
+        }
+        results: Dict[str, BatchResult] = {}
+        if use_cache and cache_policy != "refresh":
+            for request_id, key in keys.items():
+                cached = await response_cache.get(key)
+                if cached is not None:
+                    results[request_id] = LLMResponse(
+                        text=cached, cache_hit=True, cost_usd=0.0
+                    )
+
+        pending = [request_id for request_id in requests if request_id not in results]
+        if not pending:
+            return results
+
+        started = time.monotonic()
+        batch = await self.submit(
+            [
+                batch_line(
+                    request_id,
+                    requests[request_id],
+                    model,
+                    temperature,
+                    max_tokens,
+                    top_p,
+                    seed,
+                )
+                for request_id in pending
+            ]
+        )
+        print(f"OpenAI batch {batch['id']} submitted with {len(pending)} requests")
+        batch = await self.wait(batch["id"])
+        if batch["status"] in ("failed", "cancelled"):
+            errors = (batch.get("errors") or {}).get("data") or []
+            detail = "; ".join(e.get("message", "") for e in errors)
+            raise ProviderError(
+                502, f"OpenAI batch {batch['id']} {batch['status']}: {detail}"
+            )
+
+        fetched = await self.results(batch)
+        # A batch is timed as a whole; every request shares its latency
+        latency_ms = (time.monotonic() - started) * 1000
+        for request_id in pending:
+            response = fetched.get(request_id)
+            if response is None:
+                results[request_id] = (
+                    f"OpenAI batch {batch['id']} {batch['status']} without a "
+                    f"result for this request"
+                )
+                continue
+            if isinstance(response, LLMResponse):
+                response.latency_ms = latency_ms
+                if response.prompt_tokens is None:
+                    response.prompt_tokens = count_tokens(requests[request_id], model)
+                if response.completion_tokens is None:
+                    response.completion_tokens = count_tokens(response.text, model)
+                response.cost_usd = call_cost(
+                    "openai",
+                    model,
+                    response.prompt_tokens,
+                    response.completion_tokens,
+                    batch=True,
+                )
+                if use_cache:
+                    await response_cache.set(keys[request_id], response.text)
+            results[request_id] = response
+        print(
+            f"OpenAI batch {batch['id']} {batch['status']}: "
+            f"{batch.get('request_counts')}"
+        )
+        return results
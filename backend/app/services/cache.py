@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.db.redis_client import get_async_redis
+
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("LLM_CACHE_LOCAL_MAX_ENTRIES", "2048"))
+LLM_CACHE_REDIS_MAX_ENTRIES = int(os.getenv("LLM_CACHE_REDIS_MAX_ENTRIES", "100000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 86400)))
+LLM_CACHE_MAX_VALUE_BYTES = int(os.getenv("LLM_CACHE_MAX_VALUE_BYTES", "65536"))
+
+LLM_CACHE_PREFIX = "llm_cache:"
+LLM_CACHE_INDEX_KEY = "llm_cache_index"
+
+# Per-request cache policies:
+#   auto    - read and write only when the request is deterministic
+#             (temperature 0 or a pinned seed)
+#   always  - read and write regardless of sampling settings
+#   refresh - skip the read, call the model and overwrite the entry
+#   off     - bypass the cache entirely
+CACHE_POLICIES = ("auto", "always", "refresh", "off")
+
+# After a Redis error the remote tier is skipped for this long
+REDIS_RETRY_SECONDS = 30.0
+
+
+def cache_key(
+    provider: str,
+    model: str,
+    prompt: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    top_k: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> str:
+    """Build a cache key from the provider, model, sampling params and prompt hash"""
+    params = json.dumps(
+        {
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "top_k": top_k,
+            "seed": seed,
+        },
+        sort_keys=True,
+    )
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    params_hash = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+    return f"{provider}:{model}:{params_hash}:{prompt_hash}"
+
+
+class LRUCache:
+    """Bounded in-process LRU map"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ResponseCache:
+    """Two-tier LLM response cache: an in-process LRU in front of Redis.
+
+    The Redis tier expires entries after a TTL and keeps an index sorted by
+    write time so that the oldest entries are evicted once it grows past
+    ``redis_max_entries``. Redis errors never fail a call; the tier is
+    skipped for a while instead.
+    """
+
+    def __init__(
+        self,
+        local_max_entries: int = LLM_CACHE_LOCAL_MAX_ENTRIES,
+        redis_max_entries: int = LLM_CACHE_REDIS_MAX_ENTRIES,
+        ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+        max_value_bytes: int = LLM_CACHE_MAX_VALUE_BYTES,
+        enabled: bool = LLM_CACHE_ENABLED,
+    ):
+        self.local = LRUCache(local_max_entries)
+        self.redis_max_entries = redis_max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_value_bytes = max_value_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._redis_retry_at = 0.0
+
+    def should_use(self, policy: str, temperature: float, seed: Optional[int]) -> bool:
+        if not self.enabled or policy == "off":
+            return False
+        if policy == "auto":
+            return temperature == 0 or seed is not None
+        return True
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, e: Exception):
+        print(f"LLM cache: Redis tier unavailable, skipping it: {e}")
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.local.get(key)
+        if value is None and self._redis_available():
+            try:
+                value = await get_async_redis().get(f"{LLM_CACHE_PREFIX}{key}")
+            except Exception as e:
+                self._redis_failed(e)
+            if value is not None:
+                self.local.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        if len(value.encode("utf-8")) > self.max_value_bytes:
+            return
+        self.local.set(key, value)
+        if not self._redis_available():
+            return
+        try:
+            client = get_async_redis()
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.set(f"{LLM_CACHE_PREFIX}{key}", value, ex=self.ttl_seconds)
+                pipe.zadd(LLM_CACHE_INDEX_KEY, {key: time.time()})
+                pipe.zcard(LLM_CACHE_INDEX_KEY)
+                _, _, size = await pipe.execute()
+            if size > self.redis_max_entries:
+                evicted = await client.zpopmin(
+                    LLM_CACHE_INDEX_KEY, size - self.redis_max_entries
+                )
+                if evicted:
+                    await client.delete(
+                        *[f"{LLM_CACHE_PREFIX}{k}" for k, _ in evicted]
+                    )
+        except Exception as e:
+            self._redis_failed(e)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "local_entries": len(self.local),
+        }
+
+
+# Global cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,106 @@
+import json
+import os
+import re
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+
+# Cassettes are JSONL files in this directory, one per name
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+DEFAULT_CASSETTE = "default"
+
+# Per-request cassette modes:
+#   off    - call the model as usual
+#   record - call the model and append the response to the cassette
+#   replay - answer from the cassette only; a request it lacks is an error
+CASSETTE_MODES = ("off", "record", "replay")
+
+_CASSETTE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class Cassette:
+    """Append-only log of LLM responses addressed by request content.
+
+    Each line holds a request key (see app.services.cache.cache_key) and the
+    response text, token counts and early-stop flag; a later line for the
+    same key supersedes earlier ones. Lines appended by other processes are
+    picked up when a lookup misses, and a torn final line left by a crash is
+    ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Dict] = {}
+        self._offset = 0
+        self._fd: Optional[int] = None
+
+    def _catch_up(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only whole lines; a partial one is still being written (or torn)
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+                self._entries[entry["key"]] = entry
+            except (ValueError, KeyError):
+                print(f"Cassette {self.path}: skipping unreadable line")
+        self._offset += end
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._catch_up()
+            entry = self._entries.get(key)
+        return entry
+
+    def record(self, key: str, entry: Dict):
+        entry = {"key": key, **entry}
+        if self._entries.get(key) == entry:
+            return
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # One write per line so concurrent writers never interleave
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+        os.write(self._fd, line.encode("utf-8"))
+        self._entries[key] = entry
+
+    def __len__(self) -> int:
+        self._catch_up()
+        return len(self._entries)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+_cassettes: Dict[str, Cassette] = {}
+
+
+def get_cassette(name: Optional[str] = None) -> Cassette:
+    """The named cassette, loaded once per process"""
+    name = name or DEFAULT_CASSETTE
+    check_cassette("replay", name)
+    path = os.path.join(LLM_CASSETTE_DIR, f"{name}.jsonl")
+    if path not in _cassettes:
+        cassette = Cassette(path)
+        cassette._catch_up()
+        _cassettes[path] = cassette
+    return _cassettes[path]
+
+
+def check_cassette(mode: str, name: Optional[str] = None):
+    """Reject an unknown cassette mode or a name that is not a plain file name"""
+    if mode not in CASSETTE_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported cassette mode: {mode}"
+        )
+    if name is not None and not _CASSETTE_NAME.match(name):
+        raise HTTPException(status_code=400, detail=f"Invalid cassette name: {name}")
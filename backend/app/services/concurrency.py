@@ -0,0 +1,167 @@
+import asyncio
+import math
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+LLM_ADAPTIVE_CONCURRENCY = (
+    os.getenv("LLM_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+)
+# Starting in-flight limit per provider/model; the provider's
+# *_MAX_CONCURRENCY setting is the ceiling
+LLM_AIMD_INITIAL_LIMIT = float(os.getenv("LLM_AIMD_INITIAL_LIMIT", "4"))
+# Factor applied to the limit on a 429, a timeout or a latency spike
+LLM_AIMD_DECREASE_FACTOR = float(os.getenv("LLM_AIMD_DECREASE_FACTOR", "0.5"))
+# A call slower than this multiple of the baseline latency counts as a spike
+LLM_AIMD_LATENCY_TOLERANCE = float(
+    os.getenv("LLM_AIMD_LATENCY_TOLERANCE", "2.0")
+)
+
+# Weight of each new sample in the baseline latency average
+BASELINE_ALPHA = 0.1
+
+
+class AdaptiveLimiter:
+    """In-flight limit for one provider/model, adjusted by AIMD.
+
+    Every successful call at normal latency adds ``1 / limit``, so the limit
+    grows by about one per round trip of calls. A 429, a timeout or a call
+    slower than ``tolerance`` times the baseline cuts the limit by
+    ``decrease_factor``. Only calls started after the previous cut can cause
+    another one, so a burst of failures from the same window counts once.
+
+    Latency is compared per completion token when the provider reports it,
+    so that long outputs are not mistaken for congestion.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        initial_limit: float = LLM_AIMD_INITIAL_LIMIT,
+        min_limit: float = 1.0,
+        decrease_factor: float = LLM_AIMD_DECREASE_FACTOR,
+        tolerance: float = LLM_AIMD_LATENCY_TOLERANCE,
+        adaptive: bool = True,
+    ):
+        self.max_limit = float(max(1, max_limit))
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.limit = max(min_limit, min(initial_limit, self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.decreases = 0
+        self._last_decrease_at = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # asyncio primitives belong to one event loop; a new loop (tests,
+        # scripts) gets a fresh one
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the start time to pass to ``release``"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(self.has_capacity)
+            self.in_flight += 1
+        return time.monotonic()
+
+    def try_acquire(self) -> Optional[float]:
+        """Take a slot if one is free right now; None otherwise"""
+        self._get_condition()
+        if not self.has_capacity():
+            return None
+        self.in_flight += 1
+        return time.monotonic()
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < math.floor(self.limit)
+
+    async def release(
+        self,
+        started: float,
+        overloaded: bool = False,
+        latency: Optional[float] = None,
+        tokens: Optional[int] = None,
+    ):
+        """Free a slot and feed back how the call went.
+
+        ``overloaded`` marks a 429 or timeout. ``latency`` is given for
+        successful calls only; failures of other kinds leave the limit as is.
+        """
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if self.adaptive:
+                self._adjust(started, overloaded, latency, tokens)
+            condition.notify_all()
+
+    def _adjust(
+        self,
+        started: float,
+        overloaded: bool,
+        latency: Optional[float],
+        tokens: Optional[int],
+    ):
+        if overloaded:
+            self._decrease(started)
+            return
+        if latency is None:
+            return
+        cost = latency / tokens if tokens else latency
+        if self.baseline is not None and cost > self.baseline * self.tolerance:
+            self._decrease(started)
+            return
+        if self.baseline is None:
+            self.baseline = cost
+        else:
+            self.baseline += BASELINE_ALPHA * (cost - self.baseline)
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self, started: float):
+        if started < self._last_decrease_at:
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.decreases += 1
+        self._last_decrease_at = time.monotonic()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "baseline_ms": (
+                None if self.baseline is None else round(self.baseline * 1000, 2)
+            ),
+            "decreases": self.decreases,
+        }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(provider: str, model: str, max_limit: int) -> AdaptiveLimiter:
+    key = f"{provider}:{model}"
+    if key not in _limiters:
+        if LLM_ADAPTIVE_CONCURRENCY:
+            _limiters[key] = AdaptiveLimiter(max_limit)
+        else:
+            # Fixed at the provider ceiling
+            _limiters[key] = AdaptiveLimiter(
+                max_limit, initial_limit=max_limit, adaptive=False
+            )
+    return _limiters[key]
+
+
+def concurrency_limits() -> Dict[str, Dict[str, Any]]:
+    """Current in-flight limit of every provider/model seen so far"""
+    return {key: limiter.status() for key, limiter in _limiters.items()}
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+from app.services.concurrency import AdaptiveLimiter
+
+
+# Highest priority first. Interactive test runs are served before scheduled
+# runs, which are served before comparisons and the prompt optimizer.
+PRIORITY_CLASSES = ("interactive", "scheduled", "comparison", "optimizer")
+DEFAULT_PRIORITY = "interactive"
+
+# Most calls each class may have in flight across all models (0 = no cap).
+# A cap on a busy class leaves room for the classes below it.
+CLASS_CAPS = {
+    priority: int(os.getenv(f"LLM_DISPATCH_CAP_{priority.upper()}", "0"))
+    for priority in PRIORITY_CLASSES
+}
+
+# Share of a class a job gets unless its caller gives one (see
+# DispatchQueue); a job weighted 3 gets three slots for every one of a job
+# weighted 1
+DEFAULT_JOB_WEIGHT = float(os.getenv("LLM_DISPATCH_DEFAULT_WEIGHT", "1"))
+
+# Recent queue waits kept per class for the wait time stats
+WAIT_WINDOW = 500
+
+
+@dataclass
+class DispatchTicket:
+    """A granted slot; hand it back to ``DispatchQueue.release``"""
+
+    key: str
+    limiter: AdaptiveLimiter
+    priority: str
+    job_id: str
+    started: float
+
+
+@dataclass
+class _Waiter:
+    future: "asyncio.Future[float]"
+    enqueued: float
+    weight: float
+
+
+class _ModelQueue:
+    """Calls waiting for one provider/model, by class and then by job"""
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.jobs: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_CLASSES
+        }
+
+    def depth(self, priority: str) -> int:
+        return sum(len(waiters) for waiters in self.jobs[priority].values())
+
+
+class DispatchQueue:
+    """Central queue that every LLM call waits in for a concurrency slot.
+
+    Slots come from each model's adaptive limiter. Whenever one frees up it
+    goes to the highest priority class with a waiting call that is under its
+    class cap. Within a class, jobs (test runs, comparisons, optimizer
+    sessions) share in proportion to their weights: the job with the fewest
+    calls in flight per unit of weight goes next, so a 5,000-sample run
+    cannot crowd out a 20-sample one, and a run weighted 3 holds three times
+    the slots of one weighted 1 while both have calls waiting. A job with
+    nothing in flight always goes before one that has calls running.
+    """
+
+    def __init__(self, caps: Optional[Dict[str, int]] = None):
+        self.caps = dict(CLASS_CAPS if caps is None else caps)
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reset()
+
+    def _reset(self):
+        self._queues.clear()
+        self.in_flight = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._job_in_flight: Dict[str, Dict[str, int]] = {
+            priority: {} for priority in PRIORITY_CLASSES
+        }
+        self.granted = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._waits: Dict[str, Deque[float]] = {
+            priority: deque(maxlen=WAIT_WINDOW) for priority in PRIORITY_CLASSES
+        }
+
+    def _check_loop(self):
+        # Waiters belong to one event loop; a new loop (tests, scripts)
+        # starts from an empty queue
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reset()
+            self._loop = loop
+
+    async def acquire(
+        self,
+        key: str,
+        limiter: AdaptiveLimiter,
+        priority: str = DEFAULT_PRIORITY,
+        job_id: Optional[str] = None,
+        weight: float = DEFAULT_JOB_WEIGHT,
+    ) -> DispatchTicket:
+        """Wait for a slot on ``limiter`` in the given priority class, as part
+        of ``job_id`` with its ``weight``"""
+        self._check_loop()
+        job_id = job_id or ""
+        queue = self._queues.get(key)
+        if queue is None or queue.limiter is not limiter:
+            queue = self._queues[key] = _ModelQueue(limiter)
+        waiter = _Waiter(
+            asyncio.get_running_loop().create_future(), time.monotonic(), weight
+        )
+        queue.jobs[priority].setdefault(job_id, deque()).append(waiter)
+        self._pump()
+        try:
+            started = await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up; hand the slot back
+                ticket = DispatchTicket(
+                    key, limiter, priority, job_id, waiter.future.result()
+                )
+                asyncio.ensure_future(self.release(ticket))
+            else:
+                self._discard(queue, priority, job_id, waiter)
+            raise
+        return DispatchTicket(key, limiter, priority, job_id, started)
+
+    async def release(
+        self,
+        ticket: DispatchTicket,
+        overloaded: bool = False,
+        latency: Optional[float] = None,
+        tokens: Optional[int] = None,
+    ):
+        """Free a slot, feeding the call's outcome back to its limiter"""
+        await ticket.limiter.release(ticket.started, overloaded, latency, tokens)
+        self.in_flight[ticket.priority] -= 1
+        jobs = self._job_in_flight[ticket.priority]
+        jobs[ticket.job_id] -= 1
+        if not jobs[ticket.job_id]:
+            del jobs[ticket.job_id]
+        self._pump()
+
+    def _discard(self, queue: _ModelQueue, priority: str, job_id: str, waiter):
+        waiters = queue.jobs[priority].get(job_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue.jobs[priority][job_id]
+
+    def _pump(self):
+        # A freed slot may belong to any model, and a freed class slot may let
+        # a call on another model through, so every queue is looked at
+        for queue in self._queues.values():
+            while self._grant_next(queue):
+                pass
+
+    def _grant_next(self, queue: _ModelQueue) -> bool:
+        for priority in PRIORITY_CLASSES:
+            jobs = queue.jobs[priority]
+            if not jobs:
+                continue
+            cap = self.caps.get(priority, 0)
+            if cap and self.in_flight[priority] >= cap:
+                continue
+            started = queue.limiter.try_acquire()
+            if started is None:
+                return False
+            running = self._job_in_flight[priority]
+            # Fewest calls in flight per unit of weight first; ties go to the
+            # job queued longest
+            job_id = min(
+                jobs,
+                key=lambda job: (
+                    running.get(job, 0) / jobs[job][0].weight,
+                    jobs[job][0].enqueued,
+                ),
+            )
+            waiter = jobs[job_id].popleft()
+            if not jobs[job_id]:
+                del jobs[job_id]
+            self.in_flight[priority] += 1
+            running[job_id] = running.get(job_id, 0) + 1
+            self.granted[priority] += 1
+            self._waits[priority].append(time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(started)
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        classes = {}
+        for priority in PRIORITY_CLASSES:
+            waits = self._waits[priority]
+            classes[priority] = {
+                "queued": sum(q.depth(priority) for q in self._queues.values()),
+                "in_flight": self.in_flight[priority],
+                "cap": self.caps.get(priority, 0) or None,
+                "jobs": len(self._job_in_flight[priority]),
+                "granted": self.granted[priority],
+                "avg_wait_ms": (
+                    round(sum(waits) / len(waits) * 1000, 2) if waits else None
+                ),
+                "max_wait_ms": round(max(waits) * 1000, 2) if waits else None,
+            }
+        return {
+            "classes": classes,
+            "queued_by_model": {
+                key: sum(queue.depth(p) for p in PRIORITY_CLASSES)
+                for key, queue in self._queues.items()
+            },
+        }
+
+
+# Global dispatch queue
+dispatch_queue = DispatchQueue()
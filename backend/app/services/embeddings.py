@@ -0,0 +1,249 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+import numpy as np
+from fastapi import HTTPException
+
+from app.services.fake_llm import FakeLLMConfig, fake_embeddings
+from app.services.llm import get_ollama_client
+from app.services.ollama_pool import ollama_pool
+
+
+# "ollama" embeds through the Ollama nodes' /api/embed; "fake" uses the
+# in-process stand-in from app.services.fake_llm
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "ollama")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+# Texts sent per embedding request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Vector stores live in this directory, one subdirectory per model
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "embeddings")
+
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def content_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class VectorStore:
+    """Append-only on-disk store of float32 vectors addressed by content hash.
+
+    ``vectors.f32`` holds the rows back to back and ``keys.txt`` a header
+    line with the dimensions, then one key per row in row order. Rows are
+    read through a memory map, so a run only pages in the vectors it uses.
+    Appends hold an exclusive lock on the key file, so processes can share a
+    store: keys appended by others are picked up when a lookup misses, and
+    vector bytes whose key never reached the disk (a crash mid-append) are
+    dropped by the next append. Methods block on file I/O and are safe to
+    call from worker threads.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.dimensions: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._offset = 0
+        self._map: Optional[np.memmap] = None
+        self.reused = 0
+        self.embedded = 0
+        self._lock = threading.Lock()
+
+    def _catch_up(self):
+        try:
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only whole lines; a partial one is still being written (or torn)
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            if self.dimensions is None:
+                self.dimensions = int(line.split()[1])
+            else:
+                self._rows.setdefault(line, len(self._rows))
+        self._offset += end
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def lookup(self, keys: Sequence[str]) -> List[Optional[int]]:
+        """Row of each key, or None for keys not in the store"""
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._catch_up()
+            return [self._rows.get(key) for key in keys]
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """The vectors at ``rows``, copied out of the memory map"""
+        with self._lock:
+            if self._map is None or len(self._map) < len(self._rows):
+                self._map = np.memmap(
+                    self.vectors_path,
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(len(self._rows), self.dimensions),
+                )
+            return self._map[rows]
+
+    def append(self, keys: Sequence[str], vectors: np.ndarray):
+        """Add vectors for keys the store does not already hold"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.keys_path, "ab") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                fresh: Dict[str, int] = {}
+                for i, key in enumerate(keys):
+                    if key not in self._rows:
+                        fresh.setdefault(key, i)
+                if not fresh:
+                    return
+                dimensions = vectors.shape[1]
+                if self.dimensions is not None and dimensions != self.dimensions:
+                    raise ValueError(
+                        f"Vectors have {dimensions} dimensions; the store at "
+                        f"{self.directory} holds {self.dimensions}"
+                    )
+                # Drop any torn key line and any rows whose keys were lost
+                keys_file.truncate(self._offset)
+                if self.dimensions is None:
+                    keys_file.write(f"dim {dimensions}\n".encode("utf-8"))
+                row_bytes = dimensions * 4
+                with open(self.vectors_path, "ab") as vectors_file:
+                    vectors_file.truncate(len(self._rows) * row_bytes)
+                    block = vectors[list(fresh.values())].astype(np.float32)
+                    vectors_file.write(block.tobytes())
+                keys_file.write("".join(f"{key}\n" for key in fresh).encode("utf-8"))
+                keys_file.flush()
+                self._catch_up()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows": len(self._rows),
+            "dimensions": self.dimensions,
+            "reused": self.reused,
+            "embedded": self.embedded,
+        }
+
+
+_stores: Dict[str, VectorStore] = {}
+
+
+def get_store(model: str) -> VectorStore:
+    """The model's vector store, loaded once per process"""
+    directory = os.path.join(EMBEDDING_STORE_DIR, _UNSAFE_NAME.sub("_", model))
+    if directory not in _stores:
+        # Read from disk on its first lookup, off the event loop
+        _stores[directory] = VectorStore(directory)
+    return _stores[directory]
+
+
+def store_stats() -> Dict[str, Dict[str, Any]]:
+    return {directory: store.stats() for directory, store in _stores.items()}
+
+
+async def _embed_batch(texts: List[str], model: str) -> np.ndarray:
+    if EMBEDDING_PROVIDER == "fake":
+        embeddings = fake_embeddings(texts, FakeLLMConfig().embedding_dim)
+        return np.asarray(embeddings, np.float32)
+    client = get_ollama_client()
+    try:
+        async with ollama_pool.route(model, client) as base_url:
+            response = await client.post(
+                f"{base_url}/api/embed", json={"model": model, "input": texts}
+            )
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Embedding request failed: {e}")
+    embeddings = response.json().get("embeddings") or []
+    if len(embeddings) != len(texts):
+        raise HTTPException(
+            status_code=502,
+            detail=f"Embedding request returned {len(embeddings)} vectors "
+            f"for {len(texts)} texts",
+        )
+    return np.asarray(embeddings, np.float32)
+
+
+async def embed(texts: List[str], model: str) -> np.ndarray:
+    """Embeddings of ``texts``, EMBEDDING_BATCH_SIZE texts per request"""
+    batches = await asyncio.gather(
+        *(
+            _embed_batch(texts[start : start + EMBEDDING_BATCH_SIZE], model)
+            for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+        )
+    )
+    return np.vstack(batches)
+
+
+def _pair_vectors(
+    store: VectorStore,
+    p_keys: Sequence[Optional[str]],
+    e_keys: Sequence[Optional[str]],
+):
+    """Predicted and expected vectors, one row per pair; zeros for empty texts"""
+    pairs = []
+    for keys in (p_keys, e_keys):
+        matrix = np.zeros((len(keys), store.dimensions), np.float32)
+        present = np.array([key is not None for key in keys], bool)
+        rows = store.lookup([key for key in keys if key is not None])
+        matrix[present] = store.vectors(np.array(rows, np.int64))
+        pairs.append(matrix)
+    return pairs
+
+
+async def embedding_similarity(
+    predicted: Sequence[str], expected: Sequence[str], model: Optional[str] = None
+) -> List[float]:
+    """Cosine similarity of the embeddings of each predicted output and its
+    expected output.
+
+    Vectors are kept in the model's store under the hash of their text, so a
+    text is embedded once: repeat runs only embed outputs not seen before.
+    Two empty texts score 1.0, one empty text 0.0, and opposed vectors 0.0.
+    """
+    model = model or EMBEDDING_MODEL
+    store = get_store(model)
+    p_keys = [content_key(text) if text else None for text in predicted]
+    e_keys = [content_key(text) if text else None for text in expected]
+    texts = {
+        key: text
+        for key, text in zip(p_keys + e_keys, [*predicted, *expected])
+        if key is not None
+    }
+    # Store reads and appends block on disk (and on other processes' locks),
+    # so they run in threads
+    rows = await asyncio.to_thread(store.lookup, list(texts))
+    missing = [key for key, row in zip(texts, rows) if row is None]
+    if missing:
+        vectors = await embed([texts[key] for key in missing], model)
+        await asyncio.to_thread(store.append, missing, vectors)
+    store.reused += len(texts) - len(missing)
+    store.embedded += len(missing)
+
+    size = len(predicted)
+    if not texts:
+        return [1.0] * size
+    has_p = np.array([key is not None for key in p_keys], bool)
+    has_e = np.array([key is not None for key in e_keys], bool)
+    p, e = await asyncio.to_thread(_pair_vectors, store, p_keys, e_keys)
+
+    # Every pair's dot product in one batched multiply
+    dots = np.einsum("ij,ij->i", p, e)
+    norms = np.linalg.norm(p, axis=1) * np.linalg.norm(e, axis=1)
+    scores = np.divide(dots, norms, out=np.zeros(size, np.float32), where=norms > 0)
+    scores[~has_p & ~has_e] = 1.0
+    # Rounding can leave identical texts a hair short of 1.0
+    scores[np.array([pk == ek for pk, ek in zip(p_keys, e_keys)], bool)] = 1.0
+    return np.clip(scores, 0.0, 1.0).astype(float).tolist()
@@ -0,0 +1,117 @@
+import difflib
+import operator
+import time
+from functools import partial
+from typing import Dict, FrozenSet, List, Sequence, Tuple
+
+from app.services.semantic import cosine_batch
+from app.services.similarity import indel_ratio
+
+
+EVALUATION_METHODS = (
+    "fuzzy",
+    "exact",
+    "semantic",
+    "contains",
+    "indel",
+    "jaccard",
+    "embedding",
+)
+# Scored by calling a model, so only through app.services.scoring_pool
+ASYNC_METHODS = ("embedding",)
+
+
+def normalize(texts: Sequence[str]) -> List[str]:
+    """Lower-case and strip a column of texts"""
+    return [text.lower().strip() for text in texts]
+
+
+def _word_sets(texts: List[str]) -> List[FrozenSet[str]]:
+    # Each distinct text is split once; str caches its hash, so the set
+    # intersections never rehash a word
+    seen: Dict[str, FrozenSet[str]] = {}
+    sets = []
+    for text in texts:
+        words = seen.get(text)
+        if words is None:
+            words = seen[text] = frozenset(text.split())
+        sets.append(words)
+    return sets
+
+
+def _jaccard(predicted: FrozenSet[str], expected: FrozenSet[str]) -> float:
+    if not expected:
+        return 1.0 if not predicted else 0.0
+    shared = len(predicted & expected)
+    return shared / (len(predicted) + len(expected) - shared)
+
+
+def _sequence_ratio(predicted: str, expected: str, score_cutoff: float = 0.0) -> float:
+    matcher = difflib.SequenceMatcher(None, predicted, expected)
+    if score_cutoff > 0 and (
+        matcher.real_quick_ratio() < score_cutoff
+        or matcher.quick_ratio() < score_cutoff
+    ):
+        return 0.0
+    score = matcher.ratio()
+    return score if score >= score_cutoff else 0.0
+
+
+def evaluate_batch(
+    predicted: Sequence[str],
+    expected: Sequence[str],
+    method: str = "fuzzy",
+    score_cutoff: float = 0.0,
+) -> List[float]:
+    """Score each predicted output against its expected output.
+
+    Methods (all case-insensitive, ignoring surrounding whitespace):
+    "fuzzy" is difflib's sequence similarity, "indel" the same ratio computed
+    exactly by a bit-parallel engine (see app.services.similarity), "exact"
+    and "contains" are 1.0 or 0.0, "semantic" is the TF-IDF cosine of
+    character n-gram vectors (see app.services.semantic), and "jaccard" is
+    the Jaccard index of the word sets. Unknown methods score 0.0. Both
+    columns are normalised once, whatever the method. "embedding" needs a
+    model and is scored by app.services.scoring_pool.ScoringPool.evaluate.
+
+    For "fuzzy" and "indel", scores below ``score_cutoff`` are reported as
+    0.0, and pairs that cannot reach it are abandoned early.
+    """
+    if len(predicted) != len(expected):
+        raise ValueError("predicted and expected must be the same length")
+    if method in ASYNC_METHODS:
+        raise ValueError(f"{method} scores are computed by the scoring pool")
+    if method not in EVALUATION_METHODS:
+        return [0.0] * len(predicted)
+
+    predicted = normalize(predicted)
+    expected = normalize(expected)
+    if method == "exact":
+        return list(map(float, map(operator.eq, predicted, expected)))
+    if method == "contains":
+        return list(map(float, map(operator.contains, predicted, expected)))
+    if method == "semantic":
+        return cosine_batch(predicted, expected)
+    if method == "jaccard":
+        return list(map(_jaccard, _word_sets(predicted), _word_sets(expected)))
+    if method == "indel":
+        ratio = partial(indel_ratio, score_cutoff=score_cutoff)
+    else:
+        ratio = partial(_sequence_ratio, score_cutoff=score_cutoff)
+    return list(map(ratio, predicted, expected))
+
+
+def evaluate_output(
+    predicted: str, expected: str, method: str = "fuzzy", score_cutoff: float = 0.0
+) -> float:
+    """Score a single output; see evaluate_batch"""
+    return evaluate_batch([predicted], [expected], method, score_cutoff)[0]
+
+
+def timed_evaluate_batch(
+    predicted: Sequence[str], expected: Sequence[str], method: str, score_cutoff: float
+) -> Tuple[List[float], float]:
+    """evaluate_batch and the CPU seconds it took; run in scoring pool workers"""
+    started = time.process_time()
+    scores = evaluate_batch(predicted, expected, method, score_cutoff)
+    return scores, time.process_time() - started
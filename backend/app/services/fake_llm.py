@@ -0,0 +1,139 @@
+import hashlib
+import os
+import random
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from app.services.semantic import term_counts
+
+
+# Vocabulary for hash-derived outputs; any fixed list keeps outputs reproducible
+FAKE_VOCABULARY = (
+    "the model answer is a short deterministic reply built from hashed prompt "
+    "tokens so that repeated runs produce identical text for identical input "
+    "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi "
+    "omicron pi rho sigma tau upsilon phi chi psi omega"
+).split()
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+@dataclass
+class FakeLLMConfig:
+    """Behaviour of the fake provider and server, read from FAKE_LLM_* variables.
+
+    ``latency`` is a distribution spec for the time to first token, one of
+    ``fixed:<s>``, ``uniform:<low>,<high>``, ``normal:<mean>,<stddev>`` or
+    ``lognormal:<mu>,<sigma>``. Each further token adds ``token_interval``
+    seconds. ``output`` is ``hash`` (pseudo-words derived from the prompt) or
+    ``echo`` (the prompt itself). Batch jobs complete ``batch_delay`` seconds
+    after submission. Embeddings have ``embedding_dim`` dimensions.
+    """
+
+    latency: str = field(
+        default_factory=lambda: os.getenv("FAKE_LLM_LATENCY", "fixed:0.05")
+    )
+    token_interval: float = field(
+        default_factory=lambda: _env_float("FAKE_LLM_TOKEN_INTERVAL", 0.0)
+    )
+    error_rate: float = field(
+        default_factory=lambda: _env_float("FAKE_LLM_ERROR_RATE", 0.0)
+    )
+    rate_limit_rate: float = field(
+        default_factory=lambda: _env_float("FAKE_LLM_RATE_LIMIT_RATE", 0.0)
+    )
+    retry_after: float = field(
+        default_factory=lambda: _env_float("FAKE_LLM_RETRY_AFTER", 1.0)
+    )
+    min_tokens: int = field(
+        default_factory=lambda: int(os.getenv("FAKE_LLM_MIN_TOKENS", "8"))
+    )
+    max_tokens: int = field(
+        default_factory=lambda: int(os.getenv("FAKE_LLM_MAX_TOKENS", "64"))
+    )
+    output: str = field(default_factory=lambda: os.getenv("FAKE_LLM_OUTPUT", "hash"))
+    # Time a batch job takes from submission to completion
+    batch_delay: float = field(
+        default_factory=lambda: _env_float("FAKE_LLM_BATCH_DELAY", 1.0)
+    )
+    embedding_dim: int = field(
+        default_factory=lambda: int(os.getenv("FAKE_LLM_EMBEDDING_DIM", "256"))
+    )
+    models: List[str] = field(
+        default_factory=lambda: os.getenv(
+            "FAKE_LLM_MODELS", "fake-small,fake-large"
+        ).split(",")
+    )
+
+
+def sample_latency(spec: str, rng: Optional[random.Random] = None) -> float:
+    """Draw a latency in seconds from a ``kind:params`` distribution spec"""
+    rng = rng or random
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        latency = values[0]
+    elif kind == "uniform":
+        latency = rng.uniform(values[0], values[1])
+    elif kind == "normal":
+        latency = rng.gauss(values[0], values[1])
+    elif kind == "lognormal":
+        latency = rng.lognormvariate(values[0], values[1])
+    else:
+        raise ValueError(f"Unsupported latency distribution: {spec}")
+    return max(0.0, latency)
+
+
+def sample_failure(
+    config: FakeLLMConfig, rng: Optional[random.Random] = None
+) -> Optional[int]:
+    """Return 429 or 500 when the call should fail, otherwise None"""
+    roll = (rng or random).random()
+    if roll < config.rate_limit_rate:
+        return 429
+    if roll < config.rate_limit_rate + config.error_rate:
+        return 500
+    return None
+
+
+def fake_tokens(
+    prompt: str,
+    model: str,
+    max_tokens: int,
+    config: FakeLLMConfig,
+    seed: Optional[int] = None,
+) -> List[str]:
+    """Deterministic output tokens for a prompt; the same input always yields
+    the same tokens. Tokens carry their leading space so they can be joined or
+    streamed as-is."""
+    if config.output == "echo":
+        words = prompt.split()
+    else:
+        seed_text = f"{model}\0{seed}\0{prompt}"
+        rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).digest())
+        length = rng.randint(
+            config.min_tokens, max(config.min_tokens, config.max_tokens)
+        )
+        words = [rng.choice(FAKE_VOCABULARY) for _ in range(length)]
+    words = words[: max(0, max_tokens)]
+    return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+
+def count_prompt_tokens(prompt: str) -> int:
+    return len(prompt.split())
+
+
+def fake_embeddings(texts: Sequence[str], dimensions: int) -> List[List[float]]:
+    """Deterministic unit-length embeddings: each text's hashed character
+    n-grams folded into ``dimensions`` signed buckets, so that texts sharing
+    much of their wording get similar vectors"""
+    vectors = np.zeros((len(texts), dimensions), np.float32)
+    for row, (features, counts) in enumerate(term_counts(texts)):
+        weights = np.where(features & 1, 1.0, -1.0) * (1 + np.log(counts))
+        np.add.at(vectors[row], (features >> 1) % dimensions, weights)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms > 0, norms, 1)).tolist()
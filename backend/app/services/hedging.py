@@ -0,0 +1,190 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+# Hedging is opt-in per call; this is the default when a call does not say
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+# A duplicate is sent once a call has run longer than this percentile of the
+# model's recent latencies...
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# ...provided at least this many latencies have been seen
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Hedges allowed per call made (0.05 = at most 5% extra requests), and the
+# most that can be saved up for a burst of slow calls
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+LLM_HEDGE_MAX_BURST = float(os.getenv("LLM_HEDGE_MAX_BURST", "10"))
+
+# Recent latencies kept per provider/model
+LATENCY_WINDOW = 200
+
+
+class SendSignal:
+    """Marks the moment a hedgeable call actually reaches the provider"""
+
+    def __init__(self):
+        self.at: Optional[float] = None
+        self.event = asyncio.Event()
+
+    def mark(self):
+        self.at = time.monotonic()
+        self.event.set()
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies for one provider/model"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._sorted: Optional[list] = None
+
+    def record(self, latency: float):
+        self._latencies.append(latency)
+        self._sorted = None
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._latencies)
+        rank = max(1, math.ceil(q / 100 * len(self._sorted)))
+        return self._sorted[rank - 1]
+
+
+class Hedger:
+    """Send a second copy of a slow call and keep whichever answers first.
+
+    Once a call has been with the provider longer than the model's latency
+    ``percentile`` a duplicate is started; the loser is cancelled as soon as
+    one copy succeeds. Every call earns ``budget`` hedge credits and each hedge spends one, which
+    bounds the extra requests to that fraction of traffic.
+    """
+
+    def __init__(
+        self,
+        percentile: float = LLM_HEDGE_PERCENTILE,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        budget: float = LLM_HEDGE_BUDGET,
+        max_burst: float = LLM_HEDGE_MAX_BURST,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.max_burst = max_burst
+        self.credits = 0.0
+        self.hedges = 0
+        self.hedge_wins = 0
+        # Slow calls left unhedged for lack of budget or a free slot
+        self.hedges_skipped = 0
+        self._trackers: Dict[str, LatencyTracker] = {}
+
+    def tracker(self, key: str) -> LatencyTracker:
+        if key not in self._trackers:
+            self._trackers[key] = LatencyTracker()
+        return self._trackers[key]
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        tracker = self.tracker(key)
+        if len(tracker) < self.min_samples:
+            return None
+        return tracker.percentile(self.percentile)
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[SendSignal], Awaitable[Any]],
+        enabled: bool = LLM_HEDGING,
+        has_capacity: Callable[[], bool] = lambda: True,
+    ) -> Tuple[Any, bool]:
+        """Run ``fn``, hedging it when enabled; returns the result and whether
+        the hedge won.
+
+        ``fn`` calls ``mark()`` on the signal it is given once the request is
+        actually sent, so time spent queueing for quota or a concurrency slot
+        neither delays nor triggers a hedge. No hedge is sent unless
+        ``has_capacity()`` says a slot is free right away.
+        """
+        sent = SendSignal()
+        primary = asyncio.ensure_future(fn(sent))
+        hedge = None
+        try:
+            if enabled:
+                self.credits = min(self.max_burst, self.credits + self.budget)
+                delay = self.hedge_delay(key)
+                if delay is not None and await self._wait_sent(primary, sent):
+                    done, _ = await asyncio.wait({primary}, timeout=delay)
+                    if not done and self.credits >= 1 and has_capacity():
+                        self.credits -= 1
+                        self.hedges += 1
+                        hedge = asyncio.ensure_future(fn(SendSignal()))
+                    elif not done:
+                        self.hedges_skipped += 1
+            if hedge is None:
+                result = await primary
+                won_by_hedge = False
+            else:
+                result, won_by_hedge = await self._first_success(primary, hedge)
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+                    # Retrieve the loser's outcome so it is not logged as lost
+                    task.add_done_callback(
+                        lambda t: t.cancelled() or t.exception()
+                    )
+
+        if sent.at is not None:
+            self.tracker(key).record(time.monotonic() - sent.at)
+        if won_by_hedge:
+            self.hedge_wins += 1
+        return result, won_by_hedge
+
+    async def _wait_sent(
+        self, primary: "asyncio.Future[Any]", sent: SendSignal
+    ) -> bool:
+        """Wait until the primary is sent; False if it finished first"""
+        waiter = asyncio.ensure_future(sent.event.wait())
+        try:
+            await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        return not primary.done()
+
+    async def _first_success(
+        self, primary: "asyncio.Future[Any]", hedge: "asyncio.Future[Any]"
+    ) -> Tuple[Any, bool]:
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), task is hedge
+                error = error or task.exception()
+        # Both copies failed; surface the first failure
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedges_skipped": self.hedges_skipped,
+            "credits": round(self.credits, 2),
+            "thresholds_ms": {
+                key: round(self.hedge_delay(key) * 1000, 2)
+                for key in self._trackers
+                if self.hedge_delay(key) is not None
+            },
+        }
+
+
+# Global hedger instance
+hedger = Hedger()
@@ -1,17 +1,258 @@
-import difflib
+import asyncio
+import json
 import os
-from typing import Optional
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import AsyncIterator, Callable, Dict, List, Optional
 
 import httpx
+import openai
 from fastapi import HTTPException
-from openai import OpenAI
+from openai import AsyncOpenAI
 
+from app.services.cache import CACHE_POLICIES, cache_key, response_cache
+from app.services.cassette import Cassette, check_cassette, get_cassette
+from app.services.concurrency import get_limiter
+from app.services.dispatch import (
+    DEFAULT_JOB_WEIGHT,
+    DEFAULT_PRIORITY,
+    PRIORITY_CLASSES,
+    dispatch_queue,
+)
+from app.services.fake_llm import (
+    FakeLLMConfig,
+    count_prompt_tokens,
+    fake_tokens,
+    sample_failure,
+    sample_latency,
+)
+from app.services.hedging import LLM_HEDGING, SendSignal, hedger
+from app.services.ollama_pool import ollama_pool
+from app.services.rate_limiter import estimate_tokens, rate_limiter
+from app.services.resilience import (
+    RETRYABLE_STATUS_CODES,
+    ProviderError,
+    call_with_retries,
+    parse_retry_after,
+)
+from app.services.single_flight import single_flight
+from app.services.tokens import call_cost, count_tokens
 
-# Lazily or conditionally initialize the OpenAI client to avoid requiring an API key during tests
-if os.getenv("TESTING") == "true":
-    openai_client = None
-else:
-    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# Connection pool for the shared OpenAI client; keep-alive connections are
+# reused across samples so a run does not pay a TLS handshake per call
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+
+# Created lazily so that no API key is required at import time (e.g. during tests)
+openai_client: Optional[AsyncOpenAI] = None
+
+# Connection pool for the shared Ollama client
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "16")
+)
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# How long Ollama keeps a model resident after a request ("10m", "1h", "-1" =
+# forever); long enough that a run or comparison never reloads its model
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+ollama_client: Optional[httpx.AsyncClient] = None
+
+# Process-wide ceiling on in-flight calls per provider, shared by every run.
+# Within it each model's limit adapts to provider feedback (see
+# app.services.concurrency).
+DEFAULT_MAX_CONCURRENCY = 8
+PROVIDER_CONCURRENCY = {
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+    "ollama": int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4")),
+    "fake": int(os.getenv("FAKE_LLM_MAX_CONCURRENCY", "64")),
+}
+_provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _provider_semaphore(provider: str) -> asyncio.Semaphore:
+    global _semaphore_loop
+    # Semaphores belong to one event loop; start afresh on a new one
+    loop = asyncio.get_running_loop()
+    if loop is not _semaphore_loop:
+        _provider_semaphores.clear()
+        _semaphore_loop = loop
+    if provider not in _provider_semaphores:
+        _provider_semaphores[provider] = asyncio.Semaphore(
+            max(1, PROVIDER_CONCURRENCY.get(provider, DEFAULT_MAX_CONCURRENCY))
+        )
+    return _provider_semaphores[provider]
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    cache_hit: bool = False
+    retries: int = 0
+    # Served by an identical request that was already in flight
+    coalesced: bool = False
+    latency_ms: Optional[float] = None
+    ttfb_ms: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # Streaming calls only: time to the first non-empty token, mean gap between
+    # tokens, and whether a stop condition ended generation early
+    ttft_ms: Optional[float] = None
+    inter_token_ms: Optional[float] = None
+    stopped_early: bool = False
+    # Answered by a hedged duplicate rather than the original request
+    hedged: bool = False
+    # Priced from the provider's token usage, or local counts without it;
+    # cache hits and coalesced calls cost nothing
+    cost_usd: Optional[float] = None
+    # Served from a cassette (see app.services.cassette); also a cache hit
+    replayed: bool = False
+
+
+# Called with the text generated so far; returning True ends a streaming call
+StopCondition = Callable[[str], bool]
+
+
+@dataclass
+class StreamedText:
+    text: str
+    chunks: int
+    ttft_ms: Optional[float]
+    inter_token_ms: Optional[float]
+    stopped_early: bool
+
+
+async def consume_stream(
+    pieces: AsyncIterator[str],
+    started: float,
+    stop_when: Optional[StopCondition] = None,
+) -> StreamedText:
+    """Read a token stream, timing each token and stopping once ``stop_when``
+    is satisfied. Stopping closes ``pieces`` so the provider stops generating."""
+    text = ""
+    chunks = 0
+    first_at = last_at = None
+    stopped_early = False
+    try:
+        async for piece in pieces:
+            if not piece:
+                continue
+            last_at = time.monotonic()
+            if first_at is None:
+                first_at = last_at
+            text += piece
+            chunks += 1
+            if stop_when is not None and stop_when(text):
+                stopped_early = True
+                break
+    finally:
+        await pieces.aclose()
+    return StreamedText(
+        text=text,
+        chunks=chunks,
+        ttft_ms=(first_at - started) * 1000 if first_at is not None else None,
+        inter_token_ms=(
+            (last_at - first_at) * 1000 / (chunks - 1) if chunks > 1 else None
+        ),
+        stopped_early=stopped_early,
+    )
+
+
+async def _mark_first_byte(response: httpx.Response):
+    # Response hooks run once the headers arrive, before the body is read
+    response.request.extensions["first_byte_at"] = time.monotonic()
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Return the process-wide async OpenAI client, creating it on first use"""
+    global openai_client
+    if openai_client is None:
+        http_client = httpx.AsyncClient(
+            http2=OPENAI_HTTP2,
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+            event_hooks={"response": [_mark_first_byte]},
+        )
+        # Retries are handled by app.services.resilience, not the SDK
+        openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=http_client,
+            max_retries=0,
+        )
+    return openai_client
+
+
+async def close_openai_client():
+    """Close the shared OpenAI client and its connection pool"""
+    global openai_client
+    if openai_client is not None:
+        await openai_client.close()
+        openai_client = None
+
+
+def get_ollama_client() -> httpx.AsyncClient:
+    """Return the process-wide Ollama HTTP client, creating it on first use"""
+    global ollama_client
+    if ollama_client is None:
+        ollama_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        )
+    return ollama_client
+
+
+async def close_ollama_client():
+    """Close the shared Ollama client and its connection pool"""
+    global ollama_client
+    if ollama_client is not None:
+        await ollama_client.aclose()
+        ollama_client = None
+
+
+async def list_ollama_models(timeout: float = 5.0) -> List[str]:
+    """Return the names of the models available on any healthy Ollama node"""
+    client = get_ollama_client()
+    responses = await asyncio.gather(
+        *[
+            client.get(f"{url}/api/tags", timeout=timeout)
+            for url in ollama_pool.healthy_urls()
+        ],
+        return_exceptions=True,
+    )
+    names: List[str] = []
+    errors = []
+    for response in responses:
+        if isinstance(response, Exception):
+            errors.append(response)
+            continue
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            errors.append(e)
+            continue
+        for model in response.json().get("models", []):
+            if model["name"] not in names:
+                names.append(model["name"])
+    if errors and len(errors) == len(responses):
+        raise errors[0]
+    return names
 
 
 async def call_ollama(
@@ -21,28 +262,81 @@ async def call_ollama(
     max_tokens: int,
     top_p: float,
     top_k: Optional[int] = None,
-):
-    ollama_host = os.getenv("OLLAMA_HOST", "host.docker.internal")
+    seed: Optional[int] = None,
+    stream: bool = False,
+    stop_when: Optional[StopCondition] = None,
+) -> LLMResponse:
+    client = get_ollama_client()
+    final: Dict[str, int] = {}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"http://{ollama_host}:11434/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "options": {
-                        "temperature": temperature,
-                        "top_p": top_p,
-                        "top_k": top_k,
-                        "num_predict": max_tokens,
-                    },
-                    "stream": False,
+        started = time.monotonic()
+        async with ollama_pool.route(model, client) as base_url, client.stream(
+            "POST",
+            f"{base_url}/api/generate",
+            json={
+                "model": model,
+                "prompt": prompt,
+                "options": {
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "top_k": top_k,
+                    "num_predict": max_tokens,
+                    "seed": seed,
                 },
-                timeout=60.0,
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("response", "").strip()
+                "stream": stream,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+            },
+        ) as response:
+            ttfb_ms = (time.monotonic() - started) * 1000
+            if not stream or response.is_error:
+                await response.aread()
+                response.raise_for_status()
+                result = response.json()
+                return LLMResponse(
+                    text=result.get("response", "").strip(),
+                    ttfb_ms=ttfb_ms,
+                    prompt_tokens=result.get("prompt_eval_count"),
+                    completion_tokens=result.get("eval_count"),
+                )
+
+            # NDJSON chunks; the last one carries the token counts
+            async def pieces() -> AsyncIterator[str]:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise ProviderError(
+                            500, f"Ollama API error: {chunk['error']}", retryable=True
+                        )
+                    if chunk.get("done"):
+                        final.update(chunk)
+                    yield chunk.get("response", "")
+
+            streamed = await consume_stream(pieces(), started, stop_when)
+        return LLMResponse(
+            text=streamed.text.strip(),
+            ttfb_ms=ttfb_ms,
+            ttft_ms=streamed.ttft_ms,
+            inter_token_ms=streamed.inter_token_ms,
+            stopped_early=streamed.stopped_early,
+            prompt_tokens=final.get("prompt_eval_count"),
+            completion_tokens=final.get("eval_count", streamed.chunks),
+        )
+    except ProviderError:
+        raise
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        raise ProviderError(
+            429 if status == 429 else 500,
+            f"Ollama API error: {str(e)}",
+            retryable=status in RETRYABLE_STATUS_CODES,
+            retry_after=parse_retry_after(e.response.headers.get("retry-after")),
+        )
+    except httpx.TimeoutException as e:
+        raise ProviderError(504, f"Ollama API timeout: {str(e)}", retryable=True)
+    except httpx.TransportError as e:
+        raise ProviderError(503, f"Ollama API error: {str(e)}", retryable=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ollama API error: {str(e)}")
 
@@ -54,39 +348,188 @@ async def call_openai(
     max_tokens: int,
     top_p: float,
     top_k: Optional[int] = None,
-):
+    seed: Optional[int] = None,
+    stream: bool = False,
+    stop_when: Optional[StopCondition] = None,
+) -> LLMResponse:
     api_key = os.getenv("OPENAI_API_KEY")
     # In TESTING mode, return a deterministic stubbed response
     if os.getenv("TESTING") == "true":
-        return "TESTING_OPENAI_RESPONSE"
+        return LLMResponse(text="TESTING_OPENAI_RESPONSE")
     if not api_key:
         raise HTTPException(status_code=500, detail="OpenAI API key not found in environment variables")
     try:
-        response = openai_client.chat.completions.create(
+        started = time.monotonic()
+        if stream:
+            return await _stream_openai(
+                prompt, model, temperature, max_tokens, top_p, seed, stop_when
+            )
+        raw = await get_openai_client().chat.completions.with_raw_response.create(
             model=model,
             messages=[{"role": "user", "content": prompt}],
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=top_p,
+            **({"seed": seed} if seed is not None else {}),
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
+        response = raw.parse()
+        first_byte_at = raw.http_request.extensions.get("first_byte_at")
+        return LLMResponse(
+            text=response.choices[0].message.content.strip(),
+            ttfb_ms=(first_byte_at - started) * 1000 if first_byte_at else None,
+            prompt_tokens=response.usage.prompt_tokens if response.usage else None,
+            completion_tokens=(
+                response.usage.completion_tokens if response.usage else None
+            ),
+        )
+    except openai.APIStatusError as e:
         error_msg = str(e)
-        if "invalid_api_key" in error_msg.lower() or "401" in error_msg:
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid OpenAI API key. Please check your API key configuration.",
+        retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+        if e.status_code == 401:
+            raise ProviderError(
+                401,
+                "Invalid OpenAI API key. Please check your API key configuration.",
+            )
+        elif e.status_code == 429 and "quota" in error_msg.lower():
+            raise ProviderError(
+                429, "OpenAI API quota exceeded. Please check your usage limits."
             )
-        elif "quota" in error_msg.lower():
-            raise HTTPException(
-                status_code=429,
-                detail="OpenAI API quota exceeded. Please check your usage limits.",
+        elif e.status_code == 429:
+            raise ProviderError(
+                429,
+                f"OpenAI rate limit exceeded: {error_msg}",
+                retryable=True,
+                retry_after=retry_after,
             )
         else:
-            raise HTTPException(status_code=500, detail=f"OpenAI API error: {error_msg}")
+            raise ProviderError(
+                500,
+                f"OpenAI API error: {error_msg}",
+                retryable=e.status_code in RETRYABLE_STATUS_CODES,
+                retry_after=retry_after,
+            )
+    except openai.APITimeoutError as e:
+        raise ProviderError(504, f"OpenAI API timeout: {str(e)}", retryable=True)
+    except openai.APIConnectionError as e:
+        raise ProviderError(503, f"OpenAI API error: {str(e)}", retryable=True)
+    # Raised while reading a stream, outside the SDK's own error mapping
+    except httpx.TimeoutException as e:
+        raise ProviderError(504, f"OpenAI API timeout: {str(e)}", retryable=True)
+    except httpx.TransportError as e:
+        raise ProviderError(503, f"OpenAI API error: {str(e)}", retryable=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
 
 
-async def call_llm(
+async def _stream_openai(
+    prompt: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    seed: Optional[int],
+    stop_when: Optional[StopCondition],
+) -> LLMResponse:
+    started = time.monotonic()
+    stream = await get_openai_client().chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        stream=True,
+        **({"seed": seed} if seed is not None else {}),
+    )
+    first_byte_at = stream.response.request.extensions.get("first_byte_at")
+
+    async def pieces() -> AsyncIterator[str]:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    try:
+        streamed = await consume_stream(pieces(), started, stop_when)
+    finally:
+        # Closing the connection early is what stops the server generating
+        await stream.response.aclose()
+    # Streamed chunks carry one token each; usage is not reported on streams
+    return LLMResponse(
+        text=streamed.text.strip(),
+        ttfb_ms=(first_byte_at - started) * 1000 if first_byte_at else None,
+        ttft_ms=streamed.ttft_ms,
+        inter_token_ms=streamed.inter_token_ms,
+        stopped_early=streamed.stopped_early,
+        completion_tokens=streamed.chunks,
+    )
+
+
+async def call_fake(
+    prompt: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    top_k: Optional[int] = None,
+    seed: Optional[int] = None,
+    stream: bool = False,
+    stop_when: Optional[StopCondition] = None,
+) -> LLMResponse:
+    """In-process fake provider for load tests; see app.services.fake_llm"""
+    config = FakeLLMConfig()
+    started = time.monotonic()
+    await asyncio.sleep(sample_latency(config.latency))
+    failure = sample_failure(config)
+    if failure == 429:
+        raise ProviderError(
+            429,
+            "Fake LLM rate limit exceeded",
+            retryable=True,
+            retry_after=config.retry_after,
+        )
+    if failure:
+        raise ProviderError(failure, "Fake LLM error", retryable=True)
+    ttfb_ms = (time.monotonic() - started) * 1000
+    tokens = fake_tokens(prompt, model, max_tokens, config, seed)
+
+    if stream:
+
+        async def pieces() -> AsyncIterator[str]:
+            for i, token in enumerate(tokens):
+                if i and config.token_interval:
+                    await asyncio.sleep(config.token_interval)
+                yield token
+
+        streamed = await consume_stream(pieces(), started, stop_when)
+        return LLMResponse(
+            text=streamed.text.strip(),
+            ttfb_ms=ttfb_ms,
+            ttft_ms=streamed.ttft_ms,
+            inter_token_ms=streamed.inter_token_ms,
+            stopped_early=streamed.stopped_early,
+            prompt_tokens=count_prompt_tokens(prompt),
+            completion_tokens=streamed.chunks,
+        )
+
+    if config.token_interval and len(tokens) > 1:
+        await asyncio.sleep(config.token_interval * (len(tokens) - 1))
+    return LLMResponse(
+        text="".join(tokens).strip(),
+        ttfb_ms=ttfb_ms,
+        prompt_tokens=count_prompt_tokens(prompt),
+        completion_tokens=len(tokens),
+    )
+
+
+def provider_for_model(model_id: str) -> str:
+    """Infer the provider from a model id used in comparisons"""
+    if model_id.startswith("gpt-"):
+        return "openai"
+    if model_id.startswith("fake-"):
+        return "fake"
+    return "ollama"
+
+
+async def _dispatch(
     prompt: str,
     provider: str,
     model: str,
@@ -94,33 +537,347 @@ async def call_llm(
     max_tokens: int,
     top_p: float,
     top_k: Optional[int] = None,
-):
+    seed: Optional[int] = None,
+    stream: bool = False,
+    stop_when: Optional[StopCondition] = None,
+    hedge: bool = False,
+    priority: str = DEFAULT_PRIORITY,
+    job_id: Optional[str] = None,
+    weight: float = DEFAULT_JOB_WEIGHT,
+) -> LLMResponse:
     if provider == "ollama":
-        return await call_ollama(prompt, model, temperature, max_tokens, top_p, top_k)
+        call = call_ollama
     elif provider == "openai":
-        return await call_openai(prompt, model, temperature, max_tokens, top_p, top_k)
+        call = call_openai
+    elif provider == "fake":
+        call = call_fake
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported provider: {provider}")
 
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Unsupported priority: {priority}")
+    if weight <= 0:
+        raise HTTPException(status_code=400, detail="weight must be positive")
+
+    key = f"{provider}:{model}"
+    limiter = get_limiter(
+        provider, model, PROVIDER_CONCURRENCY.get(provider, DEFAULT_MAX_CONCURRENCY)
+    )
+
+    async def send(timeout: float, sent: SendSignal) -> LLMResponse:
+        # Wait for quota before taking a concurrency slot
+        await rate_limiter.acquire(provider, model, estimate_tokens(prompt, max_tokens))
+        # Slots under the per-model adaptive limit are handed out by priority;
+        # the provider-wide ceiling sits above both
+        ticket = await dispatch_queue.acquire(key, limiter, priority, job_id, weight)
+        try:
+            async with _provider_semaphore(provider):
+                sent.mark()
+                # Timed from here: a wait for the provider-wide ceiling is not
+                # the provider's latency, and must not read as a spike
+                started = time.monotonic()
+                response = await asyncio.wait_for(
+                    call(
+                        prompt,
+                        model,
+                        temperature,
+                        max_tokens,
+                        top_p,
+                        top_k,
+                        seed,
+                        stream=stream,
+                        stop_when=stop_when,
+                    ),
+                    timeout,
+                )
+        except asyncio.TimeoutError:
+            await dispatch_queue.release(ticket, overloaded=True)
+            raise
+        except ProviderError as e:
+            await dispatch_queue.release(
+                ticket, overloaded=e.status_code in (429, 504)
+            )
+            raise
+        except BaseException:
+            await dispatch_queue.release(ticket)
+            raise
+        await dispatch_queue.release(
+            ticket,
+            latency=time.monotonic() - started,
+            tokens=response.completion_tokens,
+        )
+        return response
+
+    async def attempt(timeout: float) -> LLMResponse:
+        response, hedged = await hedger.run(
+            key,
+            lambda sent: send(timeout, sent),
+            enabled=hedge,
+            has_capacity=limiter.has_capacity,
+        )
+        return replace(response, hedged=True) if hedged else response
+
+    # Ollama nodes each have their own breaker (see app.services.ollama_pool)
+    breaker_name = None if provider == "ollama" else provider
+    response, retries = await call_with_retries(breaker_name, attempt)
+    return replace(response, retries=retries)
+
+
+async def generate(
+    prompt: str,
+    provider: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    top_k: Optional[int] = None,
+    seed: Optional[int] = None,
+    cache_policy: str = "auto",
+    stream: bool = False,
+    stop_when: Optional[StopCondition] = None,
+    hedge: Optional[bool] = None,
+    priority: str = DEFAULT_PRIORITY,
+    job_id: Optional[str] = None,
+    cassette: Optional[str] = None,
+    cassette_mode: str = "off",
+    weight: float = DEFAULT_JOB_WEIGHT,
+) -> LLMResponse:
+    """Call the LLM through the response cache and request coalescing.
+
+    The returned LLMResponse carries the call's wall-clock latency, time to
+    first byte, token usage, cost and retry count, and says whether it was a
+    cache hit or shared with an identical request already in flight.
 
-def evaluate_output(predicted: str, expected: str, method: str = "fuzzy") -> float:
-    if method == "fuzzy":
-        return difflib.SequenceMatcher(
-            None, predicted.lower().strip(), expected.lower().strip()
-        ).ratio()
-    elif method == "exact":
-        return 1.0 if predicted.lower().strip() == expected.lower().strip() else 0.0
-    elif method == "semantic":
-        predicted_words = set(predicted.lower().strip().split())
-        expected_words = set(expected.lower().strip().split())
-        if not expected_words:
-            return 1.0 if not predicted_words else 0.0
-        intersection = predicted_words.intersection(expected_words)
-        union = predicted_words.union(expected_words)
-        return len(intersection) / len(union) if union else 0.0
-    elif method == "contains":
-        return 1.0 if expected.lower().strip() in predicted.lower().strip() else 0.0
+    With ``stream`` the output is read token by token, adding time to first
+    token and inter-token latency. ``stop_when`` implies streaming and ends
+    generation as soon as it returns True; such truncated outputs are not
+    cached or shared with other callers.
+
+    ``hedge`` (default LLM_HEDGING) sends a duplicate request when the call
+    runs past the model's recent latency percentile; see app.services.hedging.
+
+    Calls queue for a slot in the ``priority`` class, sharing it with other
+    jobs of the same class by ``job_id`` in proportion to their ``weight``;
+    see app.services.dispatch.
+
+    ``cassette_mode`` "record" appends the response to the named
+    ``cassette``; "replay" answers from it without calling the model.
+    """
+    check_cassette(cassette_mode, cassette)
+    tape = key = None
+    if cassette_mode != "off":
+        tape = get_cassette(cassette)
+        key = cache_key(
+            provider, model, prompt, temperature, max_tokens, top_p, top_k, seed
+        )
+
+    started = time.monotonic()
+    if cassette_mode == "replay":
+        response = replay(tape, key, prompt, model)
     else:
-        return 0.0
+        response = await _generate(
+            prompt,
+            provider,
+            model,
+            temperature,
+            max_tokens,
+            top_p,
+            top_k,
+            seed,
+            cache_policy,
+            stream or stop_when is not None,
+            stop_when,
+            LLM_HEDGING if hedge is None else hedge,
+            priority,
+            job_id,
+            weight,
+        )
+    response = replace(response, latency_ms=(time.monotonic() - started) * 1000)
+    response = with_usage(response, provider, model, prompt)
+    if cassette_mode == "record":
+        record(tape, key, response)
+    return response
+
+
+def record(tape: Cassette, key: str, response: LLMResponse):
+    tape.record(
+        key,
+        {
+            "text": response.text,
+            "prompt_tokens": response.prompt_tokens,
+            "completion_tokens": response.completion_tokens,
+            "stopped_early": response.stopped_early,
+        },
+    )
+
+
+def replay(tape: Cassette, key: str, prompt: str, model: str) -> LLMResponse:
+    """The recorded response to a request; replays are free cache hits"""
+    entry = tape.get(key)
+    if entry is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No recorded response in cassette {tape.path} for this request",
+        )
+    prompt_tokens = entry.get("prompt_tokens")
+    completion_tokens = entry.get("completion_tokens")
+    return LLMResponse(
+        text=entry["text"],
+        cache_hit=True,
+        replayed=True,
+        prompt_tokens=(
+            prompt_tokens if prompt_tokens is not None else count_tokens(prompt, model)
+        ),
+        completion_tokens=(
+            completion_tokens
+            if completion_tokens is not None
+            else count_tokens(entry["text"], model)
+        ),
+        stopped_early=entry.get("stopped_early", False),
+    )
+
+
+def with_usage(
+    response: LLMResponse, provider: str, model: str, prompt: str
+) -> LLMResponse:
+    """Fill in token counts the provider did not report, and the call's cost"""
+    if response.cache_hit or response.coalesced:
+        return replace(response, cost_usd=0.0)
+    prompt_tokens = response.prompt_tokens
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(prompt, model)
+    completion_tokens = response.completion_tokens
+    if completion_tokens is None:
+        completion_tokens = count_tokens(response.text, model)
+    return replace(
+        response,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cost_usd=call_cost(provider, model, prompt_tokens, completion_tokens),
+    )
+
+
+async def _generate(
+    prompt: str,
+    provider: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    top_k: Optional[int],
+    seed: Optional[int],
+    cache_policy: str,
+    stream: bool,
+    stop_when: Optional[StopCondition],
+    hedge: bool,
+    priority: str,
+    job_id: Optional[str],
+    weight: float,
+) -> LLMResponse:
+    if cache_policy not in CACHE_POLICIES:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported cache policy: {cache_policy}"
+        )
+
+    key = cache_key(
+        provider, model, prompt, temperature, max_tokens, top_p, top_k, seed
+    )
+    use_cache = response_cache.should_use(cache_policy, temperature, seed)
+    if use_cache and cache_policy != "refresh":
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return LLMResponse(text=cached, cache_hit=True)
+
+    async def call() -> LLMResponse:
+        response = await _dispatch(
+            prompt,
+            provider,
+            model,
+            temperature,
+            max_tokens,
+            top_p,
+            top_k,
+            seed,
+            stream=stream,
+            stop_when=stop_when,
+            hedge=hedge,
+            priority=priority,
+            job_id=job_id,
+            weight=weight,
+        )
+        if use_cache and not response.stopped_early:
+            await response_cache.set(key, response.text)
+        return response
+
+    # A stop condition is specific to its caller, so its output is not shared
+    if stop_when is not None or not single_flight.should_use(temperature, seed):
+        return await call()
+
+    response, coalesced = await single_flight.run(
+        key,
+        call,
+        encode=lambda response: json.dumps(asdict(response)),
+        decode=lambda data: LLMResponse(**json.loads(data)),
+    )
+    return replace(response, coalesced=True) if coalesced else response
+
+
+async def call_llm(
+    prompt: str,
+    provider: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    top_k: Optional[int] = None,
+    seed: Optional[int] = None,
+    cache_policy: str = "auto",
+    hedge: Optional[bool] = None,
+    priority: str = DEFAULT_PRIORITY,
+    job_id: Optional[str] = None,
+    cassette: Optional[str] = None,
+    cassette_mode: str = "off",
+) -> str:
+    response = await generate(
+        prompt,
+        provider,
+        model,
+        temperature,
+        max_tokens,
+        top_p,
+        top_k,
+        seed=seed,
+        cache_policy=cache_policy,
+        hedge=hedge,
+        priority=priority,
+        job_id=job_id,
+        cassette=cassette,
+        cassette_mode=cassette_mode,
+    )
+    return response.text
+
+
+def early_stop_condition(
+    method: str, expected: str, max_chars: Optional[int] = None
+) -> Optional[StopCondition]:
+    """Stop condition for streaming a sample scored with ``method``.
+
+    Generation can stop once the score can no longer change: for "contains"
+    as soon as the expected text appears, for "exact" once the output is
+    longer than the expected text. ``max_chars`` caps the output length for
+    any method. Returns None when nothing can be cut short.
+    """
+    target = expected.lower().strip()
 
+    def stop(text: str) -> bool:
+        if max_chars is not None and len(text) >= max_chars:
+            return True
+        if method == "contains":
+            return target in text.lower()
+        if method == "exact":
+            return len(text.lower().strip()) > len(target)
+        return False
 
+    if method in ("contains", "exact") or max_chars is not None:
+        return stop
+    return None
@@ -0,0 +1,190 @@
+import math
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import ModelStats, OutputLengthStats
+from app.services.sketch import QuantileSketch
+from app.services.tokens import count_tokens
+
+
+# "auto" max_tokens: cap at a safety factor above a high percentile of the
+# prompt system's past output lengths, once enough outputs have been seen
+MAX_TOKENS_MODES = ("fixed", "auto")
+AUTO_MAX_TOKENS_QUANTILE = float(os.getenv("AUTO_MAX_TOKENS_QUANTILE", "0.99"))
+AUTO_MAX_TOKENS_SAFETY_FACTOR = float(
+    os.getenv("AUTO_MAX_TOKENS_SAFETY_FACTOR", "1.5")
+)
+AUTO_MAX_TOKENS_MIN_SAMPLES = int(os.getenv("AUTO_MAX_TOKENS_MIN_SAMPLES", "20"))
+# Never cap below this, however short the outputs have been
+AUTO_MAX_TOKENS_FLOOR = int(os.getenv("AUTO_MAX_TOKENS_FLOOR", "16"))
+
+
+def stats_key(provider: str, model: str) -> str:
+    return f"{provider}:{model}"
+
+
+def _locked_row(db: Session, table, key: str):
+    return db.query(table).filter(table.id == key).with_for_update().first()
+
+
+def _locked_or_new_row(db: Session, table, key: str, **fields):
+    """Lock a stats row for update, creating it first if it does not exist"""
+    row = _locked_row(db, table, key)
+    if row is None:
+        try:
+            with db.begin_nested():
+                db.add(table(id=key, samples=0, **fields))
+        except IntegrityError:
+            # Another run created it first
+            pass
+        row = _locked_row(db, table, key)
+    return row
+
+
+def _recordable(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        r
+        for r in results
+        if "error" not in r and not r.get("cache_hit") and not r.get("stopped_early")
+    ]
+
+
+def record_model_stats(
+    db: Session,
+    provider: str,
+    model: str,
+    results: List[Dict[str, Any]],
+    include_latency: bool = True,
+):
+    """Fold a run's per-call metrics into the model's running distributions.
+
+    Failed samples, cache hits and early-stopped outputs say nothing about
+    how the model behaves and are left out. The update joins the caller's
+    transaction; a failure here is logged and never fails the run.
+    """
+    calls = [
+        r for r in _recordable(results) if r.get("completion_tokens") is not None
+    ]
+    if not calls:
+        return
+
+    key = stats_key(provider, model)
+    try:
+        with db.begin_nested():
+            row = _locked_or_new_row(
+                db, ModelStats, key, provider=provider, model=model
+            )
+            latency = QuantileSketch.from_json(row.latency_sketch)
+            tokens = QuantileSketch.from_json(row.completion_tokens_sketch)
+            for call in calls:
+                tokens.add(call["completion_tokens"])
+                if include_latency and call.get("latency_ms") is not None:
+                    latency.add(call["latency_ms"])
+            row.samples = (row.samples or 0) + len(calls)
+            row.latency_sketch = latency.to_json()
+            row.completion_tokens_sketch = tokens.to_json()
+            row.updated_at = datetime.utcnow()
+    except Exception as e:
+        print(f"Model stats: could not record {key}: {e}")
+
+
+def model_history(db: Session, provider: str, model: str) -> Optional[Dict[str, Any]]:
+    """Summary of a model's past latency and output lengths, or None without
+    history. Reads one row, however many results were ever recorded."""
+    row = db.get(ModelStats, stats_key(provider, model))
+    if row is None or not row.samples:
+        return None
+    latency = QuantileSketch.from_json(row.latency_sketch)
+    tokens = QuantileSketch.from_json(row.completion_tokens_sketch)
+    return {
+        "samples": row.samples,
+        "latency_mean_ms": latency.mean,
+        "latency_p50_ms": latency.quantile(0.5),
+        "latency_p95_ms": latency.quantile(0.95),
+        "completion_tokens_mean": tokens.mean,
+        "completion_tokens_p95": tokens.quantile(0.95),
+    }
+
+
+def output_length(result: Dict[str, Any], model: str) -> int:
+    """Completion tokens of a result, counted from its output when the
+    provider did not report them"""
+    if result.get("completion_tokens") is not None:
+        return result["completion_tokens"]
+    return count_tokens(result.get("predicted_output") or "", model)
+
+
+def record_output_lengths(
+    db: Session, prompt_system_id: str, model: str, results: List[Dict[str, Any]]
+):
+    """Fold a run's output lengths into the prompt system's distribution.
+
+    Outputs that hit their cap are recorded at the cap, so a cap that proves
+    too tight raises the next one. Like record_model_stats this joins the
+    caller's transaction and only logs failures.
+    """
+    outputs = _recordable(results)
+    if not outputs:
+        return
+
+    key = f"{prompt_system_id}:{model}"
+    try:
+        with db.begin_nested():
+            row = _locked_or_new_row(
+                db,
+                OutputLengthStats,
+                key,
+                prompt_system_id=prompt_system_id,
+                model=model,
+            )
+            tokens = QuantileSketch.from_json(row.completion_tokens_sketch)
+            for output in outputs:
+                tokens.add(output_length(output, model))
+            row.samples = (row.samples or 0) + len(outputs)
+            row.completion_tokens_sketch = tokens.to_json()
+            row.updated_at = datetime.utcnow()
+    except Exception as e:
+        print(f"Output length stats: could not record {key}: {e}")
+
+
+def resolve_max_tokens(db: Session, prompt_system) -> int:
+    """The max_tokens to send for a prompt system's calls.
+
+    In "fixed" mode, and in "auto" mode until AUTO_MAX_TOKENS_MIN_SAMPLES
+    outputs have been seen, this is the configured max_tokens. Past that,
+    "auto" caps it at AUTO_MAX_TOKENS_SAFETY_FACTOR times the
+    AUTO_MAX_TOKENS_QUANTILE of past output lengths; the configured value
+    remains the ceiling.
+    """
+    max_tokens = prompt_system.max_tokens
+    if prompt_system.max_tokens_mode != "auto":
+        return max_tokens
+    row = db.get(OutputLengthStats, f"{prompt_system.id}:{prompt_system.model}")
+    if row is None or (row.samples or 0) < AUTO_MAX_TOKENS_MIN_SAMPLES:
+        return max_tokens
+    high = QuantileSketch.from_json(row.completion_tokens_sketch).quantile(
+        AUTO_MAX_TOKENS_QUANTILE
+    )
+    cap = math.ceil((high or 0) * AUTO_MAX_TOKENS_SAFETY_FACTOR)
+    return min(max_tokens, max(AUTO_MAX_TOKENS_FLOOR, cap))
+
+
+def token_cap_summary(
+    prompt_system, max_tokens: int, results: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """The max_tokens a run used and how many of its outputs reached it"""
+    # A replayed run uses the cap it was recorded with (see runner.run_prompt_system)
+    max_tokens = next(
+        (r["max_tokens"] for r in results if r.get("max_tokens") is not None),
+        max_tokens,
+    )
+    return {
+        "mode": prompt_system.max_tokens_mode or "fixed",
+        "configured": prompt_system.max_tokens,
+        "max_tokens": max_tokens,
+        "capped_samples": sum(1 for r in results if r.get("capped")),
+    }
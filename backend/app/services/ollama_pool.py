@@ -0,0 +1,220 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import httpx
+
+from app.services.resilience import CircuitBreaker, ProviderError
+
+
+# Comma-separated Ollama nodes ("host", "host:port" or full URLs). Falls back
+# to the single OLLAMA_HOST when unset.
+OLLAMA_HOSTS = os.getenv("OLLAMA_HOSTS", "")
+OLLAMA_DEFAULT_PORT = 11434
+# How often each node's available (/api/tags) and loaded (/api/ps) models are
+# refreshed; ejected nodes are probed on the same schedule
+OLLAMA_REFRESH_SECONDS = float(os.getenv("OLLAMA_REFRESH_SECONDS", "15"))
+# Consecutive connection failures or 5xx responses that eject a node, and how
+# long it stays out before it is tried again
+OLLAMA_EJECT_AFTER_FAILURES = int(os.getenv("OLLAMA_EJECT_AFTER_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+
+
+def normalize_host(host: str) -> str:
+    """Turn "gpu1", "gpu1:11434" or "http://gpu1:11434/" into a base URL"""
+    host = host.strip().rstrip("/")
+    if "://" not in host:
+        host = f"http://{host}"
+    scheme, _, rest = host.partition("://")
+    if ":" not in rest:
+        rest = f"{rest}:{OLLAMA_DEFAULT_PORT}"
+    return f"{scheme}://{rest}"
+
+
+def configured_hosts() -> List[str]:
+    if OLLAMA_HOSTS.strip():
+        return [normalize_host(h) for h in OLLAMA_HOSTS.split(",") if h.strip()]
+    # Use host.docker.internal when running in Docker, localhost otherwise
+    return [normalize_host(os.getenv("OLLAMA_HOST", "host.docker.internal"))]
+
+
+class OllamaEndpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until: Optional[float] = None
+        self.available: Set[str] = set()
+        self.loaded: Set[str] = set()
+        # Fails calls fast while this node is down; see call_with_retries
+        self.breaker = CircuitBreaker()
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until is None or time.monotonic() >= self.ejected_until
+
+    def record_success(self):
+        self.failures = 0
+        self.ejected_until = None
+
+    def record_failure(self, eject_after: int, eject_seconds: float):
+        self.failures += 1
+        if self.failures >= eject_after:
+            if self.ejected_until is None or self.healthy:
+                print(f"Ollama pool: ejecting {self.url} for {eject_seconds:.0f}s")
+            self.ejected_until = time.monotonic() + eject_seconds
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "circuit": self.breaker.state,
+            "available_models": sorted(self.available),
+            "loaded_models": sorted(self.loaded),
+        }
+
+
+class OllamaPool:
+    """Route Ollama requests across nodes by least outstanding requests.
+
+    Among healthy nodes, those that already have the model loaded are
+    preferred, then those that have it pulled, then any node. Nodes that keep
+    failing are ejected for a while and re-admitted once a probe or a trial
+    request succeeds. A pool of one node routes straight to it.
+    """
+
+    def __init__(
+        self,
+        hosts: Optional[List[str]] = None,
+        refresh_seconds: float = OLLAMA_REFRESH_SECONDS,
+        eject_after: int = OLLAMA_EJECT_AFTER_FAILURES,
+        eject_seconds: float = OLLAMA_EJECT_SECONDS,
+    ):
+        self.endpoints = [
+            OllamaEndpoint(normalize_host(host))
+            for host in hosts or configured_hosts()
+        ]
+        self.refresh_seconds = refresh_seconds
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.refreshed_at: Optional[float] = None
+        self._refresh_task: Optional["asyncio.Task[None]"] = None
+
+    async def _probe(self, endpoint: OllamaEndpoint, client: httpx.AsyncClient):
+        try:
+            tags, ps = await asyncio.gather(
+                client.get(f"{endpoint.url}/api/tags", timeout=5.0),
+                client.get(f"{endpoint.url}/api/ps", timeout=5.0),
+            )
+            tags.raise_for_status()
+            endpoint.available = {m["name"] for m in tags.json().get("models", [])}
+            # Older Ollama versions have no /api/ps; keep our own view then
+            if ps.status_code == 200:
+                endpoint.loaded = {m["name"] for m in ps.json().get("models", [])}
+            endpoint.record_success()
+        except Exception as e:
+            print(f"Ollama pool: probe of {endpoint.url} failed: {e}")
+            endpoint.record_failure(self.eject_after, self.eject_seconds)
+
+    async def refresh(self, client: httpx.AsyncClient):
+        """Re-read every node's available and loaded models"""
+        self.refreshed_at = time.monotonic()
+        await asyncio.gather(*[self._probe(e, client) for e in self.endpoints])
+
+    async def _maybe_refresh(self, client: httpx.AsyncClient):
+        if len(self.endpoints) == 1:
+            return
+        if self.refreshed_at is None:
+            # The first request waits so that it can use model affinity
+            await self.refresh(client)
+        elif time.monotonic() - self.refreshed_at >= self.refresh_seconds and (
+            self._refresh_task is None or self._refresh_task.done()
+        ):
+            self._refresh_task = asyncio.create_task(self.refresh(client))
+
+    def choose(self, model: str) -> OllamaEndpoint:
+        # With every node ejected, try them all rather than fail outright;
+        # the nodes' circuit breakers take care of failing fast
+        candidates = [
+            e for e in self.endpoints if e.healthy and e.breaker.state != "open"
+        ] or self.endpoints
+        for preferred in (
+            [e for e in candidates if model in e.loaded],
+            [e for e in candidates if model in e.available],
+        ):
+            if preferred:
+                candidates = preferred
+                break
+        fewest = min(e.outstanding for e in candidates)
+        return random.choice([e for e in candidates if e.outstanding == fewest])
+
+    @asynccontextmanager
+    async def route(
+        self, model: str, client: httpx.AsyncClient
+    ) -> AsyncIterator[str]:
+        """Pick a node for ``model`` and yield its base URL for one request.
+
+        Connection errors, timeouts and 5xx responses count against the node
+        (and its circuit breaker); rate limits and cancelled calls do not.
+        """
+        await self._maybe_refresh(client)
+        endpoint = self.choose(model)
+        breaker = endpoint.breaker
+        if not breaker.allow():
+            raise ProviderError(
+                503,
+                f"Ollama node {endpoint.url} circuit is open; failing fast "
+                f"while it recovers",
+            )
+        endpoint.outstanding += 1
+        try:
+            yield endpoint.url
+        except (httpx.TimeoutException, httpx.TransportError):
+            endpoint.record_failure(self.eject_after, self.eject_seconds)
+            breaker.record_failure()
+            raise
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500:
+                endpoint.record_failure(self.eject_after, self.eject_seconds)
+                breaker.record_failure()
+            else:
+                endpoint.record_success()
+                if e.response.status_code == 429:
+                    breaker.release_trial()
+                else:
+                    breaker.record_success()
+            raise
+        except ProviderError as e:
+            # An error reported mid-stream
+            if e.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.release_trial()
+            raise
+        except BaseException:
+            breaker.release_trial()
+            raise
+        else:
+            endpoint.record_success()
+            breaker.record_success()
+            # Ollama keeps the model resident after serving it
+            endpoint.loaded.add(model)
+        finally:
+            endpoint.outstanding -= 1
+
+    def healthy_urls(self) -> List[str]:
+        return [e.url for e in self.endpoints if e.healthy] or [
+            e.url for e in self.endpoints
+        ]
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [endpoint.status() for endpoint in self.endpoints]
+
+
+# Global pool instance
+ollama_pool = OllamaPool()
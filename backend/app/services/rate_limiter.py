@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, Tuple
+
+from fastapi import HTTPException
+
+from app.db.redis_client import get_async_redis
+
+
+# Limits per "provider:model", with "provider:*" as the fallback for a provider.
+# rpm = requests per minute, tpm = tokens per minute; 0 or missing = unlimited.
+LLM_RATE_LIMITS: Dict[str, Dict[str, int]] = json.loads(
+    os.getenv("LLM_RATE_LIMITS", '{"openai:*": {"rpm": 500, "tpm": 90000}}')
+)
+# Longest a call will wait for capacity before giving up with a 429
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "300"))
+
+RATE_LIMIT_PREFIX = "rate_limit:"
+
+# After a Redis error the limiter falls back to in-process buckets for this long
+REDIS_RETRY_SECONDS = 30.0
+
+# Both buckets refill continuously and hold at most one minute of quota.
+# Returns "0" when capacity was taken, otherwise the seconds to wait.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local need = tonumber(ARGV[3])
+
+local function level(key, capacity)
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local lvl = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if lvl == nil then
+        return capacity
+    end
+    return math.min(capacity, lvl + (now - ts) * capacity / 60)
+end
+
+local wait = 0
+local requests, tokens
+if rpm > 0 then
+    requests = level(KEYS[1], rpm)
+    if requests < 1 then
+        wait = math.max(wait, (1 - requests) * 60 / rpm)
+    end
+end
+if tpm > 0 then
+    tokens = level(KEYS[2], tpm)
+    if tokens < need then
+        wait = math.max(wait, (need - tokens) * 60 / tpm)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+if rpm > 0 then
+    redis.call('HSET', KEYS[1], 'level', requests - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], 120)
+end
+if tpm > 0 then
+    redis.call('HSET', KEYS[2], 'level', tokens - need, 'ts', now)
+    redis.call('EXPIRE', KEYS[2], 120)
+end
+return "0"
+"""
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough token cost of a call as providers count it: prompt plus max_tokens"""
+    return len(prompt) // 4 + 1 + max_tokens
+
+
+class TokenBucket:
+    """In-process bucket pair used when Redis is unreachable"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self, tokens: int) -> float:
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+        wait = 0.0
+        if self.rpm and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+        if self.tpm and self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+        if wait > 0:
+            return wait
+        if self.rpm:
+            self.requests -= 1
+        if self.tpm:
+            self.tokens -= tokens
+        return 0.0
+
+
+class RateLimiter:
+    """Token-bucket limiter per provider/model shared through Redis.
+
+    Every worker and replica draws from the same buckets, so the combined
+    request and token rate stays under the configured quota. Callers wait
+    for capacity instead of failing.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, int]] = LLM_RATE_LIMITS,
+        max_wait: float = LLM_RATE_LIMIT_MAX_WAIT,
+    ):
+        self.limits = limits
+        self.max_wait = max_wait
+        self._local_buckets: Dict[str, TokenBucket] = {}
+        self._script = None
+        self._redis_retry_at = 0.0
+
+    def limits_for(self, provider: str, model: str) -> Tuple[int, int]:
+        limits = self.limits.get(f"{provider}:{model}") or self.limits.get(
+            f"{provider}:*", {}
+        )
+        return int(limits.get("rpm") or 0), int(limits.get("tpm") or 0)
+
+    async def _try_acquire(
+        self, provider: str, model: str, rpm: int, tpm: int, tokens: int
+    ) -> float:
+        bucket = f"{RATE_LIMIT_PREFIX}{provider}:{model}"
+        if time.monotonic() >= self._redis_retry_at:
+            try:
+                if self._script is None:
+                    self._script = get_async_redis().register_script(
+                        TOKEN_BUCKET_SCRIPT
+                    )
+                wait = await self._script(
+                    keys=[f"{bucket}:requests", f"{bucket}:tokens"],
+                    args=[rpm, tpm, tokens],
+                )
+                return float(wait)
+            except Exception as e:
+                print(f"Rate limiter: Redis unavailable, using local buckets: {e}")
+                self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+
+        if bucket not in self._local_buckets:
+            self._local_buckets[bucket] = TokenBucket(rpm, tpm)
+        return self._local_buckets[bucket].try_acquire(tokens)
+
+    async def acquire(self, provider: str, model: str, tokens: int = 0):
+        """Wait until the provider/model buckets have room for one call"""
+        rpm, tpm = self.limits_for(provider, model)
+        if not rpm and not tpm:
+            return
+        # A call larger than a full bucket would never fit; let it drain the bucket
+        if tpm:
+            tokens = min(tokens, tpm)
+
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = await self._try_acquire(provider, model, rpm, tpm, tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Rate limit for {provider}:{model} not available "
+                    f"within {self.max_wait:.0f}s",
+                )
+            # Jitter so that waiters woken together do not collide again
+            await asyncio.sleep(wait * (1 + random.random() * 0.1))
+
+
+# Global limiter instance
+rate_limiter = RateLimiter()
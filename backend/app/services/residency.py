@@ -0,0 +1,130 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Sequence
+
+from app.services.llm import (
+    OLLAMA_KEEP_ALIVE,
+    get_ollama_client,
+    provider_for_model,
+)
+from app.services.ollama_pool import OllamaEndpoint, ollama_pool
+
+
+# Model loads can take minutes for large models on a cold node
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "300"))
+# Unload each Ollama model once a comparison is done with it, so that the next
+# model does not have to share memory with it
+OLLAMA_RELEASE_AFTER_COMPARISON = (
+    os.getenv("OLLAMA_RELEASE_AFTER_COMPARISON", "false").lower() == "true"
+)
+
+
+class ModelResidency:
+    """Keep Ollama models loaded for the runs that need them.
+
+    ``warm_up`` loads a model on the node the pool will route it to before any
+    sample is timed, so cold starts stay out of latency and score stats.
+    Concurrent warm-ups of the same model share one request. Warm-up failures
+    are logged and otherwise ignored; the run itself will surface the error.
+    """
+
+    def __init__(self):
+        self._warming: Dict[str, "asyncio.Task[bool]"] = {}
+
+    async def warm_up(self, model: str) -> bool:
+        task = self._warming.get(model)
+        if task is None:
+            task = asyncio.ensure_future(self._load(model))
+            self._warming[model] = task
+            task.add_done_callback(lambda _: self._warming.pop(model, None))
+        return await asyncio.shield(task)
+
+    async def release(self, model: str) -> bool:
+        """Ask every Ollama node holding a model to unload it now instead of
+        when keep_alive expires; True if they all did"""
+        holders = [e for e in ollama_pool.endpoints if model in e.loaded]
+        unloaded = await asyncio.gather(*[self._unload(e, model) for e in holders])
+        return all(unloaded)
+
+    async def _load(self, model: str) -> bool:
+        client = get_ollama_client()
+        try:
+            # A generate request without a prompt only loads the model; the
+            # pool marks it loaded on the node it was routed to
+            async with ollama_pool.route(model, client) as base_url:
+                response = await client.post(
+                    f"{base_url}/api/generate",
+                    json={
+                        "model": model,
+                        "keep_alive": OLLAMA_KEEP_ALIVE,
+                        "stream": False,
+                    },
+                    timeout=OLLAMA_WARMUP_TIMEOUT,
+                )
+                response.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"Model residency: could not warm up {model}: {e}")
+            return False
+
+    async def _unload(self, endpoint: OllamaEndpoint, model: str) -> bool:
+        client = get_ollama_client()
+        try:
+            # keep_alive 0 unloads the model once the (empty) request is done
+            response = await client.post(
+                f"{endpoint.url}/api/generate",
+                json={"model": model, "keep_alive": 0, "stream": False},
+                timeout=OLLAMA_WARMUP_TIMEOUT,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Model residency: could not unload {model} on {endpoint.url}: {e}")
+            return False
+        endpoint.loaded.discard(model)
+        return True
+
+    def order_models(self, models: Sequence[str]) -> List[str]:
+        """Order comparison models so that each Ollama model is loaded once.
+
+        Non-Ollama models and Ollama models already resident somewhere go
+        first, since running them cannot evict anything; the rest follow in
+        their original order, one model at a time.
+        """
+        resident = {
+            model for endpoint in ollama_pool.endpoints for model in endpoint.loaded
+        }
+
+        def rank(model: str) -> int:
+            if provider_for_model(model) != "ollama":
+                return 0
+            return 1 if model in resident else 2
+
+        return sorted(dict.fromkeys(models), key=rank)
+
+    async def snapshot(self) -> List[Dict[str, Any]]:
+        """Models currently loaded on each Ollama node, as reported by /api/ps"""
+        client = get_ollama_client()
+
+        async def node(url: str) -> Dict[str, Any]:
+            try:
+                response = await client.get(f"{url}/api/ps", timeout=5.0)
+                response.raise_for_status()
+            except Exception as e:
+                return {"url": url, "error": str(e), "models": []}
+            return {
+                "url": url,
+                "models": [
+                    {
+                        "name": model["name"],
+                        "size_vram": model.get("size_vram"),
+                        "expires_at": model.get("expires_at"),
+                    }
+                    for model in response.json().get("models", [])
+                ],
+            }
+
+        return await asyncio.gather(*[node(e.url) for e in ollama_pool.endpoints])
+
+
+# Global residency manager
+model_residency = ModelResidency()
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+# Wall-clock budget for one sample across all attempts and backoff sleeps,
+# and the timeout applied to each individual provider call
+LLM_SAMPLE_TIMEOUT = float(os.getenv("LLM_SAMPLE_TIMEOUT", "600"))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "120"))
+# Consecutive failures (5xx, timeouts, connection errors) that open a
+# circuit, and how long it stays open before a single trial call is let
+# through. Rate limits are waited out, not counted.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class ProviderError(HTTPException):
+    """Provider failure classified for the retry layer"""
+
+    def __init__(
+        self,
+        status_code: int,
+        detail: str,
+        retryable: bool = False,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(status_code=status_code, detail=detail)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(e: Exception) -> ProviderError:
+    if isinstance(e, ProviderError):
+        return e
+    if isinstance(e, asyncio.TimeoutError):
+        return ProviderError(504, "LLM call timed out", retryable=True)
+    if isinstance(e, HTTPException):
+        # Unclassified errors (missing API key, bad provider...) are not retried
+        return ProviderError(e.status_code, e.detail)
+    return ProviderError(500, str(e))
+
+
+def counts_against_breaker(error: ProviderError) -> bool:
+    """Whether a failed call says the provider (or node) is unhealthy: server
+    errors and timeouts do, a rate limit or a bad request does not"""
+    return error.status_code >= 500 or error.status_code == 408
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, never shorter than Retry-After"""
+    delay = random.uniform(
+        0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2**attempt))
+    )
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """Fail fast while a provider (or one Ollama node) is down.
+
+    Opens after ``failure_threshold`` consecutive failures. Once
+    ``reset_seconds`` have passed one trial call is allowed through; its
+    success closes the circuit and its failure re-opens it. A trial that ends
+    without a verdict (cancelled, rate limited) frees the slot for another.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def release_trial(self):
+        self.trial_in_flight = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker()
+    return _breakers[name]
+
+
+def breaker_states() -> Dict[str, str]:
+    return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+async def call_with_retries(
+    breaker_name: Optional[str],
+    attempt: Callable[[float], Awaitable[T]],
+    max_attempts: int = LLM_MAX_ATTEMPTS,
+    budget: float = LLM_SAMPLE_TIMEOUT,
+) -> Tuple[T, int]:
+    """Run ``attempt(timeout)`` with retries, backoff and a circuit breaker.
+
+    Returns the result and the number of retries it took. Non-retryable
+    errors, an open circuit and an exhausted time budget raise immediately.
+    With no ``breaker_name`` the caller keeps its own breakers (see
+    app.services.ollama_pool, which has one per node).
+    """
+    breaker = get_breaker(breaker_name) if breaker_name else None
+    deadline = time.monotonic() + budget
+    retries = 0
+    while True:
+        if breaker and not breaker.allow():
+            raise ProviderError(
+                503, f"{breaker_name} circuit is open; failing fast while it recovers"
+            )
+        remaining = deadline - time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                attempt(min(LLM_ATTEMPT_TIMEOUT, remaining)), remaining
+            )
+        except Exception as e:
+            error = classify_error(e)
+            if breaker:
+                if not error.retryable:
+                    # The provider answered; it is healthy even if the request
+                    # was bad
+                    breaker.record_success()
+                elif counts_against_breaker(error):
+                    breaker.record_failure()
+                else:
+                    # Rate limited: the provider is up, the call is waited out
+                    breaker.release_trial()
+            if not error.retryable or retries + 1 >= max_attempts:
+                raise error
+            delay = backoff_delay(retries, error.retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise error
+            retries += 1
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled (a hedge won, early stop, client gone): no verdict
+            if breaker:
+                breaker.release_trial()
+            raise
+        if breaker:
+            breaker.record_success()
+        return result, retries
@@ -0,0 +1,556 @@
+import asyncio
+import math
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app.services.batch import OpenAIBatchRunner, get_batch_http_client
+from app.services.cache import cache_key
+from app.services.cassette import Cassette, check_cassette, get_cassette
+from app.services.dispatch import DEFAULT_JOB_WEIGHT, DEFAULT_PRIORITY
+from app.services.hedging import hedger
+from app.services.llm import (
+    DEFAULT_MAX_CONCURRENCY,
+    PROVIDER_CONCURRENCY,
+    LLMResponse,
+    early_stop_condition,
+    generate,
+    provider_for_model,
+    record,
+)
+from app.models import TestResult
+from app.services.model_stats import model_history
+from app.services.residency import model_residency
+from app.services.scoring_pool import scoring_pool
+from app.services.tokens import (
+    call_cost,
+    count_tokens,
+    estimate_cost,
+    estimate_duration,
+)
+
+
+# Per-run fan-out. The per-provider ceiling lives in app.services.llm so that
+# concurrent runs share it.
+DEFAULT_RUN_CONCURRENCY = int(os.getenv("TEST_RUN_CONCURRENCY", "8"))
+MAX_RUN_CONCURRENCY = int(os.getenv("TEST_RUN_MAX_CONCURRENCY", "64"))
+
+# Per-call metrics copied from each LLMResponse onto results and TestResult rows
+CALL_METRIC_FIELDS = (
+    "latency_ms",
+    "ttfb_ms",
+    "prompt_tokens",
+    "completion_tokens",
+    "retries",
+    "cache_hit",
+    "ttft_ms",
+    "inter_token_ms",
+    "stopped_early",
+    "cost_usd",
+)
+
+
+def resolve_concurrency(requested: Optional[int] = None) -> int:
+    """Clamp a requested per-run concurrency to the configured bounds"""
+    if requested is None:
+        requested = DEFAULT_RUN_CONCURRENCY
+    return max(1, min(requested, MAX_RUN_CONCURRENCY))
+
+
+async def run_concurrently(
+    items: Sequence[Any],
+    worker: Callable[[int, Any], Awaitable[Any]],
+    concurrency: int,
+) -> List[Any]:
+    """Run ``worker(index, item)`` over items with at most ``concurrency`` in flight.
+
+    Results are returned in input order. If any worker raises, the remaining
+    work is cancelled and the exception propagates.
+    """
+    results: List[Any] = [None] * len(items)
+    pending = iter(range(len(items)))
+
+    async def _drain():
+        for index in pending:
+            results[index] = await worker(index, items[index])
+
+    workers = [
+        asyncio.create_task(_drain()) for _ in range(min(concurrency, len(items)))
+    ]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    return results
+
+
+def prepare_samples(
+    template: str, regression_set: List[Dict[str, Any]], strict: bool = True
+) -> List[Dict[str, Any]]:
+    """Render the prompt for every sample before any LLM call is made.
+
+    With ``strict`` a sample with a missing template variable aborts the run
+    with a 400; otherwise that sample is skipped.
+    """
+    samples = []
+    for i, sample in enumerate(regression_set):
+        variables = {k: v for k, v in sample.items() if k != "expected_output"}
+        expected_output = sample.get("expected_output", "")
+        try:
+            prompt = template.format(**variables)
+        except KeyError as e:
+            if strict:
+                raise HTTPException(
+                    status_code=400, detail=f"Missing variable in sample {i}: {e}"
+                )
+            continue
+        samples.append(
+            {
+                "sample_id": str(i),
+                "input_variables": variables,
+                "expected_output": expected_output,
+                "prompt": prompt,
+            }
+        )
+    return samples
+
+
+def _cassette_max_tokens(tape, prompt_system, max_tokens: int, mode: str) -> int:
+    """The max_tokens a cassette run is made with.
+
+    Responses are keyed by request, max_tokens included, and an "auto" cap
+    moves with every run that records output lengths, so a recording keeps
+    the cap it ran under and a replay reuses it.
+    """
+    key = f"max_tokens:{prompt_system.id}:{prompt_system.model}"
+    if mode == "replay":
+        entry = tape.get(key)
+        return entry["max_tokens"] if entry else max_tokens
+    tape.record(key, {"max_tokens": max_tokens})
+    return max_tokens
+
+
+async def run_prompt_system(
+    prompt_system,
+    samples: List[Dict[str, Any]],
+    evaluation_function: str,
+    concurrency: Optional[int] = None,
+    raise_on_error: bool = True,
+    cache_policy: str = "auto",
+    stream: bool = False,
+    early_stop: bool = False,
+    max_output_chars: Optional[int] = None,
+    hedge: Optional[bool] = None,
+    priority: str = DEFAULT_PRIORITY,
+    job_id: Optional[str] = None,
+    batch: bool = False,
+    max_tokens: Optional[int] = None,
+    cassette: Optional[str] = None,
+    cassette_mode: str = "off",
+    score_cutoff: float = 0.0,
+    weight: float = DEFAULT_JOB_WEIGHT,
+) -> List[Dict[str, Any]]:
+    """Call the LLM for every prepared sample concurrently and score the outputs.
+
+    Results keep the order of ``samples``. When ``raise_on_error`` is False a
+    failed sample yields a result with an ``error`` key instead of aborting.
+    With ``early_stop`` (or a ``max_output_chars`` cap) samples are streamed
+    and generation stops once the evaluation function has its answer.
+    ``hedge`` overrides the LLM_HEDGING default for this run.
+
+    Calls are dispatched in the ``priority`` class; the run is one job for
+    fair sharing, identified by ``job_id`` or a fresh id, and gets a share of
+    the class in proportion to its ``weight``.
+
+    With ``batch`` an OpenAI prompt system's samples are sent as one OpenAI
+    Batch API job instead (see app.services.batch), trading latency for
+    throughput and cost; other providers run as usual.
+
+    ``max_tokens`` overrides the prompt system's (see
+    app.services.model_stats.resolve_max_tokens); every result records the
+    limit it was generated under and whether its output was ``capped`` by it.
+
+    ``cassette_mode`` records every response to, or replays every response
+    from, the named ``cassette`` (see app.services.cassette); a replayed run
+    makes no calls, so it never goes through the Batch API.
+
+    Fuzzy scores below ``score_cutoff`` are reported as 0.0 (see
+    app.services.evaluation.evaluate_batch); large runs are scored in worker
+    processes (see app.services.scoring_pool).
+    """
+    check_cassette(cassette_mode, cassette)
+    job_id = job_id or str(uuid.uuid4())
+    if max_tokens is None:
+        max_tokens = prompt_system.max_tokens
+    if cassette_mode != "off":
+        max_tokens = _cassette_max_tokens(
+            get_cassette(cassette), prompt_system, max_tokens, cassette_mode
+        )
+
+    async def _run_sample(_: int, sample: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await generate(
+                prompt=sample["prompt"],
+                provider=prompt_system.provider,
+                model=prompt_system.model,
+                temperature=prompt_system.temperature,
+                max_tokens=max_tokens,
+                top_p=prompt_system.top_p,
+                top_k=prompt_system.top_k,
+                cache_policy=cache_policy,
+                stream=stream,
+                stop_when=(
+                    early_stop_condition(
+                        evaluation_function,
+                        sample["expected_output"],
+                        max_output_chars,
+                    )
+                    if early_stop or max_output_chars is not None
+                    else None
+                ),
+                hedge=hedge,
+                priority=priority,
+                job_id=job_id,
+                cassette=cassette,
+                cassette_mode=cassette_mode,
+                weight=weight,
+            )
+        except Exception as e:
+            if raise_on_error:
+                raise
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            return _failed_result(sample, error)
+        return _result(
+            sample, response, evaluation_function, prompt_system.model, max_tokens
+        )
+
+    if batch and samples and cassette_mode != "replay":
+        if prompt_system.provider == "openai":
+            results = await _run_batch(
+                prompt_system,
+                samples,
+                evaluation_function,
+                raise_on_error,
+                cache_policy,
+                max_tokens,
+                get_cassette(cassette) if cassette_mode == "record" else None,
+            )
+            return await score_results(results, evaluation_function, score_cutoff)
+        print(
+            f"Batch mode is only available for OpenAI; running "
+            f"{prompt_system.provider} samples one by one"
+        )
+
+    # Load the model before the first sample so no sample pays the cold start
+    if prompt_system.provider == "ollama" and samples:
+        await model_residency.warm_up(prompt_system.model)
+
+    results = await run_concurrently(
+        samples, _run_sample, resolve_concurrency(concurrency)
+    )
+    return await score_results(results, evaluation_function, score_cutoff)
+
+
+async def _run_batch(
+    prompt_system,
+    samples: List[Dict[str, Any]],
+    evaluation_function: str,
+    raise_on_error: bool,
+    cache_policy: str,
+    max_tokens: int,
+    tape: Optional[Cassette] = None,
+) -> List[Dict[str, Any]]:
+    """Run the samples as one Batch API job, recording the responses to
+    ``tape`` when given"""
+    try:
+        async with get_batch_http_client() as client:
+            responses = await OpenAIBatchRunner(client).run(
+                {sample["sample_id"]: sample["prompt"] for sample in samples},
+                prompt_system.model,
+                prompt_system.temperature,
+                max_tokens,
+                prompt_system.top_p,
+                prompt_system.top_k,
+                cache_policy=cache_policy,
+            )
+    except HTTPException as e:
+        if raise_on_error:
+            raise
+        # The whole batch failed; record it against every sample
+        responses = {sample["sample_id"]: e.detail for sample in samples}
+
+    results = []
+    for sample in samples:
+        response = responses[sample["sample_id"]]
+        if isinstance(response, str):
+            if raise_on_error:
+                raise HTTPException(status_code=502, detail=response)
+            results.append(_failed_result(sample, response))
+        else:
+            if tape is not None:
+                key = cache_key(
+                    "openai",
+                    prompt_system.model,
+                    sample["prompt"],
+                    prompt_system.temperature,
+                    max_tokens,
+                    prompt_system.top_p,
+                    prompt_system.top_k,
+                )
+                record(tape, key, response)
+            results.append(
+                _result(
+                    sample,
+                    response,
+                    evaluation_function,
+                    prompt_system.model,
+                    max_tokens,
+                )
+            )
+    return results
+
+
+def _failed_result(sample: Dict[str, Any], error: str) -> Dict[str, Any]:
+    return {
+        "sample_id": sample["sample_id"],
+        "input_variables": sample["input_variables"],
+        "expected_output": sample["expected_output"],
+        "error": f"LLM call failed for sample {sample['sample_id']}: {error}",
+    }
+
+
+def _result(
+    sample: Dict[str, Any],
+    response: LLMResponse,
+    evaluation_function: str,
+    model: str,
+    max_tokens: int,
+) -> Dict[str, Any]:
+    completion_tokens = response.completion_tokens
+    if completion_tokens is None:
+        # Cache hits and coalesced calls carry no usage; count their output
+        completion_tokens = count_tokens(response.text, model)
+    return {
+        "sample_id": sample["sample_id"],
+        "input_variables": sample["input_variables"],
+        "expected_output": sample["expected_output"],
+        "predicted_output": response.text,
+        # Filled in for the whole run at once by score_results
+        "score": None,
+        "evaluation_method": evaluation_function,
+        **call_metrics(response),
+        "max_tokens": max_tokens,
+        # A capped output may have been cut short; its score may not be its own
+        "capped": completion_tokens >= max_tokens,
+    }
+
+
+async def score_results(
+    results: List[Dict[str, Any]], evaluation_function: str, score_cutoff: float = 0.0
+) -> List[Dict[str, Any]]:
+    """Score every successful result of a run in one pass over its outputs,
+    in the scoring pool when the run is large (see app.services.scoring_pool).
+
+    If the scorer itself fails (the embedding model is unreachable, say) the
+    outputs are already paid for: they score 0.0 with a ``score_error`` and
+    can be scored again once stored (see rescore_test_run).
+    """
+    scored = [result for result in results if "error" not in result]
+    try:
+        scores = await scoring_pool.evaluate(
+            [result["predicted_output"] for result in scored],
+            [result["expected_output"] for result in scored],
+            evaluation_function,
+            score_cutoff,
+        )
+    except (HTTPException, OSError) as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"Scoring with {evaluation_function} failed; outputs kept: {error}")
+        scores = [0.0] * len(scored)
+        for result in scored:
+            result["score_error"] = f"Scoring failed: {error}"
+    for result, score in zip(scored, scores):
+        result["score"] = score
+    return results
+
+
+async def rescore_test_run(
+    db: Session, test_run, evaluation_function: str, score_cutoff: float = 0.0
+) -> Dict[str, Any]:
+    """Scores of a stored test run's outputs under ``evaluation_function``"""
+    rows = (
+        db.query(
+            TestResult.sample_id,
+            TestResult.predicted_output,
+            TestResult.expected_output,
+        )
+        .filter(TestResult.test_run_id == test_run.id)
+        .all()
+    )
+    scores = await scoring_pool.evaluate(
+        [row.predicted_output or "" for row in rows],
+        [row.expected_output or "" for row in rows],
+        evaluation_function,
+        score_cutoff,
+    )
+    total_samples = test_run.total_samples or len(rows)
+    return {
+        "test_run_id": test_run.id,
+        "evaluation_function": evaluation_function,
+        "avg_score": sum(scores) / total_samples if total_samples else 0,
+        "total_samples": total_samples,
+        "scores": [
+            {"sample_id": row.sample_id, "score": score}
+            for row, score in zip(rows, scores)
+        ],
+    }
+
+
+def typical_latency(provider: str, model: str) -> Optional[float]:
+    """Median latency in seconds of the model's recent calls in this process"""
+    return hedger.tracker(f"{provider}:{model}").percentile(50)
+
+
+def estimate_run(
+    provider: str,
+    model: str,
+    prompts: Sequence[str],
+    max_tokens: int,
+    concurrency: int = 1,
+    batch: bool = False,
+    history: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Tokens, cost and duration of a run, before any call is made.
+
+    Prompt tokens are counted exactly. The worst case assumes every output
+    runs to ``max_tokens``; the expected case and the duration come from the
+    model's ``history`` (see app.services.model_stats), falling back to this
+    process's recent latencies, and are None when there is nothing to go on.
+    """
+    estimate = estimate_cost(provider, model, prompts, max_tokens, batch)
+    calls = estimate["calls"]
+    history = history or {}
+
+    expected_tokens = expected_cost = None
+    if history.get("completion_tokens_mean") is not None:
+        expected_tokens = round(
+            calls * min(history["completion_tokens_mean"], max_tokens)
+        )
+        expected_cost = call_cost(
+            provider, model, estimate["prompt_tokens"], expected_tokens, batch
+        )
+
+    latency = history.get("latency_mean_ms")
+    latency = latency / 1000 if latency is not None else typical_latency(
+        provider, model
+    )
+    ceiling = PROVIDER_CONCURRENCY.get(provider, DEFAULT_MAX_CONCURRENCY)
+    estimate.update(
+        {
+            "expected_completion_tokens": expected_tokens,
+            "expected_cost_usd": expected_cost,
+            # Batch jobs finish whenever the provider gets to them
+            "estimated_duration_s": (
+                None
+                if batch
+                else estimate_duration(calls, min(concurrency, ceiling), latency)
+            ),
+            "history_samples": history.get("samples", 0),
+        }
+    )
+    return estimate
+
+
+def _sum_or_none(values: List[Optional[float]]) -> Optional[float]:
+    return None if None in values else sum(values)
+
+
+def estimate_comparison(
+    template: str,
+    template_variables: List[str],
+    models: List[str],
+    regression_set: List[Dict[str, Any]],
+    max_tokens: int,
+    db: Optional[Session] = None,
+) -> Dict[str, Any]:
+    """Estimate of a model comparison, per model and in total; models run one
+    after another and their samples one at a time. With ``db`` each model's
+    recorded history is used."""
+    prompts = []
+    for sample in regression_set:
+        prompt = template
+        for var in template_variables:
+            if var in sample:
+                prompt = prompt.replace(f"{{{var}}}", str(sample[var]))
+        prompts.append(prompt)
+
+    per_model = {}
+    for model in dict.fromkeys(models):
+        provider = provider_for_model(model)
+        history = model_history(db, provider, model) if db is not None else None
+        per_model[model] = estimate_run(
+            provider, model, prompts, max_tokens, history=history
+        )
+
+    estimates = list(per_model.values())
+    return {
+        "models": per_model,
+        "calls": sum(e["calls"] for e in estimates),
+        "prompt_tokens": sum(e["prompt_tokens"] for e in estimates),
+        "max_completion_tokens": sum(e["max_completion_tokens"] for e in estimates),
+        "expected_completion_tokens": _sum_or_none(
+            [e["expected_completion_tokens"] for e in estimates]
+        ),
+        "max_cost_usd": sum(e["max_cost_usd"] for e in estimates),
+        "expected_cost_usd": _sum_or_none(
+            [e["expected_cost_usd"] for e in estimates]
+        ),
+        "estimated_duration_s": _sum_or_none(
+            [e["estimated_duration_s"] for e in estimates]
+        ),
+    }
+
+
+def cache_summary(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Count response cache hits and misses over a run's successful samples"""
+    completed = [result for result in results if "error" not in result]
+    hits = sum(1 for result in completed if result.get("cache_hit"))
+    return {"hits": hits, "misses": len(completed) - hits}
+
+
+def call_metrics(response: LLMResponse) -> Dict[str, Any]:
+    return {field: getattr(response, field) for field in CALL_METRIC_FIELDS}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0-100) of a list of values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def metrics_summary(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Roll per-call metrics up to p50/p95 latency and TTFT, total tokens and
+    total cost"""
+    latencies = [r["latency_ms"] for r in results if r.get("latency_ms") is not None]
+    ttfts = [r["ttft_ms"] for r in results if r.get("ttft_ms") is not None]
+    total_tokens = sum(
+        (r.get("prompt_tokens") or 0) + (r.get("completion_tokens") or 0)
+        for r in results
+    )
+    return {
+        "p50_latency_ms": percentile(latencies, 50),
+        "p95_latency_ms": percentile(latencies, 95),
+        "p50_ttft_ms": percentile(ttfts, 50),
+        "p95_ttft_ms": percentile(ttfts, 95),
+        "total_tokens": total_tokens,
+        "total_cost_usd": sum(r.get("cost_usd") or 0.0 for r in results),
+    }
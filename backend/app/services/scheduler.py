@@ -10,6 +10,22 @@ from sqlalchemy.orm import Session
 from app.db.session import SessionLocal
 from app.models import TestSchedule, TestRun, TestResult, PromptSystem
 from app.services.email_service import email_service
+from app.services.model_stats import (
+    record_model_stats,
+    record_output_lengths,
+    resolve_max_tokens,
+)
+from app.services.runner import (
+    CALL_METRIC_FIELDS,
+    cache_summary,
+    metrics_summary,
+    prepare_samples,
+    run_prompt_system,
+)
+
+# "batch" sends OpenAI runs through the Batch API: slower, but cheaper and
+# with far more quota for large regression sets
+EXECUTION_MODES = ("realtime", "batch")
 
 class TestScheduler:
     def __init__(self):
@@ -68,75 +84,67 @@ class TestScheduler:
             db.add(test_run)
             db.commit()
 
-            # Import the LLM calling function
-            from app.main import call_llm, evaluate_output
-            # Process each sample
-            results = []
+            # Process samples concurrently; a failed sample is recorded and
+            # skipped rather than aborting the whole scheduled run
+            samples = prepare_samples(
+                prompt_system.template, regression_set, strict=False
+            )
+            results = await run_prompt_system(
+                prompt_system,
+                samples,
+                schedule.evaluation_function,
+                raise_on_error=False,
+                priority="scheduled",
+                job_id=test_run_id,
+                batch=schedule.execution_mode == "batch",
+                max_tokens=resolve_max_tokens(db, prompt_system),
+                cassette=schedule.cassette,
+                cassette_mode=schedule.cassette_mode or "off",
+            )
             total_score = 0
             failure_occurred = False
             failure_message = ""
 
-            for i, sample in enumerate(regression_set):
-                # Extract variables and expected output
-                variables = {k: v for k, v in sample.items() if k != "expected_output"}
-                expected_output = sample.get("expected_output", "")
-
-                # Interpolate template
-                try:
-                    prompt = prompt_system.template.format(**variables)
-                except KeyError as e:
-                    continue
-
-                # Call LLM
-                try:
-                    predicted_output = await call_llm(
-                        prompt=prompt,
-                        provider=prompt_system.provider,
-                        model=prompt_system.model,
-                        temperature=prompt_system.temperature,
-                        max_tokens=prompt_system.max_tokens,
-                        top_p=prompt_system.top_p,
-                        top_k=prompt_system.top_k,
-                    )
-                except Exception as e:
+            for result in results:
+                if "error" in result:
                     # Record failure for email notification
                     failure_occurred = True
-                    failure_message = f"LLM call failed for sample {i}: {str(e)}"
+                    failure_message = result["error"]
                     continue
 
-                # Evaluate
-                score = evaluate_output(
-                    predicted_output, expected_output, schedule.evaluation_function
-                )
-                total_score += score
+                total_score += result["score"]
 
                 # Store result
                 db_result = TestResult(
                     id=str(uuid.uuid4()),
                     test_run_id=test_run_id,
-                    sample_id=str(i),
-                    input_variables=json.dumps(variables),
-                    expected_output=expected_output,
-                    predicted_output=predicted_output,
-                    score=score,
+                    sample_id=result["sample_id"],
+                    input_variables=json.dumps(result["input_variables"]),
+                    expected_output=result["expected_output"],
+                    predicted_output=result["predicted_output"],
+                    score=result["score"],
                     evaluation_method=schedule.evaluation_function,
+                    **{field: result[field] for field in CALL_METRIC_FIELDS},
+                    max_tokens=result["max_tokens"],
+                    capped=result["capped"],
                 )
                 db.add(db_result)
 
-                results.append(
-                    {
-                        "sample_id": str(i),
-                        "input_variables": variables,
-                        "expected_output": expected_output,
-                        "predicted_output": predicted_output,
-                        "score": score,
-                    }
-                )
-
             # Update test run with aggregate metrics
             avg_score = total_score / len(regression_set) if regression_set else 0
             test_run.avg_score = avg_score
             test_run.total_samples = len(regression_set)
+            for field, value in metrics_summary(results).items():
+                setattr(test_run, field, value)
+            # Batch latencies are the whole job's, not the model's
+            record_model_stats(
+                db,
+                prompt_system.provider,
+                prompt_system.model,
+                results,
+                include_latency=schedule.execution_mode != "batch",
+            )
+            record_output_lengths(db, prompt_system.id, prompt_system.model, results)
 
             # Check for score drops and send email notifications
             score_drop_occurred = False
@@ -206,8 +214,10 @@ class TestScheduler:
                 and schedule.email_notifications
                 else "no alerts"
             )
+            cache = cache_summary(results)
             print(
-                f"Scheduled test completed for {schedule.name}: avg_score={avg_score}, {alert_status}"
+                f"Scheduled test completed for {schedule.name}: avg_score={avg_score}, "
+                f"{alert_status}, cache hits={cache['hits']} misses={cache['misses']}"
             )
 
         except Exception as e:
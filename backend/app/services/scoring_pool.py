@@ -0,0 +1,223 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services.embeddings import embedding_similarity
+from app.services.evaluation import evaluate_batch, normalize, timed_evaluate_batch
+
+
+# Worker processes for CPU-heavy scoring (0 = always score on the event loop)
+SCORING_POOL_WORKERS = int(
+    os.getenv("SCORING_POOL_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+# A batch is sent to the pool once its estimated work, in character pairs
+# (the sum of len(predicted) * len(expected)), reaches this; smaller batches
+# cost less to score inline than to ship to another process
+SCORING_POOL_MIN_WORK = int(os.getenv("SCORING_POOL_MIN_WORK", "10000000"))
+# Chunks per worker an offloaded batch is split into, so that one slow chunk
+# does not hold up the rest of the batch
+SCORING_POOL_CHUNKS_PER_WORKER = int(
+    os.getenv("SCORING_POOL_CHUNKS_PER_WORKER", "4")
+)
+
+# Scorers whose cost grows with the product of the output lengths; the others
+# are linear and always run inline
+CPU_BOUND_METHODS = ("fuzzy", "indel")
+
+
+def estimate_work(predicted: Sequence[str], expected: Sequence[str]) -> int:
+    return sum(len(p) * len(e) for p, e in zip(predicted, expected))
+
+
+def split_chunks(
+    predicted: Sequence[str], expected: Sequence[str], chunk_work: int
+) -> List[Tuple[int, int]]:
+    """(start, end) row ranges of roughly ``chunk_work`` character pairs each"""
+    chunks = []
+    start = work = 0
+    for i, (p, e) in enumerate(zip(predicted, expected)):
+        work += len(p) * len(e)
+        if work >= chunk_work:
+            chunks.append((start, i + 1))
+            start, work = i + 1, 0
+    if start < len(predicted):
+        chunks.append((start, len(predicted)))
+    return chunks
+
+
+class ScoringPool:
+    """Scores large batches of CPU-bound evaluations in worker processes.
+
+    Batches below SCORING_POOL_MIN_WORK, and linear methods such as "exact",
+    are scored inline. Larger ones are split into chunks of similar work and
+    awaited from the pool, so the event loop keeps serving requests and LLM
+    calls while they are scored. Workers are started on first use with the
+    "spawn" method (the server process runs threads, which fork does not copy
+    safely); a pool whose worker died is replaced and the batch scored inline.
+    """
+
+    def __init__(
+        self,
+        workers: int = SCORING_POOL_WORKERS,
+        min_work: int = SCORING_POOL_MIN_WORK,
+        chunks_per_worker: int = SCORING_POOL_CHUNKS_PER_WORKER,
+    ):
+        self.workers = workers
+        self.min_work = min_work
+        self.chunks_per_worker = max(1, chunks_per_worker)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.inline_batches = 0
+        self.offloaded_batches = 0
+        self.chunks = 0
+        self.completed_chunks = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.pool_restarts = 0
+        self.inline_cpu_seconds = 0.0
+        self.worker_cpu_seconds = 0.0
+        self.chunk_wall_seconds = 0.0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def should_offload(self, method: str, work: int) -> bool:
+        return (
+            self.workers > 0
+            and method in CPU_BOUND_METHODS
+            and work >= self.min_work
+        )
+
+    async def evaluate(
+        self,
+        predicted: Sequence[str],
+        expected: Sequence[str],
+        method: str = "fuzzy",
+        score_cutoff: float = 0.0,
+    ) -> List[float]:
+        """evaluate_batch, without blocking the event loop on large batches;
+        also scores "embedding" (see app.services.embeddings)"""
+        if len(predicted) != len(expected):
+            raise ValueError("predicted and expected must be the same length")
+        if method == "embedding":
+            # Waits on the embedding model, not the CPU
+            return await embedding_similarity(normalize(predicted), normalize(expected))
+        work = estimate_work(predicted, expected)
+        if not self.should_offload(method, work):
+            return self._evaluate_inline(predicted, expected, method, score_cutoff)
+
+        chunk_work = max(
+            self.min_work // self.chunks_per_worker,
+            work // (self.workers * self.chunks_per_worker),
+        )
+        chunks = split_chunks(predicted, expected, chunk_work)
+        try:
+            parts = await asyncio.gather(
+                *(
+                    self._run_chunk(
+                        list(predicted[start:end]),
+                        list(expected[start:end]),
+                        method,
+                        score_cutoff,
+                    )
+                    for start, end in chunks
+                )
+            )
+        except BrokenProcessPool:
+            print("Scoring pool worker died; restarting the pool")
+            self.shutdown()
+            self.pool_restarts += 1
+            return self._evaluate_inline(predicted, expected, method, score_cutoff)
+        self.offloaded_batches += 1
+        return [score for part in parts for score in part]
+
+    def _evaluate_inline(
+        self,
+        predicted: Sequence[str],
+        expected: Sequence[str],
+        method: str,
+        score_cutoff: float,
+    ) -> List[float]:
+        started = time.thread_time()
+        scores = evaluate_batch(predicted, expected, method, score_cutoff)
+        self.inline_cpu_seconds += time.thread_time() - started
+        self.inline_batches += 1
+        return scores
+
+    async def _run_chunk(
+        self,
+        predicted: List[str],
+        expected: List[str],
+        method: str,
+        score_cutoff: float,
+    ) -> List[float]:
+        loop = asyncio.get_running_loop()
+        self.chunks += 1
+        self.in_flight += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        started = time.perf_counter()
+        try:
+            scores, cpu_seconds = await loop.run_in_executor(
+                self._pool(),
+                timed_evaluate_batch,
+                predicted,
+                expected,
+                method,
+                score_cutoff,
+            )
+        finally:
+            self.in_flight -= 1
+        self.completed_chunks += 1
+        self.chunk_wall_seconds += time.perf_counter() - started
+        self.worker_cpu_seconds += cpu_seconds
+        return scores
+
+    @property
+    def queued(self) -> int:
+        """Chunks waiting for a free worker"""
+        return max(0, self.in_flight - self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        completed = self.completed_chunks
+        return {
+            "workers": self.workers,
+            "started": self._executor is not None,
+            "min_work": self.min_work,
+            "inline_batches": self.inline_batches,
+            "offloaded_batches": self.offloaded_batches,
+            "chunks": self.chunks,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "pool_restarts": self.pool_restarts,
+            "inline_cpu_seconds": round(self.inline_cpu_seconds, 3),
+            "worker_cpu_seconds": round(self.worker_cpu_seconds, 3),
+            # Wall time per chunk beyond its CPU time is queueing and transfer
+            "avg_chunk_ms": (
+                round(self.chunk_wall_seconds / completed * 1000, 2)
+                if completed
+                else None
+            ),
+            "avg_chunk_cpu_ms": (
+                round(self.worker_cpu_seconds / completed * 1000, 2)
+                if completed
+                else None
+            ),
+        }
+
+
+# Global scoring pool
+scoring_pool = ScoringPool()
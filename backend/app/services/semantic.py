@@ -0,0 +1,195 @@
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# Length of the character n-grams texts are broken into (words are padded
+# with a space on either side, so "paris" yields " pa", "par", ... "is ")
+SEMANTIC_NGRAM = int(os.getenv("SEMANTIC_NGRAM", "3"))
+# N-grams are hashed into this many dimensions (a power of two)
+SEMANTIC_HASH_BITS = int(os.getenv("SEMANTIC_HASH_BITS", "20"))
+# Distinct expected outputs whose vectors are kept between runs
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "10000"))
+
+# A text's vector: sorted hashed n-gram ids and their counts
+TermCounts = Tuple[np.ndarray, np.ndarray]
+
+_EMPTY: TermCounts = (np.empty(0, np.int64), np.empty(0, np.int64))
+
+
+def _hash_ngrams(codes: np.ndarray, n: int) -> np.ndarray:
+    """Hashed id of the n-gram starting at each of the first len - n + 1
+    code points"""
+    count = len(codes) - n + 1
+    h = np.zeros(count, np.uint64)
+    for offset in range(n):
+        h = (h * np.uint64(1000003)) ^ codes[offset : offset + count]
+    # Mix the high bits down before keeping the low ones
+    h ^= h >> np.uint64(29)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(32)
+    return (h & np.uint64((1 << SEMANTIC_HASH_BITS) - 1)).astype(np.int64)
+
+
+def _column_terms(
+    texts: Sequence[str], n: int = SEMANTIC_NGRAM
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Row, hashed n-gram id and count of every distinct n-gram of every text,
+    ordered by row and then id, computed for the whole column at once"""
+    # One code point array for the column: each text padded with a space on
+    # either side and ended by a NUL
+    joined = " " + " \0 ".join(texts) + " \0"
+    codes = np.frombuffer(joined.encode("utf-32-le"), np.uint32).astype(np.uint64)
+    lengths = np.fromiter(map(len, texts), np.int64, len(texts)) + 3
+    rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    if len(codes) < n:
+        return _EMPTY[0], _EMPTY[0], _EMPTY[0]
+
+    ids = _hash_ngrams(codes, n)
+    # Keep n-grams that lie within one text
+    valid = np.ones(len(ids), bool)
+    for offset in range(n):
+        valid &= codes[offset : offset + len(ids)] != 0
+    keys, counts = np.unique(
+        (rows[: len(ids)][valid] << SEMANTIC_HASH_BITS) | ids[valid],
+        return_counts=True,
+    )
+    return keys >> SEMANTIC_HASH_BITS, keys & ((1 << SEMANTIC_HASH_BITS) - 1), counts
+
+
+def term_counts(texts: Sequence[str], n: int = SEMANTIC_NGRAM) -> List[TermCounts]:
+    """Hashed character n-gram counts of each text"""
+    if not texts:
+        return []
+    rows, features, counts = _column_terms(texts, n)
+    bounds = np.searchsorted(rows, np.arange(len(texts) + 1))
+    return [
+        (features[start:end], counts[start:end])
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+class VectorCache:
+    """Term counts of expected outputs, kept across runs.
+
+    Regression sets are scored again and again by repeat runs, schedules and
+    comparisons, so only outputs not seen before are vectorized. Entries are
+    keyed by text and the least recently used are evicted first.
+    """
+
+    def __init__(self, size: int = SEMANTIC_CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[str, TermCounts]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts: Sequence[str]) -> Dict[str, TermCounts]:
+        found = {}
+        for text in set(texts):
+            entry = self._entries.get(text)
+            if entry is not None:
+                self._entries.move_to_end(text)
+                found[text] = entry
+        missing = [text for text in set(texts) if text not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        for text, entry in zip(missing, term_counts(missing)):
+            found[text] = entry
+            if self.size > 0:
+                self._entries[text] = entry
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return found
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+
+# Global cache of expected output vectors
+expected_vectors = VectorCache()
+
+
+def _gather(
+    sizes: np.ndarray, values: np.ndarray, index: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows and values of the column whose row i holds the ``index[i]``-th of
+    the runs of ``values`` whose lengths are ``sizes``"""
+    lengths = sizes[index]
+    rows = np.repeat(np.arange(len(index), dtype=np.int64), lengths)
+    # Position of each entry within its row, plus where its run starts
+    row_starts = np.cumsum(lengths) - lengths
+    take = np.arange(len(rows)) - np.repeat(row_starts, lengths)
+    take += np.repeat((np.cumsum(sizes) - sizes)[index], lengths)
+    return rows, values[take]
+
+
+def cosine_batch(predicted: Sequence[str], expected: Sequence[str]) -> List[float]:
+    """TF-IDF cosine similarity of each predicted output to its expected output.
+
+    Texts are bags of hashed character n-grams, so inflections, typos and
+    word order cost little, while words not in the expected output lower the
+    score. Terms are weighted by 1 + log(count) and by their inverse document
+    frequency across the distinct expected outputs, so words every answer
+    shares count for less. Two empty texts score 1.0.
+    """
+    if not predicted:
+        return []
+    size = len(predicted)
+    # Each distinct expected output is vectorized once, and only if new
+    cached = expected_vectors.get_many(expected)
+    distinct = {text: i for i, text in enumerate(cached)}
+    index = np.fromiter(map(distinct.__getitem__, expected), np.int64, size)
+    sizes = np.fromiter((len(f) for f, _ in cached.values()), np.int64, len(cached))
+    d_rows = np.repeat(np.arange(len(cached), dtype=np.int64), sizes)
+    d_features = np.concatenate([f for f, _ in cached.values()] + [_EMPTY[0]])
+    d_counts = np.concatenate([c for _, c in cached.values()] + [_EMPTY[1]])
+
+    # Smoothed IDF over the regression set; unseen terms get the highest
+    df_features, df = np.unique(d_features, return_counts=True)
+
+    def weights(features: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        frequency = np.zeros(len(features), np.int64)
+        if df_features.size:
+            at = np.searchsorted(df_features, features)
+            at = np.minimum(at, len(df_features) - 1)
+            seen = df_features[at] == features
+            frequency[seen] = df[at[seen]]
+        idf = np.log((1 + len(cached)) / (1 + frequency)) + 1
+        return (1 + np.log(counts)) * idf
+
+    # Expected vectors are weighted once per distinct text, then laid out
+    # one per row
+    d_weights = weights(d_features, d_counts)
+    e_norms = np.sqrt(np.bincount(d_rows, d_weights**2, len(cached)))[index]
+    e_rows, e_keys = _gather(sizes, d_features, index)
+    e_keys |= e_rows << SEMANTIC_HASH_BITS
+    _, e_weights = _gather(sizes, d_weights, index)
+
+    p_rows, p_features, p_counts = _column_terms(predicted)
+    p_weights = weights(p_features, p_counts)
+    p_norms = np.sqrt(np.bincount(p_rows, p_weights**2, size))
+    p_keys = (p_rows << SEMANTIC_HASH_BITS) | p_features
+
+    # Matching (row, feature) pairs of the two columns give every dot product
+    shared, p_at, e_at = np.intersect1d(
+        p_keys, e_keys, assume_unique=True, return_indices=True
+    )
+    dots = np.bincount(
+        shared >> SEMANTIC_HASH_BITS, p_weights[p_at] * e_weights[e_at], size
+    )
+
+    norms = p_norms * e_norms
+    scores = np.divide(dots, norms, out=np.zeros(size), where=norms > 0)
+    scores[(p_norms == 0) & (e_norms == 0)] = 1.0
+    # Rounding can leave identical texts a hair short of 1.0
+    scores[np.fromiter(map(str.__eq__, predicted, expected), bool, size)] = 1.0
+    return np.clip(scores, 0.0, 1.0).tolist()
@@ -0,0 +1,77 @@
+import math
+from collections import Counter
+from typing import Dict, Optional
+
+
+# Within a cutoff run, how many characters pass between checks on whether the
+# score can still reach the cutoff
+CUTOFF_CHECK_INTERVAL = 64
+
+
+def lcs_length(a: str, b: str, min_length: int = 0) -> Optional[int]:
+    """Length of the longest common subsequence of ``a`` and ``b``.
+
+    Bit-parallel (Allison-Dix / Hyyrö): one bit per character of the shorter
+    string, packed into a Python int, so each character of the longer string
+    costs a handful of word operations instead of a row of a DP table. Returns
+    None as soon as the result is certain to be below ``min_length``.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return 0 if min_length <= 0 else None
+
+    masks: Dict[str, int] = {}
+    bit = 1
+    for char in a:
+        masks[char] = masks.get(char, 0) | bit
+        bit <<= 1
+    full = bit - 1
+    get = masks.get
+
+    # Zero bits of v mark the positions of a matched so far
+    v = full
+    if min_length <= 0:
+        for char in b:
+            u = v & get(char, 0)
+            v = ((v + u) | (v - u)) & full
+        return len(a) - v.bit_count()
+
+    for start in range(0, len(b), CUTOFF_CHECK_INTERVAL):
+        for char in b[start : start + CUTOFF_CHECK_INTERVAL]:
+            u = v & get(char, 0)
+            v = ((v + u) | (v - u)) & full
+        # Each remaining character adds at most one to the subsequence
+        remaining = len(b) - start - CUTOFF_CHECK_INTERVAL
+        if len(a) - v.bit_count() + max(0, remaining) < min_length:
+            return None
+    length = len(a) - v.bit_count()
+    return length if length >= min_length else None
+
+
+def indel_ratio(a: str, b: str, score_cutoff: float = 0.0) -> float:
+    """Normalised Indel similarity: 2 * LCS / (len(a) + len(b)).
+
+    The same measure as difflib.SequenceMatcher.ratio(), which is 2 * M / T
+    for the matches M its heuristic finds; here M is the exact longest common
+    subsequence, so the result is never lower than difflib's. Scores below
+    ``score_cutoff`` are returned as 0.0, and hopeless pairs are rejected
+    without computing the subsequence.
+    """
+    total = len(a) + len(b)
+    if total == 0 or a == b:
+        return 1.0
+
+    needed = math.ceil(score_cutoff * total / 2 - 1e-9) if score_cutoff > 0 else 0
+    if needed:
+        # The shorter string, and then the shared characters, bound the LCS
+        if min(len(a), len(b)) < needed:
+            return 0.0
+        if sum((Counter(a) & Counter(b)).values()) < needed:
+            return 0.0
+
+    length = lcs_length(a, b, needed)
+    if length is None:
+        return 0.0
+    score = 2 * length / total
+    return score if score >= score_cutoff else 0.0
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.db.redis_client import get_async_redis
+
+
+# "deterministic" coalesces identical in-flight requests with temperature 0
+# or a pinned seed, "always" sampled ones too (N trials then share one
+# output, hiding their variance), "off" disables coalescing
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "deterministic")
+# Also coalesce across workers/replicas through a Redis lock and result hand-off
+LLM_SINGLE_FLIGHT_DISTRIBUTED = (
+    os.getenv("LLM_SINGLE_FLIGHT_DISTRIBUTED", "false").lower() == "true"
+)
+# How long a leader may hold the lock, and how long its result stays readable
+SINGLE_FLIGHT_LOCK_SECONDS = float(
+    os.getenv("LLM_SINGLE_FLIGHT_LOCK_SECONDS", "180")
+)
+SINGLE_FLIGHT_RESULT_SECONDS = 60
+
+SINGLE_FLIGHT_PREFIX = "single_flight:"
+
+# After a Redis error the distributed tier is skipped for this long
+REDIS_RETRY_SECONDS = 30.0
+
+
+class SingleFlight:
+    """Share one upstream call between concurrent identical requests.
+
+    Within a process the first caller for a key starts the call as a task and
+    later callers await the same task. With ``distributed`` enabled the leader
+    also holds a Redis lock; callers in other processes poll for the result it
+    publishes, and take over if the lock disappears without one.
+
+    ``run`` returns the result and whether it was produced by another caller.
+    """
+
+    def __init__(
+        self,
+        mode: str = LLM_SINGLE_FLIGHT,
+        distributed: bool = LLM_SINGLE_FLIGHT_DISTRIBUTED,
+        lock_seconds: float = SINGLE_FLIGHT_LOCK_SECONDS,
+    ):
+        self.mode = mode
+        self.distributed = distributed
+        self.lock_seconds = lock_seconds
+        self.coalesced = 0
+        self._in_flight: Dict[str, "asyncio.Task[Tuple[Any, bool]]"] = {}
+        self._redis_retry_at = 0.0
+
+    def should_use(self, temperature: float, seed: Optional[int]) -> bool:
+        if self.mode == "off":
+            return False
+        if self.mode == "deterministic":
+            return temperature == 0 or seed is not None
+        return True
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], str] = json.dumps,
+        decode: Callable[[str], Any] = json.loads,
+    ) -> Tuple[Any, bool]:
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            result, _ = await asyncio.shield(task)
+            return result, True
+
+        if self.distributed:
+            coro = self._run_distributed(key, fn, encode, decode)
+        else:
+            coro = self._run_local(fn)
+        task = asyncio.ensure_future(coro)
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so that one cancelled caller does not cancel the shared call
+        return await asyncio.shield(task)
+
+    async def _run_local(self, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        return await fn(), False
+
+    async def _run_distributed(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], str],
+        decode: Callable[[str], Any],
+    ) -> Tuple[Any, bool]:
+        if time.monotonic() < self._redis_retry_at:
+            return await self._run_local(fn)
+
+        lock_key = f"{SINGLE_FLIGHT_PREFIX}lock:{key}"
+        result_key = f"{SINGLE_FLIGHT_PREFIX}result:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_seconds
+        delay = 0.05
+        try:
+            client = get_async_redis()
+            while True:
+                if await client.set(
+                    lock_key, token, nx=True, px=int(self.lock_seconds * 1000)
+                ):
+                    break
+                # Another process is the leader: wait for its hand-off
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                published = await client.get(result_key)
+                if published is not None:
+                    self.coalesced += 1
+                    return decode(published), True
+                if time.monotonic() > deadline:
+                    return await self._run_local(fn)
+        except Exception as e:
+            print(f"Single-flight: Redis unavailable, coalescing locally only: {e}")
+            self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+            return await self._run_local(fn)
+
+        try:
+            result = await fn()
+            try:
+                await client.set(
+                    result_key, encode(result), ex=SINGLE_FLIGHT_RESULT_SECONDS
+                )
+            except Exception as e:
+                print(f"Single-flight: could not publish result: {e}")
+            return result, False
+        finally:
+            try:
+                if await client.get(lock_key) == token:
+                    await client.delete(lock_key)
+            except Exception:
+                pass
+
+
+# Global single-flight instance
+single_flight = SingleFlight()
@@ -0,0 +1,95 @@
+import json
+import math
+from typing import Dict, Optional
+
+
+# Relative error of quantiles read from a sketch
+SKETCH_RELATIVE_ACCURACY = 0.02
+
+
+class QuantileSketch:
+    """Streaming quantile sketch with bounded relative error (DDSketch-style).
+
+    Positive values go into logarithmic buckets whose width grows with the
+    value, so any quantile is within ``relative_accuracy`` of the true one and
+    the number of buckets depends on the range of values, not on how many
+    were added. Sketches merge by adding bucket counts, and serialise to JSON
+    for storage. Zero and negative values are counted in a bucket of their
+    own and read back as 0.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.max: Optional[float] = None
+
+    def add(self, value: float, count: int = 1):
+        if value <= 0:
+            self.zeros += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "QuantileSketch"):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Approximate value at quantile ``q`` (0-1)"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket in relative terms
+                value = 2 * self._gamma**index / (self._gamma + 1)
+                return min(value, self.max) if self.max is not None else value
+        return self.max
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "relative_accuracy": self.relative_accuracy,
+                "buckets": self.buckets,
+                "zeros": self.zeros,
+                "count": self.count,
+                "total": self.total,
+                "max": self.max,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data: Optional[str]) -> "QuantileSketch":
+        if not data:
+            return cls()
+        state = json.loads(data)
+        sketch = cls(state["relative_accuracy"])
+        sketch.buckets = {
+            int(index): count for index, count in state["buckets"].items()
+        }
+        sketch.zeros = state["zeros"]
+        sketch.count = state["count"]
+        sketch.total = state["total"]
+        sketch.max = state["max"]
+        return sketch
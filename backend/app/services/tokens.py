@@ -0,0 +1,159 @@
+import json
+import math
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+
+# USD per million (input, output) tokens. Longest matching prefix wins, so
+# dated snapshots such as gpt-4o-2024-08-06 use their family's price.
+# LLM_PRICES (JSON, same shape) adds to or overrides the table.
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+PRICES: Dict[str, Tuple[float, float]] = {
+    **DEFAULT_PRICES,
+    **{
+        model: (float(price[0]), float(price[1]))
+        for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()
+    },
+}
+# Providers whose calls cost nothing per token
+FREE_PROVIDERS = ("ollama", "fake")
+# The Batch API bills at a discount off the table price
+OPENAI_BATCH_DISCOUNT = float(os.getenv("OPENAI_BATCH_DISCOUNT", "0.5"))
+
+# Tokenizer used for models tiktoken does not know (local models included)
+FALLBACK_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    # tiktoken downloads its vocabularies on first use; offline it cannot, and
+    # counts are then estimated
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        print(f"Token counting: no tokenizer for {model} ({e}); estimating")
+        return None
+    try:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        print(f"Token counting: no tokenizer available ({e}); estimating")
+        return None
+
+
+def load_encodings(models: Iterable[str] = ()):
+    """Load the encodings of the priced models, of ``models`` and the fallback
+    one, so that no count made later on the event loop waits on a download.
+    Blocking; run it in a thread."""
+    for model in ("", *PRICES, *models):
+        _encoding(model)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = "") -> int:
+    """Number of tokens in ``text`` for ``model``.
+
+    Uses the model's tiktoken encoding (cl100k_base for models it does not
+    know) and falls back to ~4 characters per token without tiktoken.
+    Results are memoised, since the same prompts recur across runs.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def model_price(provider: str, model: str) -> Tuple[float, float]:
+    """USD per million (input, output) tokens for a model.
+
+    Models missing from the table are priced like the most expensive one, so
+    budgets err on the safe side.
+    """
+    if provider in FREE_PROVIDERS:
+        return (0.0, 0.0)
+    matches = [name for name in PRICES if model.startswith(name)]
+    if matches:
+        return PRICES[max(matches, key=len)]
+    return max(PRICES.values(), key=lambda price: price[0] + price[1])
+
+
+def call_cost(
+    provider: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    batch: bool = False,
+) -> float:
+    input_price, output_price = model_price(provider, model)
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1e6
+    return cost * OPENAI_BATCH_DISCOUNT if batch else cost
+
+
+def estimate_cost(
+    provider: str,
+    model: str,
+    prompts: Iterable[str],
+    max_tokens: int,
+    batch: bool = False,
+) -> Dict[str, Any]:
+    """Worst-case tokens and cost of sending ``prompts`` to a model.
+
+    Prompt tokens are counted exactly; every call is assumed to use its full
+    ``max_tokens``.
+    """
+    calls = 0
+    prompt_tokens = 0
+    for prompt in prompts:
+        calls += 1
+        prompt_tokens += count_tokens(prompt, model)
+    completion_tokens = calls * max_tokens
+    return {
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "max_completion_tokens": completion_tokens,
+        "max_cost_usd": call_cost(
+            provider, model, prompt_tokens, completion_tokens, batch
+        ),
+    }
+
+
+def estimate_duration(
+    calls: int, concurrency: int, latency: Optional[float]
+) -> Optional[float]:
+    """Seconds to make ``calls`` calls of ``latency`` seconds, ``concurrency``
+    at a time; None without a latency to go on"""
+    if latency is None:
+        return None
+    return math.ceil(calls / max(1, concurrency)) * latency
+
+
+def enforce_budget(estimate: Dict[str, Any], budget: Optional[float]):
+    """Reject a job whose worst-case cost exceeds its budget"""
+    if budget is not None and estimate["max_cost_usd"] > budget:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Estimated cost up to ${estimate['max_cost_usd']:.4f} exceeds "
+                f"the budget of ${budget:.4f}; reduce the samples or max_tokens"
+            ),
+        )
@@ -3,3 +3,39 @@ def test_list_model_comparisons_empty(client):
     assert resp.status_code == 200
     assert isinstance(resp.json(), list)
 
+
+
+def test_create_model_comparison_reports_metrics(client):
+    payload = {
+        "prompt_template": "Translate {text}",
+        "template_variables": ["text"],
+        "model_settings": {"temperature": 0},
+        "models": ["gpt-3.5-turbo"],
+        "regression_set": [{"text": "hi", "expected_output": "TESTING_OPENAI_RESPONSE"}],
+        "evaluation_function": "exact",
+    }
+    resp = client.post("/model-comparisons/", json=payload)
+    assert resp.status_code == 200
+    result = resp.json()["results"][0]
+    assert result["status"] == "completed"
+    assert result["avg_score"] == 1.0
+    assert result["p50_latency_ms"] is not None
+
+
+def test_estimate_model_comparison(client):
+    payload = {
+        "prompt_template": "Translate {text}",
+        "template_variables": ["text"],
+        "model_settings": {"temperature": 0, "max_tokens": 50},
+        "models": ["gpt-3.5-turbo", "llama3"],
+        "regression_set": [{"text": "hi"}, {"text": "bye"}],
+        "cost_budget": 0.0,
+    }
+    resp = client.post("/model-comparisons/estimate/", json=payload)
+    assert resp.status_code == 200
+    estimate = resp.json()
+    assert estimate["calls"] == 4
+    assert estimate["max_completion_tokens"] == 200
+    assert estimate["models"]["llama3"]["max_cost_usd"] == 0.0
+    assert estimate["max_cost_usd"] > 0
+    assert estimate["within_budget"] is False
@@ -16,3 +16,297 @@ def test_create_test_run_404_when_prompt_system_missing(client):
     resp = client.post("/test-runs/", json=payload)
     assert resp.status_code == 404
 
+
+
+def test_create_test_run_keeps_sample_order_when_concurrent(client):
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    regression_set = [
+        {"text": f"sample {i}", "language": "es", "expected_output": "TESTING_OPENAI_RESPONSE"}
+        for i in range(12)
+    ]
+    resp = client.post(
+        "/test-runs/",
+        json={
+            "prompt_system_id": ps["id"],
+            "regression_set": regression_set,
+            "evaluation_function": "exact",
+            "concurrency": 4,
+        },
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["total_samples"] == 12
+    assert [r["sample_id"] for r in body["results"]] == [str(i) for i in range(12)]
+    assert [r["input_variables"]["text"] for r in body["results"]] == [
+        f"sample {i}" for i in range(12)
+    ]
+    assert body["avg_score"] == 1.0
+    assert body["metrics"]["p95_latency_ms"] is not None
+    assert body["results"][0]["retries"] == 0
+
+
+def test_create_test_run_400_on_missing_variable(client):
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    resp = client.post(
+        "/test-runs/",
+        json={
+            "prompt_system_id": ps["id"],
+            "regression_set": [{"text": "hello", "expected_output": "hola"}],
+        },
+    )
+    assert resp.status_code == 400
+
+
+def test_create_test_run_reports_cache_hits(client):
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": "cache me", "language": "fr", "expected_output": "x"}
+        ],
+        "cache_policy": "always",
+    }
+    first = client.post("/test-runs/", json=payload).json()
+    second = client.post("/test-runs/", json=payload).json()
+    assert second["cache"] == {"hits": 1, "misses": 0}
+    assert second["results"][0]["cache_hit"] is True
+    assert first["results"][0]["predicted_output"] == second["results"][0]["predicted_output"]
+
+
+def test_create_test_run_reports_cost_and_enforces_budget(client):
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": "price me", "language": "de", "expected_output": "x"}
+        ],
+        "cache_policy": "off",
+    }
+    body = client.post("/test-runs/", json=payload).json()
+    assert body["results"][0]["cost_usd"] > 0
+    assert body["metrics"]["total_cost_usd"] == body["results"][0]["cost_usd"]
+    assert body["estimate"]["max_cost_usd"] >= body["metrics"]["total_cost_usd"]
+
+    resp = client.post("/test-runs/", json={**payload, "cost_budget": 1e-9})
+    assert resp.status_code == 400
+    assert "exceeds the budget" in resp.json()["detail"]
+
+
+def test_estimate_test_run_uses_recorded_history(client):
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": f"history {i}", "language": "it", "expected_output": "x"}
+            for i in range(3)
+        ],
+        "cache_policy": "off",
+    }
+    assert client.post("/test-runs/", json=payload).status_code == 200
+
+    estimate = client.post(
+        "/test-runs/estimate/", json={**payload, "cost_budget": 100.0}
+    ).json()
+    assert estimate["calls"] == 3
+    assert estimate["history_samples"] >= 3
+    assert estimate["expected_completion_tokens"] <= estimate["max_completion_tokens"]
+    assert estimate["expected_cost_usd"] <= estimate["max_cost_usd"]
+    assert estimate["estimated_duration_s"] is not None
+    assert estimate["within_budget"] is True
+
+
+def test_auto_max_tokens_caps_from_past_outputs_and_flags_capped(client, monkeypatch):
+    from app.services import model_stats
+
+    ps = client.post(
+        "/prompt-systems/",
+        json={**make_prompt_system_payload(), "max_tokens_mode": "auto"},
+    ).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": f"length {i}", "language": "pt", "expected_output": "x"}
+            for i in range(model_stats.AUTO_MAX_TOKENS_MIN_SAMPLES)
+        ],
+        "cache_policy": "off",
+    }
+    # Too few outputs seen yet: the configured max_tokens applies
+    first = client.post("/test-runs/", json=payload).json()
+    assert first["token_cap"]["max_tokens"] == 1000
+    assert first["token_cap"]["capped_samples"] == 0
+
+    second = client.post("/test-runs/", json=payload).json()
+    assert second["token_cap"]["mode"] == "auto"
+    assert second["token_cap"]["max_tokens"] == model_stats.AUTO_MAX_TOKENS_FLOOR
+    cap = second["token_cap"]["max_tokens"]
+    assert all(r["max_tokens"] == cap for r in second["results"])
+    assert not any(r["capped"] for r in second["results"])
+
+    # A cap no higher than the outputs flags every sample instead of hiding it
+    monkeypatch.setattr(model_stats, "AUTO_MAX_TOKENS_FLOOR", 1)
+    monkeypatch.setattr(model_stats, "AUTO_MAX_TOKENS_SAFETY_FACTOR", 0.5)
+    third = client.post("/test-runs/", json=payload).json()
+    assert third["token_cap"]["max_tokens"] < cap
+    assert third["token_cap"]["capped_samples"] == len(payload["regression_set"])
+
+
+def test_unknown_max_tokens_mode_is_rejected(client):
+    resp = client.post(
+        "/prompt-systems/",
+        json={**make_prompt_system_payload(), "max_tokens_mode": "sometimes"},
+    )
+    assert resp.status_code == 400
+
+
+def test_test_run_replays_from_cassette(client, tmp_path, monkeypatch):
+    from app.services import cassette
+
+    monkeypatch.setattr(cassette, "LLM_CASSETTE_DIR", str(tmp_path))
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": f"tape {i}", "language": "nl", "expected_output": "x"}
+            for i in range(3)
+        ],
+        "cache_policy": "off",
+        "cassette": "regression",
+    }
+    recorded = client.post("/test-runs/", json={**payload, "cassette_mode": "record"})
+    assert recorded.status_code == 200
+
+    # Replays cost nothing, so no budget can reject them
+    replayed = client.post(
+        "/test-runs/",
+        json={**payload, "cassette_mode": "replay", "cost_budget": 0.0},
+    ).json()
+    assert [r["predicted_output"] for r in replayed["results"]] == [
+        r["predicted_output"] for r in recorded.json()["results"]
+    ]
+    assert replayed["cache"] == {"hits": 3, "misses": 0}
+    assert replayed["metrics"]["total_cost_usd"] == 0.0
+
+    missing = client.post(
+        "/test-runs/",
+        json={**payload, "cassette": "empty", "cassette_mode": "replay"},
+    )
+    assert missing.status_code == 404
+
+
+def test_cache_hits_are_flagged_capped(client):
+    ps = client.post(
+        "/prompt-systems/",
+        json={**make_prompt_system_payload(), "temperature": 0.0, "max_tokens": 1},
+    ).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": f"cap {i}", "language": "fr", "expected_output": "x"}
+            for i in range(3)
+        ],
+        "cache_policy": "auto",
+    }
+    first = client.post("/test-runs/", json=payload).json()
+    assert first["token_cap"]["capped_samples"] == 3
+
+    # Served from the cache, without usage from the provider
+    second = client.post("/test-runs/", json=payload).json()
+    assert second["cache"]["hits"] == 3
+    assert second["token_cap"]["capped_samples"] == 3
+
+
+def test_auto_max_tokens_run_replays_with_the_recorded_cap(
+    client, tmp_path, monkeypatch
+):
+    from app.services import cassette, model_stats
+
+    monkeypatch.setattr(cassette, "LLM_CASSETTE_DIR", str(tmp_path))
+    ps = client.post(
+        "/prompt-systems/",
+        json={**make_prompt_system_payload(), "max_tokens_mode": "auto"},
+    ).json()
+    payload = {
+        "prompt_system_id": ps["id"],
+        "regression_set": [
+            {"text": f"auto {i}", "language": "nl", "expected_output": "x"}
+            for i in range(model_stats.AUTO_MAX_TOKENS_MIN_SAMPLES)
+        ],
+        "cache_policy": "off",
+        "cassette": "auto",
+    }
+    recorded = client.post("/test-runs/", json={**payload, "cassette_mode": "record"})
+    assert recorded.status_code == 200
+    assert recorded.json()["token_cap"]["max_tokens"] == 1000
+
+    # The recording's own output lengths have moved the auto cap since
+    replayed = client.post("/test-runs/", json={**payload, "cassette_mode": "replay"})
+    assert replayed.status_code == 200
+    replayed = replayed.json()
+    assert replayed["token_cap"]["max_tokens"] == 1000
+    assert [r["predicted_output"] for r in replayed["results"]] == [
+        r["predicted_output"] for r in recorded.json()["results"]
+    ]
+
+
+def test_run_is_kept_when_embedding_scoring_fails(client, tmp_path, monkeypatch):
+    from fastapi import HTTPException
+
+    from app.services import embeddings
+
+    monkeypatch.setattr(embeddings, "EMBEDDING_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(embeddings, "_stores", {})
+
+    async def unreachable(texts, model):
+        raise HTTPException(status_code=502, detail="Embedding request failed")
+
+    monkeypatch.setattr(embeddings, "embed", unreachable)
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    resp = client.post(
+        "/test-runs/",
+        json={
+            "prompt_system_id": ps["id"],
+            "regression_set": [
+                {"text": f"embed {i}", "language": "de", "expected_output": "x"}
+                for i in range(2)
+            ],
+            "evaluation_function": "embedding",
+            "cache_policy": "off",
+        },
+    )
+    assert resp.status_code == 200
+    run = resp.json()
+    assert [r["score"] for r in run["results"]] == [0.0, 0.0]
+    assert all("Embedding request failed" in r["score_error"] for r in run["results"])
+    stored = client.get(f"/test-runs/{run['test_run_id']}").json()
+    assert len(stored["results"]) == 2
+
+
+def test_evaluate_rescores_stored_outputs(client):
+    ps = client.post("/prompt-systems/", json=make_prompt_system_payload()).json()
+    run = client.post(
+        "/test-runs/",
+        json={
+            "prompt_system_id": ps["id"],
+            "regression_set": [
+                {"text": "a", "language": "en", "expected_output": "testing_openai"},
+                {"text": "b", "language": "en", "expected_output": "other"},
+            ],
+            "evaluation_function": "exact",
+        },
+    ).json()
+    assert run["avg_score"] == 0.0
+
+    resp = client.post(
+        f"/test-runs/{run['test_run_id']}/evaluate/",
+        json={"evaluation_function": "contains"},
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["avg_score"] == 0.5
+    assert sorted(s["score"] for s in body["scores"]) == [0.0, 1.0]
+
+    bad = client.post(
+        f"/test-runs/{run['test_run_id']}/evaluate/",
+        json={"evaluation_function": "bleu"},
+    )
+    assert bad.status_code == 400
@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import httpx
+
+from app import fake_llm_server
+from app.services import resilience
+from app.services.batch import OpenAIBatchRunner, parse_batch_output
+from app.services.cache import cache_key, response_cache
+from app.services.llm import LLMResponse
+
+
+def _runner(client: httpx.AsyncClient) -> OpenAIBatchRunner:
+    return OpenAIBatchRunner(client, poll_seconds=0.01, timeout=5)
+
+
+def _fake_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=fake_llm_server.app),
+        base_url="http://fake/v1",
+    )
+
+
+def test_batch_results_map_back_by_custom_id(monkeypatch):
+    monkeypatch.setattr(fake_llm_server.config, "batch_delay", 0.02)
+    requests = {str(i): f"Question {i}" for i in range(5)}
+
+    async def scenario():
+        async with _fake_client() as client:
+            return await _runner(client).run(
+                requests, "fake-small", 0.7, 16, 1.0, cache_policy="off"
+            )
+
+    results = asyncio.run(scenario())
+    assert sorted(results) == sorted(requests)
+    for response in results.values():
+        assert isinstance(response, LLMResponse)
+        assert response.text
+        assert response.completion_tokens <= 16
+        assert response.latency_ms > 0
+    # Outputs are deterministic per prompt, so they line up with their ids
+    assert results["0"].text != results["1"].text
+
+
+def test_failed_requests_come_back_as_errors(monkeypatch):
+    monkeypatch.setattr(fake_llm_server.config, "batch_delay", 0.0)
+    monkeypatch.setattr(fake_llm_server.config, "error_rate", 1.0)
+
+    async def scenario():
+        async with _fake_client() as client:
+            return await _runner(client).run(
+                {"a": "hello"}, "fake-small", 0.7, 16, 1.0, cache_policy="off"
+            )
+
+    results = asyncio.run(scenario())
+    assert isinstance(results["a"], str)
+    assert "Server error" in results["a"]
+
+
+class _FlakyPolls(httpx.AsyncBaseTransport):
+    """Drops the first ``failures`` batch status polls"""
+
+    def __init__(self, failures: int):
+        self.inner = httpx.ASGITransport(app=fake_llm_server.app)
+        self.failures = failures
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET" and "/batches/" in request.url.path:
+            if self.failures:
+                self.failures -= 1
+                if self.failures % 2:
+                    raise httpx.ConnectError("connection reset", request=request)
+                return httpx.Response(503, text="overloaded", request=request)
+        return await self.inner.handle_async_request(request)
+
+
+def test_transient_poll_errors_do_not_end_the_wait(monkeypatch):
+    monkeypatch.setattr(fake_llm_server.config, "batch_delay", 0.02)
+    monkeypatch.setattr(resilience, "LLM_RETRY_BASE_DELAY", 0.001)
+    # More failures in a row than one poll retries
+    transport = _FlakyPolls(resilience.LLM_MAX_ATTEMPTS + 2)
+
+    async def scenario():
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://fake/v1"
+        ) as client:
+            return await _runner(client).run(
+                {"a": "hello"}, "fake-small", 0.7, 16, 1.0, cache_policy="off"
+            )
+
+    results = asyncio.run(scenario())
+    assert transport.failures == 0
+    assert isinstance(results["a"], LLMResponse)
+
+
+def test_batch_responses_warm_the_realtime_cache_key(monkeypatch):
+    monkeypatch.setattr(fake_llm_server.config, "batch_delay", 0.0)
+    response_cache.local.clear()
+
+    async def scenario():
+        async with _fake_client() as client:
+            return await _runner(client).run(
+                {"a": "warm me"}, "fake-small", 0.0, 16, 1.0, 40, cache_policy="auto"
+            )
+
+    results = asyncio.run(scenario())
+    key = cache_key("openai", "fake-small", "warm me", 0.0, 16, 1.0, 40)
+    assert asyncio.run(response_cache.get(key)) == results["a"].text
+
+
+def test_parse_batch_output():
+    lines = [
+        {
+            "custom_id": "ok",
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "choices": [{"message": {"content": " yes "}}],
+                    "usage": {"prompt_tokens": 3, "completion_tokens": 1},
+                },
+            },
+            "error": None,
+        },
+        {"custom_id": "bad", "response": None, "error": {"message": "expired"}},
+    ]
+    results = parse_batch_output("\n".join(json.dumps(line) for line in lines))
+    assert results["ok"].text == "yes"
+    assert results["ok"].prompt_tokens == 3
+    assert results["bad"] == "OpenAI batch request failed: expired"
@@ -0,0 +1,46 @@
+import asyncio
+
+from app.services.cache import LRUCache, ResponseCache, cache_key
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(max_entries=2)
+    lru.set("a", "1")
+    lru.set("b", "2")
+    assert lru.get("a") == "1"
+    lru.set("c", "3")
+    assert lru.get("b") is None
+    assert lru.get("a") == "1"
+    assert len(lru) == 2
+
+
+def test_cache_key_covers_sampling_params():
+    base = cache_key("openai", "gpt-4", "hi", 0.0, 100, 1.0)
+    assert base == cache_key("openai", "gpt-4", "hi", 0.0, 100, 1.0)
+    assert base != cache_key("openai", "gpt-4", "hi", 0.0, 200, 1.0)
+    assert base != cache_key("openai", "gpt-4", "hi", 0.0, 100, 1.0, seed=7)
+    assert base != cache_key("ollama", "gpt-4", "hi", 0.0, 100, 1.0)
+
+
+def test_auto_policy_only_caches_deterministic_requests():
+    cache = ResponseCache(enabled=True)
+    assert cache.should_use("auto", 0.0, None)
+    assert cache.should_use("auto", 0.7, 42)
+    assert not cache.should_use("auto", 0.7, None)
+    assert cache.should_use("always", 0.7, None)
+    assert not cache.should_use("off", 0.0, None)
+
+
+def test_local_tier_serves_hits_without_redis():
+    cache = ResponseCache(enabled=True)
+    # Pretend Redis is down so only the in-process tier is exercised
+    cache._redis_retry_at = float("inf")
+
+    async def scenario():
+        assert await cache.get("k") is None
+        await cache.set("k", "value")
+        assert await cache.get("k") == "value"
+
+    asyncio.run(scenario())
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
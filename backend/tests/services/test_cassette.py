@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import cassette as cassette_module
+from app.services import llm
+from app.services.cassette import Cassette, get_cassette
+
+
+def test_cassette_appends_and_supersedes_entries(tmp_path):
+    path = str(tmp_path / "tape.jsonl")
+    tape = Cassette(path)
+    tape.record("a", {"text": "first"})
+    tape.record("b", {"text": "other"})
+    tape.record("a", {"text": "second"})
+    tape.close()
+
+    with open(path) as f:
+        assert len(f.readlines()) == 3
+    reloaded = Cassette(path)
+    assert reloaded.get("a")["text"] == "second"
+    assert len(reloaded) == 2
+
+
+def test_cassette_ignores_torn_line_and_sees_other_writers(tmp_path):
+    path = str(tmp_path / "tape.jsonl")
+    reader = Cassette(path)
+    assert reader.get("a") is None
+
+    writer = Cassette(path)
+    writer.record("a", {"text": "hello"})
+    with open(path, "a") as f:
+        f.write('{"key": "b", "te')
+    assert reader.get("a")["text"] == "hello"
+    assert reader.get("b") is None
+
+
+def test_generate_replays_recorded_responses_without_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(cassette_module, "LLM_CASSETTE_DIR", str(tmp_path))
+    monkeypatch.setenv("FAKE_LLM_LATENCY", "fixed:0")
+
+    def run(prompt, mode):
+        return asyncio.run(
+            llm.generate(
+                prompt,
+                "fake",
+                "fake-small",
+                0.7,
+                64,
+                1.0,
+                cache_policy="off",
+                cassette="suite",
+                cassette_mode=mode,
+            )
+        )
+
+    recorded = run("What is 2+2?", "record")
+    assert len(get_cassette("suite")) == 1
+
+    async def no_calls(*args, **kwargs):
+        raise AssertionError("replay must not call the model")
+
+    monkeypatch.setattr(llm, "call_fake", no_calls)
+    replayed = run("What is 2+2?", "replay")
+    assert replayed.text == recorded.text
+    assert replayed.completion_tokens == recorded.completion_tokens
+    assert replayed.replayed and replayed.cache_hit
+    assert replayed.cost_usd == 0.0
+
+    with pytest.raises(HTTPException) as error:
+        run("What is 3+3?", "replay")
+    assert error.value.status_code == 404
+
+
+def test_cassette_names_are_plain_file_names():
+    with pytest.raises(HTTPException) as error:
+        get_cassette("../outside")
+    assert error.value.status_code == 400
@@ -0,0 +1,90 @@
+import asyncio
+
+from app.services import concurrency, llm
+from app.services.concurrency import AdaptiveLimiter
+from app.services.dispatch import dispatch_queue
+
+
+def test_limit_grows_additively_and_halves_on_overload():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=16, initial_limit=4)
+        for _ in range(8):
+            started = await limiter.acquire()
+            await limiter.release(started, latency=0.1)
+        assert 5.5 < limiter.limit < 6.5
+
+        # Failures from calls started before the cut only count once
+        first = await limiter.acquire()
+        second = await limiter.acquire()
+        await limiter.release(first, overloaded=True)
+        await limiter.release(second, overloaded=True)
+        assert limiter.decreases == 1
+        return limiter.limit
+
+    assert 2.5 < asyncio.run(scenario()) < 3.5
+
+
+def test_latency_spike_cuts_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(max_limit=16, initial_limit=8)
+        for _ in range(5):
+            await limiter.release(await limiter.acquire(), latency=1.0, tokens=100)
+        before = limiter.limit
+        await limiter.release(await limiter.acquire(), latency=5.0, tokens=100)
+        return before, limiter.limit
+
+    before, after = asyncio.run(scenario())
+    assert after == before / 2
+
+
+def test_in_flight_never_exceeds_limit():
+    limiter = AdaptiveLimiter(max_limit=2, initial_limit=2, adaptive=False)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        started = await limiter.acquire()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        await limiter.release(started, latency=0.01)
+
+    async def scenario():
+        await asyncio.gather(*[call() for _ in range(10)])
+
+    asyncio.run(scenario())
+    assert peak == 2
+    assert limiter.limit == 2
+
+
+def test_latency_excludes_the_wait_for_the_provider_ceiling(monkeypatch):
+    monkeypatch.setenv("FAKE_LLM_LATENCY", "fixed:0.05")
+    # The limiter lets four calls through; the provider-wide ceiling one
+    monkeypatch.setitem(llm.PROVIDER_CONCURRENCY, "fake", 1)
+    monkeypatch.setitem(
+        concurrency._limiters, "fake:ceiling", AdaptiveLimiter(4, initial_limit=4)
+    )
+    monkeypatch.setattr(llm, "LLM_HEDGING", False)
+    latencies = []
+    release = dispatch_queue.release
+
+    async def spy(ticket, overloaded=False, latency=None, tokens=None):
+        if latency is not None:
+            latencies.append(latency)
+        await release(ticket, overloaded, latency, tokens)
+
+    monkeypatch.setattr(dispatch_queue, "release", spy)
+
+    async def scenario():
+        await asyncio.gather(
+            *(
+                llm.generate(
+                    f"q{i}", "fake", "ceiling", 0.7, 8, 1.0, cache_policy="off"
+                )
+                for i in range(4)
+            )
+        )
+
+    asyncio.run(scenario())
+    # The calls ran one at a time, but each took one call's latency
+    assert len(latencies) == 4
+    assert max(latencies) < 0.1
@@ -0,0 +1,123 @@
+import asyncio
+
+from app.services.concurrency import AdaptiveLimiter
+from app.services.dispatch import DispatchQueue
+
+
+def _limiter(limit: int) -> AdaptiveLimiter:
+    return AdaptiveLimiter(max_limit=limit, initial_limit=limit, adaptive=False)
+
+
+async def _call(
+    queue, limiter, priority, job_id, order, key="fake:model", weight=1.0
+):
+    ticket = await queue.acquire(key, limiter, priority, job_id, weight)
+    order.append((priority, job_id))
+    await asyncio.sleep(0.01)
+    await queue.release(ticket, latency=0.01)
+
+
+def test_higher_priority_class_is_served_first():
+    async def scenario():
+        queue = DispatchQueue(caps={})
+        limiter = _limiter(1)
+        order = []
+        calls = [_call(queue, limiter, "optimizer", "o", order) for _ in range(3)]
+        calls += [_call(queue, limiter, "scheduled", "s", order) for _ in range(3)]
+        calls += [_call(queue, limiter, "interactive", "i", order) for _ in range(3)]
+        await asyncio.gather(*calls)
+        return order, queue.stats()
+
+    order, stats = asyncio.run(scenario())
+    # The first optimizer call got the free slot; everything queued behind it
+    # then runs strictly by class
+    assert [priority for priority, _ in order] == (
+        ["optimizer"] + ["interactive"] * 3 + ["scheduled"] * 3 + ["optimizer"] * 2
+    )
+    assert stats["classes"]["interactive"]["granted"] == 3
+    assert stats["classes"]["optimizer"]["max_wait_ms"] > 0
+
+
+def test_jobs_in_a_class_share_fairly():
+    async def scenario():
+        queue = DispatchQueue(caps={})
+        limiter = _limiter(2)
+        order = []
+        calls = [_call(queue, limiter, "scheduled", "big", order) for _ in range(20)]
+        calls += [_call(queue, limiter, "scheduled", "small", order) for _ in range(4)]
+        await asyncio.gather(*calls)
+        return order
+
+    order = asyncio.run(scenario())
+    # The small job finishes within the first dozen grants instead of last
+    assert max(i for i, (_, job) in enumerate(order) if job == "small") < 12
+
+
+def test_jobs_share_a_class_in_proportion_to_their_weights():
+    async def scenario():
+        queue = DispatchQueue(caps={})
+        limiter = _limiter(4)
+        order = []
+        calls = [
+            _call(queue, limiter, "scheduled", "heavy", order, weight=3.0)
+            for _ in range(30)
+        ]
+        calls += [
+            _call(queue, limiter, "scheduled", "light", order, weight=1.0)
+            for _ in range(30)
+        ]
+        await asyncio.gather(*calls)
+        return order
+
+    order = asyncio.run(scenario())
+    # While both have calls waiting the heavy job holds three of the four
+    # slots, so it is granted three calls for each of the light job's
+    first = [job for _, job in order[:40]]
+    assert first.count("heavy") == 30
+    assert first.count("light") == 10
+
+
+def test_class_cap_leaves_room_for_lower_classes():
+    async def scenario():
+        queue = DispatchQueue(caps={"scheduled": 1})
+        limiter = _limiter(2)
+        peak = {"scheduled": 0}
+        order = []
+
+        async def call(priority):
+            ticket = await queue.acquire("fake:model", limiter, priority, None)
+            peak["scheduled"] = max(peak["scheduled"], queue.in_flight["scheduled"])
+            order.append(priority)
+            await asyncio.sleep(0.01)
+            await queue.release(ticket)
+
+        await asyncio.gather(
+            *[call("scheduled") for _ in range(4)], call("comparison")
+        )
+        return peak, order
+
+    peak, order = asyncio.run(scenario())
+    assert peak["scheduled"] == 1
+    # The comparison call ran alongside the first scheduled one
+    assert order.index("comparison") == 1
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        queue = DispatchQueue(caps={})
+        limiter = _limiter(1)
+        ticket = await queue.acquire("fake:model", limiter, "interactive", "a")
+        waiting = asyncio.ensure_future(
+            queue.acquire("fake:model", limiter, "interactive", "b")
+        )
+        await asyncio.sleep(0)
+        assert queue.stats()["classes"]["interactive"]["queued"] == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        await queue.release(ticket)
+        return queue.stats()["classes"]["interactive"], limiter.in_flight
+
+    stats, in_flight = asyncio.run(scenario())
+    assert stats["queued"] == 0
+    assert stats["in_flight"] == 0
+    assert in_flight == 0
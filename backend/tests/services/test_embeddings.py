@@ -0,0 +1,68 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services import embeddings
+from app.services.embeddings import VectorStore, content_key, embedding_similarity
+from app.services.scoring_pool import ScoringPool
+
+
+@pytest.fixture
+def fake_embeddings(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBEDDING_PROVIDER", "fake")
+    monkeypatch.setattr(embeddings, "EMBEDDING_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(embeddings, "_stores", {})
+    embedded = []
+    embed_batch = embeddings._embed_batch
+
+    async def counting_embed_batch(texts, model):
+        embedded.extend(texts)
+        return await embed_batch(texts, model)
+
+    monkeypatch.setattr(embeddings, "_embed_batch", counting_embed_batch)
+    return embedded
+
+
+def test_store_appends_reloads_and_drops_torn_rows(tmp_path):
+    store = VectorStore(str(tmp_path))
+    vectors = np.arange(6, dtype=np.float32).reshape(3, 2)
+    store.append(["a", "b", "a"], vectors)
+    assert len(store) == 2
+    # A crash after writing a row's vector but before its key
+    with open(store.vectors_path, "ab") as f:
+        f.write(np.ones(2, np.float32).tobytes())
+    with open(store.keys_path, "ab") as f:
+        f.write(b"c")
+
+    other = VectorStore(str(tmp_path))
+    assert other.lookup(["a", "b", "c"]) == [0, 1, None]
+    other.append(["c"], np.full((1, 2), 7, np.float32))
+    assert store.lookup(["c"]) == [2]
+    assert store.vectors(np.array([2, 0])).tolist() == [[7, 7], [0, 1]]
+
+
+def test_repeat_runs_only_embed_new_outputs(fake_embeddings):
+    expected = ["the capital of france is paris"] * 3
+    predicted = ["Paris is the capital of France", "i like turtles", ""]
+    scores = asyncio.run(embedding_similarity(predicted, expected))
+    assert scores[0] > 0.7
+    assert scores[1] < 0.3
+    assert scores[2] == 0.0
+    assert len(fake_embeddings) == 3
+
+    again = asyncio.run(
+        embedding_similarity(predicted[:2] + ["the capital is paris"], expected)
+    )
+    assert again[:2] == scores[:2]
+    assert fake_embeddings[3:] == ["the capital is paris"]
+    assert asyncio.run(embedding_similarity(["", "x"], ["", "x"])) == [1.0, 1.0]
+
+
+def test_scoring_pool_scores_embeddings(fake_embeddings):
+    pool = ScoringPool(workers=0)
+    scores = asyncio.run(pool.evaluate(["Hello World"], ["hello world"], "embedding"))
+    assert scores == [1.0]
+    assert embeddings.get_store(embeddings.EMBEDDING_MODEL).lookup(
+        [content_key("hello world")]
+    ) == [0]
@@ -0,0 +1,44 @@
+import difflib
+
+import pytest
+
+from app.services.evaluation import evaluate_batch, evaluate_output
+
+
+PREDICTED = ["Hola Mundo ", "the cat sat", "", "Paris is the capital", "abc"]
+EXPECTED = ["hola mundo", "the dog sat down", "", "paris", "xyz"]
+
+
+def test_exact_and_contains_ignore_case_and_whitespace():
+    assert evaluate_batch(PREDICTED, EXPECTED, "exact") == [1.0, 0.0, 1.0, 0.0, 0.0]
+    assert evaluate_batch(PREDICTED, EXPECTED, "contains") == [
+        1.0,
+        0.0,
+        1.0,
+        1.0,
+        0.0,
+    ]
+
+
+def test_jaccard_is_word_set_overlap():
+    scores = evaluate_batch(PREDICTED, EXPECTED, "jaccard")
+    assert scores[0] == 1.0
+    assert scores[1] == pytest.approx(2 / 5)
+    assert scores[2] == 1.0
+    assert scores[3] == pytest.approx(1 / 4)
+    assert evaluate_output("something", "", "jaccard") == 0.0
+
+
+def test_fuzzy_matches_sequence_matcher_with_repeated_expected():
+    predicted = PREDICTED + ["hola mundo!", "HOLA"]
+    expected = EXPECTED + ["hola mundo", "hola mundo"]
+    assert evaluate_batch(predicted, expected, "fuzzy") == [
+        difflib.SequenceMatcher(None, p.lower().strip(), e.lower().strip()).ratio()
+        for p, e in zip(predicted, expected)
+    ]
+
+
+def test_unknown_method_and_mismatched_columns():
+    assert evaluate_batch(PREDICTED, EXPECTED, "bleu") == [0.0] * len(PREDICTED)
+    with pytest.raises(ValueError):
+        evaluate_batch(PREDICTED, EXPECTED[:2], "exact")
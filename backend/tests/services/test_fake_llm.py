@@ -0,0 +1,41 @@
+import asyncio
+import random
+
+import pytest
+
+from app.services.fake_llm import FakeLLMConfig, fake_tokens, sample_latency
+from app.services.llm import call_fake, provider_for_model
+from app.services.resilience import ProviderError
+
+
+def test_outputs_are_deterministic_per_prompt():
+    config = FakeLLMConfig(min_tokens=4, max_tokens=12)
+    first = fake_tokens("What is 2+2?", "fake-small", 100, config)
+    assert first == fake_tokens("What is 2+2?", "fake-small", 100, config)
+    assert first != fake_tokens("What is 3+3?", "fake-small", 100, config)
+    assert 4 <= len(first) <= 12
+    assert len(fake_tokens("What is 2+2?", "fake-small", 3, config)) == 3
+
+
+def test_latency_specs():
+    rng = random.Random(0)
+    assert sample_latency("fixed:0.2", rng) == 0.2
+    assert 1 <= sample_latency("uniform:1,2", rng) <= 2
+    assert sample_latency("normal:-5,0.1", rng) == 0.0
+    with pytest.raises(ValueError):
+        sample_latency("pareto:1", rng)
+
+
+def test_call_fake_reports_usage_and_rate_limits(monkeypatch):
+    monkeypatch.setenv("FAKE_LLM_LATENCY", "fixed:0")
+    response = asyncio.run(call_fake("hello world", "fake-small", 0, 16, 1))
+    assert response.text
+    assert response.prompt_tokens == 2
+    assert response.completion_tokens == len(response.text.split())
+    assert provider_for_model("fake-small") == "fake"
+
+    monkeypatch.setenv("FAKE_LLM_RATE_LIMIT_RATE", "1")
+    with pytest.raises(ProviderError) as error:
+        asyncio.run(call_fake("hello world", "fake-small", 0, 16, 1))
+    assert error.value.status_code == 429
+    assert error.value.retryable
@@ -0,0 +1,84 @@
+import asyncio
+
+from app.services.hedging import Hedger
+
+
+def _primed(hedger: Hedger, key: str, latency: float, count: int = 20):
+    for _ in range(count):
+        hedger.tracker(key).record(latency)
+
+
+def test_slow_call_is_hedged_and_loser_cancelled():
+    hedger = Hedger(percentile=95, min_samples=20, budget=1.0)
+    _primed(hedger, "m", 0.01)
+    delays = [1.0, 0.0]
+    cancelled = []
+
+    async def call(sent):
+        sent.mark()
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    async def scenario():
+        result = await hedger.run("m", call, enabled=True)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario()) == (0.0, True)
+    assert cancelled == [1.0]
+    assert hedger.hedges == 1 and hedger.hedge_wins == 1
+
+
+def test_budget_caps_hedges():
+    hedger = Hedger(percentile=50, min_samples=20, budget=0.5)
+    _primed(hedger, "m", 0.001)
+    calls = []
+
+    async def slow(sent):
+        sent.mark()
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def scenario():
+        for _ in range(4):
+            await hedger.run("m", slow, enabled=True)
+
+    asyncio.run(scenario())
+    # 4 calls x 0.5 credits = 2 hedges at most
+    assert hedger.hedges == 2
+    assert len(calls) == 6
+    assert hedger.hedges_skipped == 2
+
+
+def test_no_hedge_without_free_capacity():
+    hedger = Hedger(percentile=50, min_samples=20, budget=1.0)
+    _primed(hedger, "m", 0.001)
+
+    async def slow(sent):
+        sent.mark()
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    result = asyncio.run(
+        hedger.run("m", slow, enabled=True, has_capacity=lambda: False)
+    )
+    assert result == ("ok", False)
+    assert hedger.hedges == 0 and hedger.hedges_skipped == 1
+
+
+def test_disabled_hedging_only_tracks_latency():
+    hedger = Hedger(min_samples=1)
+
+    async def fast(sent):
+        sent.mark()
+        return "ok"
+
+    assert asyncio.run(hedger.run("m", fast, enabled=False)) == ("ok", False)
+    assert len(hedger.tracker("m")) == 1
+    assert hedger.hedges == 0
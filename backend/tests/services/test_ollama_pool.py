@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.ollama_pool import OllamaPool, normalize_host
+
+
+def test_normalize_host():
+    assert normalize_host("gpu1") == "http://gpu1:11434"
+    assert normalize_host("gpu1:8080") == "http://gpu1:8080"
+    assert normalize_host("https://gpu1:443/") == "https://gpu1:443"
+
+
+def test_prefers_loaded_model_then_fewest_outstanding():
+    pool = OllamaPool(hosts=["http://a:1", "http://b:1", "http://c:1"])
+    a, b, c = pool.endpoints
+    a.available = b.available = c.available = {"llama3"}
+    b.loaded = {"llama3"}
+    b.outstanding = 5
+    assert pool.choose("llama3") is b
+    assert pool.choose("mistral").outstanding == 0
+
+    b.loaded = set()
+    a.outstanding = 2
+    assert pool.choose("llama3") is c
+
+
+def test_failing_node_is_ejected_and_readmitted():
+    pool = OllamaPool(
+        hosts=["http://a:1", "http://b:1"], eject_after=2, eject_seconds=60
+    )
+    a, b = pool.endpoints
+    pool.refreshed_at = float("inf")  # skip probing
+    a.loaded = b.loaded = {"llama3"}
+
+    client = httpx.AsyncClient()
+
+    async def failing_request():
+        async with pool.route("llama3", client) as url:
+            if url == a.url:
+                raise httpx.ConnectError("refused")
+
+    async def scenario():
+        # Ties are broken at random, so a is picked often enough to fail twice
+        for _ in range(50):
+            try:
+                await failing_request()
+            except httpx.ConnectError:
+                pass
+
+    asyncio.run(scenario())
+    assert not a.healthy
+    assert all(pool.choose("llama3") is b for _ in range(10))
+
+    a.ejected_until = 0.0  # ejection elapsed: a trial request may go through
+    assert a.healthy
+    a.record_success()
+    assert a.failures == 0 and a.ejected_until is None
+
+
+def test_circuit_breakers_are_per_node():
+    pool = OllamaPool(hosts=["http://a:1", "http://b:1"], eject_after=100)
+    a, b = pool.endpoints
+    pool.refreshed_at = float("inf")
+    a.breaker.failure_threshold = 2
+    b.outstanding = 1  # a has fewer requests in flight, so it is picked
+    client = httpx.AsyncClient()
+
+    async def request():
+        async with pool.route("llama3", client) as url:
+            if url == a.url:
+                raise httpx.ConnectError("refused")
+            return url
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await request()
+        return await request()
+
+    # a's open circuit sends traffic to b, whose circuit is unaffected
+    assert asyncio.run(scenario()) == b.url
+    assert a.breaker.state == "open"
+    assert b.breaker.state == "closed"
+    assert pool.status()[0]["circuit"] == "open"
@@ -0,0 +1,25 @@
+from app.services.rate_limiter import RateLimiter, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rpm=2, tpm=0)
+    assert bucket.try_acquire(0) == 0.0
+    assert bucket.try_acquire(0) == 0.0
+    wait = bucket.try_acquire(0)
+    assert 0 < wait <= 30
+
+
+def test_token_bucket_limits_tokens_per_minute():
+    bucket = TokenBucket(rpm=0, tpm=600)
+    assert bucket.try_acquire(500) == 0.0
+    # 100 tokens left, 300 more needed at 10 tokens/s
+    assert 29 < bucket.try_acquire(400) <= 30
+
+
+def test_limits_fall_back_to_provider_wildcard():
+    limiter = RateLimiter(
+        limits={"openai:*": {"rpm": 10}, "openai:gpt-4": {"rpm": 5, "tpm": 100}}
+    )
+    assert limiter.limits_for("openai", "gpt-4") == (5, 100)
+    assert limiter.limits_for("openai", "gpt-3.5-turbo") == (10, 0)
+    assert limiter.limits_for("ollama", "llama3") == (0, 0)
@@ -0,0 +1,56 @@
+import asyncio
+
+import httpx
+
+from app.services import residency
+from app.services.ollama_pool import OllamaPool, ollama_pool
+from app.services.residency import ModelResidency
+
+
+def test_order_models_runs_resident_and_remote_models_first(monkeypatch):
+    endpoint = ollama_pool.endpoints[0]
+    monkeypatch.setattr(endpoint, "loaded", {"mistral"})
+    order = ModelResidency().order_models(["llama3", "mistral", "gpt-4", "phi3"])
+    assert order == ["gpt-4", "mistral", "llama3", "phi3"]
+
+
+def _nodes(monkeypatch, handler, hosts=("http://a:1", "http://b:1", "http://c:1")):
+    pool = OllamaPool(hosts=list(hosts))
+    pool.refreshed_at = float("inf")  # skip probing
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(residency, "ollama_pool", pool)
+    monkeypatch.setattr(residency, "get_ollama_client", lambda: client)
+    return pool
+
+
+def test_release_unloads_every_node_holding_the_model(monkeypatch):
+    unloaded = []
+
+    def handler(request):
+        unloaded.append(request.url.host)
+        # Node b cannot be reached for the unload
+        return httpx.Response(500 if request.url.host == "b" else 200, json={})
+
+    pool = _nodes(monkeypatch, handler)
+    a, b, c = pool.endpoints
+    a.loaded = {"llama3", "phi3"}
+    b.loaded = {"llama3"}
+
+    released = asyncio.run(ModelResidency().release("llama3"))
+    assert not released
+    assert sorted(unloaded) == ["a", "b"]
+    assert a.loaded == {"phi3"}
+    # b still holds the model, so the report keeps it there
+    assert b.loaded == {"llama3"}
+    assert c.loaded == set()
+
+
+def test_failed_warm_up_marks_no_node_loaded(monkeypatch):
+    pool = _nodes(
+        monkeypatch,
+        lambda request: httpx.Response(500, json={"error": "out of memory"}),
+        hosts=("http://a:1", "http://b:1"),
+    )
+
+    assert not asyncio.run(ModelResidency().warm_up("llama3"))
+    assert all(not endpoint.loaded for endpoint in pool.endpoints)
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from app.services import resilience
+from app.services.resilience import (
+    CircuitBreaker,
+    ProviderError,
+    call_with_retries,
+    parse_retry_after,
+)
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_RETRY_BASE_DELAY", 0.001)
+    resilience._breakers.clear()
+
+
+def test_retries_retryable_errors_until_success():
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise ProviderError(503, "unavailable", retryable=True)
+        return "ok"
+
+    result, retries = asyncio.run(call_with_retries("test", attempt))
+    assert result == "ok"
+    assert retries == 2
+
+
+def test_non_retryable_error_is_raised_immediately():
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        raise ProviderError(401, "bad key")
+
+    with pytest.raises(ProviderError) as exc:
+        asyncio.run(call_with_retries("test", attempt))
+    assert exc.value.status_code == 401
+    assert len(calls) == 1
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_circuit_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_cancelled_half_open_trial_frees_the_circuit():
+    breaker = resilience.get_breaker("test")
+    breaker.failure_threshold = 1
+    breaker.reset_seconds = 0
+    breaker.record_failure()
+
+    async def hangs(timeout):
+        await asyncio.sleep(60)
+
+    async def ok(timeout):
+        return "ok"
+
+    async def scenario():
+        trial = asyncio.create_task(call_with_retries("test", hangs))
+        await asyncio.sleep(0.01)
+        assert breaker.trial_in_flight
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return await call_with_retries("test", ok)
+
+    assert asyncio.run(scenario()) == ("ok", 0)
+    assert breaker.state == "closed"
+
+
+def test_rate_limits_do_not_open_the_circuit():
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) < 4:
+            raise ProviderError(429, "slow down", retryable=True)
+        return "ok"
+
+    breaker = resilience.get_breaker("test")
+    breaker.failure_threshold = 2
+    result, retries = asyncio.run(call_with_retries("test", attempt, max_attempts=5))
+    assert result == "ok" and retries == 3
+    assert breaker.failures == 0
+
+    async def server_error(timeout):
+        raise ProviderError(503, "unavailable", retryable=True)
+
+    with pytest.raises(ProviderError):
+        asyncio.run(call_with_retries("test", server_error, max_attempts=2))
+    assert breaker.state == "open"
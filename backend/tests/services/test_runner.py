@@ -0,0 +1,20 @@
+from app.services.runner import metrics_summary, percentile
+
+
+def test_percentile_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile([], 50) is None
+
+
+def test_metrics_summary_rolls_up_latency_and_tokens():
+    results = [
+        {"latency_ms": 10.0, "prompt_tokens": 5, "completion_tokens": 7},
+        {"latency_ms": 30.0, "prompt_tokens": None, "completion_tokens": None},
+        {"error": "LLM call failed"},
+    ]
+    summary = metrics_summary(results)
+    assert summary["p50_latency_ms"] == 10.0
+    assert summary["p95_latency_ms"] == 30.0
+    assert summary["total_tokens"] == 12
@@ -0,0 +1,46 @@
+import asyncio
+import random
+
+from app.services.evaluation import evaluate_batch
+from app.services.scoring_pool import ScoringPool, split_chunks
+
+WORDS = "the capital of france is paris and the answer is four".split()
+
+
+def _texts(rng, count, words=40):
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+
+def test_split_chunks_covers_every_row_once():
+    predicted = ["a" * 10, "b" * 30, "c" * 10, "d" * 10, "e"]
+    chunks = split_chunks(predicted, predicted, 250)
+    assert chunks == [(0, 2), (2, 5)]
+
+
+def test_small_and_linear_batches_stay_inline():
+    pool = ScoringPool(workers=2, min_work=10**9)
+    scores = asyncio.run(pool.evaluate(["Paris"], ["paris"], "fuzzy"))
+    assert scores == [1.0]
+    asyncio.run(pool.evaluate(["a" * 1000], ["a" * 1000], "exact"))
+    stats = pool.stats()
+    assert stats["inline_batches"] == 2
+    assert stats["offloaded_batches"] == 0
+    assert not stats["started"]
+
+
+def test_large_batches_match_inline_scores():
+    rng = random.Random(0)
+    predicted = _texts(rng, 40)
+    expected = _texts(rng, 40)
+    pool = ScoringPool(workers=2, min_work=1, chunks_per_worker=2)
+    try:
+        for method in ("fuzzy", "indel"):
+            scores = asyncio.run(pool.evaluate(predicted, expected, method, 0.3))
+            assert scores == evaluate_batch(predicted, expected, method, 0.3)
+        stats = pool.stats()
+    finally:
+        pool.shutdown()
+    assert stats["offloaded_batches"] == 2
+    assert stats["chunks"] >= 4
+    assert stats["in_flight"] == 0
+    assert stats["worker_cpu_seconds"] > 0
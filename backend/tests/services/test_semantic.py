@@ -0,0 +1,44 @@
+import pytest
+
+from app.services.evaluation import evaluate_batch
+from app.services.semantic import VectorCache, cosine_batch, expected_vectors
+
+
+def test_cosine_ranks_paraphrases_above_unrelated_text():
+    expected = ["the capital of france is paris"] * 3 + [""]
+    predicted = [
+        "Paris is the capital of France",
+        "the capitol of france is pariss",
+        "i like turtles",
+        "",
+    ]
+    scores = evaluate_batch(predicted, expected, "semantic")
+    assert scores[0] > 0.9
+    assert 0.5 < scores[1] < scores[0]
+    assert scores[2] < 0.2
+    assert scores[3] == 1.0
+    assert cosine_batch(["hello"], [""]) == [0.0]
+    assert cosine_batch(["same text"], ["same text"]) == [1.0]
+    with pytest.raises(ValueError):
+        evaluate_batch(["a"], [], "semantic")
+
+
+def test_expected_vectors_are_cached_across_runs():
+    expected = ["answer one", "answer two", "answer one"]
+    expected_vectors.clear()
+    hits = expected_vectors.hits
+    first = cosine_batch(["answer 1", "answer 2", "one"], expected)
+    assert expected_vectors.stats()["entries"] == 2
+    second = cosine_batch(["answer 1", "answer 2", "one"], expected)
+    assert second == first
+    assert expected_vectors.hits == hits + 2
+
+
+def test_vector_cache_evicts_least_recently_used():
+    cache = VectorCache(size=2)
+    cache.get_many(["a b", "c d"])
+    cache.get_many(["a b"])
+    cache.get_many(["e f"])
+    assert cache.stats()["entries"] == 2
+    cache.get_many(["a b"])
+    assert cache.hits == 2
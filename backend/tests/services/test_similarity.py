@@ -0,0 +1,59 @@
+import difflib
+import random
+
+import pytest
+
+from app.services.evaluation import evaluate_batch
+from app.services.similarity import indel_ratio, lcs_length
+
+
+def reference_lcs(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(
+                previous[j] + 1 if x == y else max(previous[j + 1], current[j])
+            )
+        previous = current
+    return previous[-1]
+
+
+def test_lcs_length_matches_dynamic_programming():
+    rng = random.Random(0)
+    for _ in range(300):
+        a = "".join(rng.choices("abcd ", k=rng.randint(0, 120)))
+        b = "".join(rng.choices("abcde", k=rng.randint(0, 120)))
+        assert lcs_length(a, b) == reference_lcs(a, b)
+
+
+def test_indel_ratio_has_difflib_ratio_semantics():
+    pairs = [("hola mundo", "hola mundo"), ("kitten", "sitting"), ("", ""), ("a", "")]
+    for a, b in pairs:
+        assert indel_ratio(a, b) == pytest.approx(
+            difflib.SequenceMatcher(None, a, b).ratio()
+        )
+    # The exact LCS is never below what difflib's heuristic finds
+    rng = random.Random(1)
+    for _ in range(100):
+        a = "".join(rng.choices("ab c", k=rng.randint(1, 400)))
+        b = "".join(rng.choices("ab c", k=rng.randint(1, 400)))
+        assert indel_ratio(a, b) >= difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def test_score_cutoff_zeroes_scores_below_it():
+    rng = random.Random(2)
+    for _ in range(200):
+        a = "".join(rng.choices("abc", k=rng.randint(0, 300)))
+        b = "".join(rng.choices("abcd", k=rng.randint(0, 300)))
+        cutoff = rng.random()
+        score = indel_ratio(a, b)
+        assert indel_ratio(a, b, cutoff) == (score if score >= cutoff else 0.0)
+
+
+def test_evaluate_batch_indel_and_fuzzy_cutoff():
+    predicted = ["The Cat sat", "completely different"]
+    expected = ["the cat sat ", "the cat sat"]
+    assert evaluate_batch(predicted, expected, "indel")[0] == 1.0
+    assert evaluate_batch(predicted, expected, "indel", 0.9) == [1.0, 0.0]
+    assert evaluate_batch(predicted, expected, "fuzzy", 0.9) == [1.0, 0.0]
@@ -0,0 +1,51 @@
+import asyncio
+
+from app.services.single_flight import SingleFlight
+
+
+def test_concurrent_identical_requests_share_one_call():
+    flight = SingleFlight(mode="always", distributed=False)
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def scenario():
+        return await asyncio.gather(*[flight.run("k", upstream) for _ in range(5)])
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["answer"] * 5
+    assert sum(coalesced for _, coalesced in results) == 4
+
+
+def test_errors_are_shared_and_key_is_released():
+    flight = SingleFlight(mode="always", distributed=False)
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        return await asyncio.gather(
+            flight.run("k", failing), flight.run("k", failing), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight._in_flight == {}
+
+
+def test_deterministic_mode_skips_sampled_requests():
+    flight = SingleFlight(mode="deterministic", distributed=False)
+    assert flight.should_use(0.0, None)
+    assert flight.should_use(0.7, 1)
+    assert not flight.should_use(0.7, None)
+
+
+def test_default_mode_keeps_sampled_trials_independent():
+    flight = SingleFlight(distributed=False)
+    assert flight.should_use(0.0, None)
+    assert not flight.should_use(0.7, None)
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from app.services.sketch import QuantileSketch
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(6, 1) for _ in range(20000)]
+    sketch = QuantileSketch(relative_accuracy=0.02)
+    for value in values:
+        sketch.add(value)
+
+    ordered = sorted(values)
+    for q in (0.5, 0.9, 0.95, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.021)
+    assert sketch.mean == pytest.approx(sum(values) / len(values))
+    # Buckets depend on the range of values, not their number
+    assert len(sketch.buckets) < 500
+
+
+def test_merge_and_json_round_trip():
+    first, second = QuantileSketch(), QuantileSketch()
+    for value in range(1, 101):
+        first.add(value)
+    for value in range(101, 201):
+        second.add(value)
+    second.add(0)
+    first.merge(second)
+
+    restored = QuantileSketch.from_json(first.to_json())
+    assert restored.count == 201
+    assert restored.zeros == 1
+    assert restored.max == 200
+    assert restored.quantile(0) == 0.0
+    assert restored.quantile(0.5) == pytest.approx(100, rel=0.02)
+    assert QuantileSketch.from_json(None).quantile(0.5) is None
@@ -0,0 +1,44 @@
+import asyncio
+
+from app.services.llm import call_fake, consume_stream, early_stop_condition
+
+
+async def _pieces(tokens, delay=0.0):
+    for token in tokens:
+        await asyncio.sleep(delay)
+        yield token
+
+
+def test_consume_stream_times_tokens_and_stops_early():
+    stop = early_stop_condition("contains", "Paris")
+    streamed = asyncio.run(
+        consume_stream(
+            _pieces(["The", " capital", " is", " Paris", ",", " France"], 0.001),
+            started=0.0,
+            stop_when=stop,
+        )
+    )
+    assert streamed.text == "The capital is Paris"
+    assert streamed.stopped_early
+    assert streamed.chunks == 4
+    assert streamed.inter_token_ms > 0
+
+
+def test_early_stop_conditions():
+    assert early_stop_condition("fuzzy", "anything") is None
+    exact = early_stop_condition("exact", "yes")
+    assert not exact(" Yes")
+    assert exact("Yes, and")
+    capped = early_stop_condition("fuzzy", "x", max_chars=5)
+    assert not capped("abcd") and capped("abcde")
+
+
+def test_streamed_fake_call_matches_buffered_output(monkeypatch):
+    monkeypatch.setenv("FAKE_LLM_LATENCY", "fixed:0")
+    buffered = asyncio.run(call_fake("hello world", "fake-small", 0, 32, 1))
+    streamed = asyncio.run(
+        call_fake("hello world", "fake-small", 0, 32, 1, stream=True)
+    )
+    assert streamed.text == buffered.text
+    assert streamed.ttft_ms is not None
+    assert not streamed.stopped_early
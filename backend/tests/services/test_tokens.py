@@ -0,0 +1,61 @@
+import pytest
+from fastapi import HTTPException
+
+from app.services import tokens
+from app.services.tokens import (
+    call_cost,
+    count_tokens,
+    enforce_budget,
+    estimate_cost,
+    model_price,
+)
+
+
+def test_longest_prefix_price_and_free_local_models():
+    assert model_price("openai", "gpt-4o-mini-2024-07-18") == (0.15, 0.60)
+    assert model_price("openai", "gpt-4o-2024-08-06") == (2.50, 10.00)
+    assert model_price("ollama", "llama3") == (0.0, 0.0)
+    # Unknown paid models are priced like the most expensive known one
+    assert model_price("openai", "gpt-unknown") == model_price("openai", "gpt-4")
+
+
+def test_call_cost_and_batch_discount():
+    cost = call_cost("openai", "gpt-4o", 1_000_000, 1_000_000)
+    assert cost == pytest.approx(12.5)
+    assert call_cost("openai", "gpt-4o", 1_000_000, 1_000_000, batch=True) == (
+        pytest.approx(6.25)
+    )
+
+
+def test_estimate_counts_prompts_and_assumes_full_output():
+    prompts = ["Translate hello", "Translate goodbye"]
+    estimate = estimate_cost("openai", "gpt-3.5-turbo", prompts, max_tokens=100)
+    assert estimate["calls"] == 2
+    assert estimate["prompt_tokens"] == sum(
+        count_tokens(p, "gpt-3.5-turbo") for p in prompts
+    )
+    assert estimate["max_completion_tokens"] == 200
+
+    enforce_budget(estimate, None)
+    enforce_budget(estimate, estimate["max_cost_usd"])
+    with pytest.raises(HTTPException) as e:
+        enforce_budget(estimate, estimate["max_cost_usd"] / 2)
+    assert e.value.status_code == 400
+
+
+def test_offline_tokenizer_falls_back_to_the_estimate(monkeypatch):
+    class OfflineTiktoken:
+        @staticmethod
+        def encoding_for_model(model):
+            raise OSError("Network is unreachable")
+
+        get_encoding = encoding_for_model
+
+    monkeypatch.setattr(tokens, "tiktoken", OfflineTiktoken)
+    tokens._encoding.cache_clear()
+    try:
+        tokens.load_encodings(["gpt-offline"])
+        assert count_tokens("x" * 40, "gpt-offline") == 10
+    finally:
+        tokens._encoding.cache_clear()
+        count_tokens.cache_clear()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark the "fuzzy" (difflib) and "indel" (bit-parallel) evaluators
+
+Scores pairs of LLM-like outputs at a range of lengths: a reference answer
+against a lightly edited copy of it (similar) and against an unrelated answer
+(dissimilar), with and without a score cutoff.
+
+Usage: python scripts/benchmark_fuzzy.py [--pairs N] [--cutoff 0.8]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+BACKEND_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, os.path.abspath(BACKEND_ROOT))
+
+from app.services.evaluation import evaluate_batch  # noqa: E402
+
+LENGTHS = [100, 500, 1000, 2000, 5000, 10000]
+WORDS = (
+    "the model answer returns a value of for each input when and then this "
+    "that with from user data result error request response output expected "
+    "capital city paris france translate hello world number list summary"
+).split()
+
+
+def make_text(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def edit_text(rng, text, rate=0.1):
+    """Replace, drop or insert about ``rate`` of the words"""
+    words = []
+    for word in text.split():
+        roll = rng.random()
+        if roll < rate / 3:
+            continue
+        if roll < 2 * rate / 3:
+            words.append(rng.choice(WORDS))
+        elif roll < rate:
+            words.extend([word, rng.choice(WORDS)])
+        else:
+            words.append(word)
+    return " ".join(words)
+
+
+def time_method(predicted, expected, method, cutoff=0.0):
+    started = time.perf_counter()
+    scores = evaluate_batch(predicted, expected, method, cutoff)
+    return (time.perf_counter() - started) / len(predicted) * 1000, scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--pairs", type=int, default=20, help="pairs per length")
+    parser.add_argument("--cutoff", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print(f"ms per pair, {args.pairs} pairs per row, cutoff {args.cutoff}")
+    print(
+        f"{'chars':>6} {'pairs':>10} {'fuzzy':>9} {'indel':>9} {'speedup':>8} "
+        f"{'fuzzy+cut':>10} {'indel+cut':>10} {'max diff':>9}"
+    )
+    for length in LENGTHS:
+        expected = [make_text(rng, length) for _ in range(args.pairs)]
+        for kind in ("similar", "dissimilar"):
+            if kind == "similar":
+                predicted = [edit_text(rng, text) for text in expected]
+            else:
+                predicted = [make_text(rng, length) for _ in expected]
+            fuzzy_ms, fuzzy = time_method(predicted, expected, "fuzzy")
+            indel_ms, indel = time_method(predicted, expected, "indel")
+            fuzzy_cut_ms, _ = time_method(predicted, expected, "fuzzy", args.cutoff)
+            indel_cut_ms, _ = time_method(predicted, expected, "indel", args.cutoff)
+            # indel is the exact ratio; difflib's heuristic can only fall short
+            diff = max(i - f for f, i in zip(fuzzy, indel))
+            print(
+                f"{length:>6} {kind:>10} {fuzzy_ms:>9.3f} {indel_ms:>9.3f} "
+                f"{fuzzy_ms / indel_ms:>7.1f}x {fuzzy_cut_ms:>10.3f} "
+                f"{indel_cut_ms:>10.3f} {diff:>9.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()